@@ -0,0 +1,107 @@
+"""
+A local stand-in for the azure oauth2/v2.0/token endpoint, answering
+refresh token grants the way azure_refresh_token expects.
+
+Usage:
+    python -m benchmarks.azure_stub --port 8089 --latency-ms 40
+    AZURE_TOKEN_URL=http://127.0.0.1:8089/tenant/oauth2/v2.0/token gunicorn main:app
+"""
+
+import argparse
+import itertools
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs
+
+from .fakes import Latency
+
+_tokens = itertools.count(1)
+
+
+def make_handler(latency: Latency):
+    class TokenHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode("utf-8"))
+            latency.sleep()
+
+            if not self.path.endswith("/oauth2/v2.0/token"):
+                return self._reply(404, {"error": "not_found"})
+            if form.get("grant_type") != ["refresh_token"]:
+                return self._reply(400, {"error": "unsupported_grant_type"})
+            if form.get("refresh_token", [""])[0] in ("", "invalid"):
+                return self._reply(400, {"error": "invalid_grant"})
+
+            token = next(_tokens)
+            self._reply(
+                200,
+                {
+                    "token_type": "Bearer",
+                    "scope": form.get("scope", [""])[0],
+                    "expires_in": 3599,
+                    "ext_expires_in": 3599,
+                    "access_token": f"stub-access-{token}",
+                    "refresh_token": f"stub-refresh-{token}",
+                },
+            )
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return TokenHandler
+
+
+def start(host: str = "127.0.0.1", port: int = 0, latency: Latency = None):
+    """Starts the stand-in token endpoint on a background thread
+
+    Args:
+        host (str): the interface to listen on
+        port (int): the port to listen on, 0 picks a free port
+        latency (Latency): latency added to every response. Optional.
+
+    Returns:
+        Tuple[ThreadingHTTPServer, str]: the server and its token url
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(latency or Latency()))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/stub-tenant/oauth2/v2.0/token"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in azure token endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer(
+        (args.host, args.port),
+        make_handler(Latency(args.latency_ms, args.jitter_ms)),
+    )
+    server.daemon_threads = True
+    print(
+        f"AZURE_TOKEN_URL=http://{args.host}:{args.port}/stub-tenant/oauth2/v2.0/token",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
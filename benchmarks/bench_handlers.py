@@ -0,0 +1,415 @@
+"""
+Drives every route of create_app through the flask test client on top of
+the fake backends in benchmarks.fakes and reports, per endpoint, the
+throughput, p50/p99 latency and backend calls per request.
+
+Usage:
+    python -m benchmarks.bench_handlers --latency-ms 2 --jitter-ms 1 --out bench.json
+    python -m benchmarks.bench_handlers --compare bench.json
+
+A comparison run exits with status 1 when an endpoint makes more backend
+calls per request than the baseline, or when its p99 latency grew by more
+than --tolerance.
+"""
+
+import argparse
+import base64
+from collections import Counter
+import itertools
+import json
+import logging
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+from biit_server import create_app
+from biit_server.search import index_entry
+from biit_server.summaries import rebuild
+from biit_server.tasks import wait_for_tasks
+
+from .fakes import (
+    FakeAzure,
+    FakeFirestore,
+    FakeStorage,
+    Latency,
+    backend_calls,
+    installed,
+)
+
+COMMUNITY = "bench-community"
+ACCOUNT = "bench@purdue.edu"
+PHOTO = base64.b64encode(b"\xff\xd8\xff" + b"\x00" * 20000).decode("ascii")
+
+
+def _community(name: str, members: int = 50) -> Dict:
+    return {
+        "name": name,
+        "codeofconduct": "Be nice",
+        "Admins": [ACCOUNT],
+        "Members": [f"member{i}@purdue.edu" for i in range(members)],
+        "mpm": 2,
+        "meettype": "in person",
+        "bans": [],
+    }
+
+
+def seed_backends(firestore_client: FakeFirestore, storage_client: FakeStorage) -> None:
+    """Fills the fake backends with the documents the scenarios read"""
+    firestore_client.data.setdefault("communities", {})
+    firestore_client.collection("communities").document(COMMUNITY)._set(
+        _community(COMMUNITY)
+    )
+    firestore_client.collection("accounts").document(ACCOUNT)._set(
+        {"fname": "Bench", "lname": "Mark", "email": ACCOUNT}
+    )
+    storage_client.get_bucket("biit_profiles").blobs["bench.jpg"] = base64.b64decode(
+        PHOTO
+    )
+    firestore_client.collection("community_search").document(COMMUNITY)._set(
+        index_entry(_community(COMMUNITY))
+    )
+    rebuild(firestore_client)
+    firestore_client.backend.calls.clear()
+    storage_client.backend.calls.clear()
+
+
+class Scenario:
+    def __init__(self, name: str, prepare: Callable[[int, FakeFirestore], Dict]):
+        """One endpoint to benchmark
+
+        Args:
+            name (str): "<METHOD> <route>"
+            prepare (Callable): builds the test client arguments of iteration i,
+                                seeding any document it needs. Not timed.
+        """
+        self.name = name
+        self.method, self.path = name.split(" ", 1)
+        self.prepare = prepare
+
+
+def _unique_community(i: int, firestore_client: FakeFirestore) -> str:
+    name = f"{COMMUNITY}-{i}"
+    firestore_client.collection("communities").document(name)._set(_community(name))
+    return name
+
+
+def _unique_account(i: int, firestore_client: FakeFirestore) -> str:
+    email = f"bench{i}@purdue.edu"
+    firestore_client.collection("accounts").document(email)._set(
+        {"fname": "Bench", "lname": str(i), "email": email}
+    )
+    return email
+
+
+SCENARIOS = [
+    Scenario(
+        "POST /account",
+        lambda i, db: {
+            "json": {
+                "fname": "Bench",
+                "lname": "Mark",
+                "email": f"new{i}@purdue.edu",
+                "token": "refresh",
+            }
+        },
+    ),
+    Scenario(
+        "GET /account",
+        lambda i, db: {"query_string": {"email": ACCOUNT, "token": "refresh"}},
+    ),
+    Scenario(
+        "PUT /account",
+        lambda i, db: {
+            "query_string": {"email": ACCOUNT, "token": "refresh"},
+            "json": {"updateFields": {"lname": f"Mark{i}"}},
+        },
+    ),
+    Scenario(
+        "DELETE /account",
+        lambda i, db: {
+            "query_string": {"email": _unique_account(i, db), "token": "refresh"}
+        },
+    ),
+    Scenario(
+        "POST /community",
+        lambda i, db: {
+            "json": dict(_community(f"new-{i}"), token="refresh"),
+        },
+    ),
+    Scenario(
+        "GET /community",
+        lambda i, db: {"query_string": {"name": COMMUNITY, "token": "refresh"}},
+    ),
+    Scenario(
+        "PUT /community",
+        lambda i, db: {
+            "query_string": {
+                "name": COMMUNITY,
+                "email": ACCOUNT,
+                "token": "refresh",
+            },
+            "json": {"updateFields": {"mpm": i % 5}},
+        },
+    ),
+    Scenario(
+        "DELETE /community",
+        lambda i, db: {
+            "query_string": {
+                "name": _unique_community(i, db),
+                "email": ACCOUNT,
+                "token": "refresh",
+            }
+        },
+    ),
+    Scenario(
+        f"POST /community/{COMMUNITY}/join",
+        lambda i, db: {"json": {"email": f"joiner{i}@purdue.edu", "token": "refresh"}},
+    ),
+    Scenario(
+        f"POST /community/{COMMUNITY}/leave",
+        lambda i, db: {"json": {"email": f"joiner{i}@purdue.edu", "token": "refresh"}},
+    ),
+    Scenario(
+        "POST /ban",
+        lambda i, db: {
+            "json": {
+                "banner": ACCOUNT,
+                "bannee": f"member{i % 50}@purdue.edu",
+                "community": COMMUNITY,
+                "token": "refresh",
+            }
+        },
+    ),
+    Scenario(
+        "PUT /ban",
+        lambda i, db: {
+            "query_string": {
+                "banner": ACCOUNT,
+                "bannee": f"member{i % 50}@purdue.edu",
+                "community": COMMUNITY,
+                "token": "refresh",
+            }
+        },
+    ),
+    Scenario(
+        "POST /profile",
+        lambda i, db: {
+            "content_type": "multipart/form-data",
+            "data": {
+                "email": ACCOUNT,
+                "token": "refresh",
+                "file": PHOTO,
+                "filename": f"upload{i % 10}.jpg",
+            },
+        },
+    ),
+    Scenario(
+        "GET /profile",
+        lambda i, db: {
+            "query_string": {
+                "email": ACCOUNT,
+                "token": "refresh",
+                "filename": "bench.jpg",
+            }
+        },
+    ),
+    Scenario(
+        "GET /community/search",
+        lambda i, db: {"query_string": {"q": "bench", "token": "refresh"}},
+    ),
+    Scenario(
+        f"GET /community/{COMMUNITY}/events",
+        # the stream is read to its end, EVENTS_MAX_DURATION is 0 in benchmarks
+        lambda i, db: {"query_string": {"token": "refresh"}, "buffered": True},
+    ),
+    Scenario(
+        "POST /batch",
+        lambda i, db: {
+            "json": {
+                "token": "refresh",
+                "operations": [
+                    {
+                        "method": "GET",
+                        "path": "/community",
+                        "args": {"name": COMMUNITY},
+                    },
+                    {"method": "GET", "path": "/account", "args": {"email": ACCOUNT}},
+                    {
+                        "method": "PUT",
+                        "path": "/account",
+                        "args": {"email": ACCOUNT},
+                        "body": {"updateFields": {"lname": f"Batch{i}"}},
+                    },
+                ],
+            }
+        },
+    ),
+    # after the first probe /warmup answers from its result, without backend calls
+    Scenario("GET /warmup", lambda i, db: {}),
+    Scenario("GET /metrics", lambda i, db: {}),
+]
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(iterations: int = 200, warmup: int = 20, latency_ms=0.0, jitter_ms=0.0, seed=0):
+    """Runs every scenario and collects its results
+
+    Args:
+        iterations (int): timed requests per endpoint
+        warmup (int): untimed requests per endpoint sent first
+        latency_ms (float): base latency of every backend call
+        jitter_ms (float): extra random latency of every backend call
+        seed (int): seed of the jitter
+
+    Returns:
+        Dict: the results of every endpoint, ready to be saved as json
+    """
+    latency = Latency(latency_ms, jitter_ms, seed)
+    firestore_client = FakeFirestore(latency)
+    storage_client = FakeStorage(latency)
+    azure = FakeAzure(latency)
+    fakes = (firestore_client, storage_client, azure)
+
+    app = create_app(
+        {
+            "TESTING": True,
+            "TIMING_LOG": False,
+            "RATELIMIT_ENABLED": False,
+            "EVENTS_MAX_DURATION": 0.0,
+        }
+    )
+    results = {}
+
+    with installed(*fakes), app.test_client() as client:
+        seed_backends(firestore_client, storage_client)
+        counter = itertools.count()
+
+        for scenario in SCENARIOS:
+            send = getattr(client, scenario.method.lower())
+            for _ in range(warmup):
+                send(scenario.path, **scenario.prepare(next(counter), firestore_client))
+
+            durations = []
+            statuses = Counter()
+            calls = Counter()
+            started = time.perf_counter()
+            for _ in range(iterations):
+                kwargs = scenario.prepare(next(counter), firestore_client)
+                before = backend_calls(*fakes)
+                start = time.perf_counter()
+                rv = send(scenario.path, **kwargs)
+                durations.append(time.perf_counter() - start)
+                # deferred work is not latency, but it is a backend call of the request
+                wait_for_tasks()
+                calls.update(backend_calls(*fakes) - before)
+                statuses[str(rv.status_code)] += 1
+            elapsed = time.perf_counter() - started
+
+            results[scenario.name] = {
+                "throughput_rps": round(iterations / elapsed, 1),
+                "p50_ms": round(_percentile(durations, 50) * 1000, 3),
+                "p99_ms": round(_percentile(durations, 99) * 1000, 3),
+                "mean_ms": round(statistics.mean(durations) * 1000, 3),
+                "statuses": dict(statuses),
+                "calls_per_request": {
+                    op: round(count / iterations, 3)
+                    for op, count in sorted(calls.items())
+                },
+            }
+
+    return {
+        "config": {
+            "iterations": iterations,
+            "warmup": warmup,
+            "latency_ms": latency_ms,
+            "jitter_ms": jitter_ms,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float = 0.25) -> List[str]:
+    """Lists the regressions of a run against a baseline
+
+    Args:
+        baseline (Dict): results of the baseline run
+        current (Dict): results of the new run
+        tolerance (float): allowed relative growth of p99 latency, negative disables the check
+
+    Returns:
+        List[str]: a description of each regression, empty when there are none
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+
+        for op, count in result["calls_per_request"].items():
+            base_count = base["calls_per_request"].get(op, 0)
+            if count > base_count + 1e-9:
+                regressions.append(
+                    f"{name}: {op} calls per request went from {base_count} to {count}"
+                )
+
+        if tolerance >= 0 and result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p99 went from {base['p99_ms']}ms to {result['p99_ms']}ms"
+            )
+    return regressions
+
+
+def _print_table(report: Dict) -> None:
+    print(
+        f"{'endpoint':40} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9}  backend calls/request"
+    )
+    for name, result in report["results"].items():
+        calls = ", ".join(
+            f"{op}={n:g}" for op, n in result["calls_per_request"].items()
+        )
+        print(
+            f"{name:40} {result['throughput_rps']:>9} {result['p50_ms']:>9} "
+            f"{result['p99_ms']:>9}  {calls}"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results to this json file")
+    parser.add_argument("--compare", help="baseline json file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    report = run(
+        args.iterations, args.warmup, args.latency_ms, args.jitter_ms, args.seed
+    )
+    _print_table(report)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Measures cold start: each sample runs a fresh interpreter that imports
+main, builds the app and serves its first requests, the way a new Cloud
+Run instance does. Reports the median import time, time to the first
+response and which heavy SDKs were loaded by the import alone.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 10 --out startup.json
+    python -m benchmarks.bench_startup --compare startup.json
+
+A comparison run exits with status 1 when an SDK is loaded at import time
+that the baseline did not load, or when a median grew by more than
+--tolerance.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+HEAVY_MODULES = [
+    "google.cloud.firestore",
+    "google.cloud.storage",
+    "google.cloud.logging",
+    "grpc",
+    "requests",
+]
+"""
+Modules that should only load once a backend is first used
+"""
+
+TIMINGS = ("import_ms", "first_response_ms", "first_backend_response_ms", "ready_ms")
+
+_SAMPLE = """
+import json, sys, time
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+heavy = [m for m in HEAVY_MODULES if m in sys.modules]
+
+from benchmarks.fakes import FakeAzure, FakeFirestore, FakeStorage, installed
+
+client = main.app.test_client()
+before = time.perf_counter()
+client.get("/metrics")
+first_response = time.perf_counter()
+
+firestore_client = FakeFirestore()
+firestore_client.collection("communities").document("warm")._set({"name": "warm"})
+with installed(firestore_client, FakeStorage(), FakeAzure()):
+    before_backend = time.perf_counter()
+    client.get("/community", query_string={"name": "warm", "token": "refresh"})
+    first_backend_response = time.perf_counter()
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (first_response - before) * 1000,
+    "first_backend_response_ms": (first_backend_response - before_backend) * 1000,
+    "ready_ms": (first_response - start) * 1000,
+    "heavy_modules": heavy,
+}))
+"""
+
+
+def sample() -> Dict:
+    """Runs one cold start in a fresh interpreter
+
+    Returns:
+        Dict: the timings of the start and the heavy modules loaded by the import
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, RATELIMIT_ENABLED="0")
+    env.pop("STAGE", None)
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n" + _SAMPLE
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=root,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs: int = 5) -> Dict:
+    """Measures several cold starts
+
+    Args:
+        runs (int): how many fresh interpreters to start
+
+    Returns:
+        Dict: the median of each timing, and every heavy module loaded at import
+    """
+    samples = [sample() for _ in range(runs)]
+    report = {
+        "runs": runs,
+        "heavy_modules": sorted(
+            {module for s in samples for module in s["heavy_modules"]}
+        ),
+    }
+    for key in TIMINGS:
+        report[key] = round(statistics.median(s[key] for s in samples), 2)
+    return report
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float = 0.25) -> List[str]:
+    """Lists the regressions of a run against a baseline
+
+    Args:
+        baseline (Dict): results of the baseline run
+        current (Dict): results of the new run
+        tolerance (float): allowed relative growth of each median, negative disables the check
+
+    Returns:
+        List[str]: a description of each regression, empty when there are none
+    """
+    regressions = [
+        f"{module} is now loaded at import"
+        for module in current["heavy_modules"]
+        if module not in baseline["heavy_modules"]
+    ]
+    if tolerance >= 0:
+        for key in ("import_ms", "ready_ms"):
+            if current[key] > baseline[key] * (1 + tolerance):
+                regressions.append(
+                    f"{key} went from {baseline[key]}ms to {current[key]}ms"
+                )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", help="write the results to this json file")
+    parser.add_argument("--compare", help="baseline json file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    report = run(args.runs)
+    for key in TIMINGS:
+        print(f"{key:28} {report[key]:>9}")
+    print(f"{'heavy modules at import':28} {', '.join(report['heavy_modules']) or '-'}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
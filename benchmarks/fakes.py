@@ -0,0 +1,441 @@
+"""
+In-memory stand-ins for Firestore, Cloud Storage and the Azure token
+endpoint. Every backend call sleeps for a configurable latency and is
+counted, so benchmarks can report backend calls per request.
+"""
+
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+import itertools
+import random
+from threading import Lock
+import time
+from unittest.mock import patch
+
+from biit_server import clients
+
+
+class Latency:
+    def __init__(self, base_ms: float = 0.0, jitter_ms: float = 0.0, seed=None):
+        """Latency injected into every backend call
+
+        Args:
+            base_ms (float): the minimum latency of a call
+            jitter_ms (float): random extra latency, uniform between 0 and jitter_ms
+            seed: seed of the jitter, for repeatable runs. Optional.
+        """
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+
+    def sleep(self) -> None:
+        delay = self.base_ms + self._random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+class Backend:
+    def __init__(self, name: str, latency: Latency = None):
+        """Shared latency and call counting of one fake backend"""
+        self.name = name
+        self.latency = latency or Latency()
+        self.calls = Counter()
+        self._lock = Lock()
+
+    def call(self, op: str) -> None:
+        with self._lock:
+            self.calls[f"{self.name}.{op}"] += 1
+        self.latency.sleep()
+
+
+_clock = itertools.count(1)
+
+
+def _now():
+    return datetime(2020, 1, 1, tzinfo=timezone.utc) + timedelta(
+        microseconds=next(_clock)
+    )
+
+
+class NotFound(Exception):
+    """Raised when updating a document that does not exist"""
+
+
+class AlreadyExists(Exception):
+    """Raised when adding a document that already exists"""
+
+
+def _apply(current, data):
+    """Writes fields into a document, applying transforms such as Increment"""
+    for key, value in data.items():
+        transform = type(value).__name__
+        if transform == "Increment":
+            current[key] = current.get(key, 0) + value.value
+        elif transform == "ArrayUnion":
+            current[key] = current.get(key, []) + [
+                v for v in value.values if v not in current.get(key, [])
+            ]
+        elif transform == "ArrayRemove":
+            current[key] = [v for v in current.get(key, []) if v not in value.values]
+        else:
+            current[key] = deepcopy(value)
+    return current
+
+
+class FakeWriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+        self.exists = data is not None
+
+    def to_dict(self):
+        return deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data[field]
+
+
+class FakeDocument:
+    def __init__(self, parent, id):
+        self.parent = parent
+        self.id = id
+        self.path = f"{parent.name}/{id}"
+
+    def _store(self):
+        return self.parent.store
+
+    def get(self, field_paths=None, **kwargs):
+        self.parent.backend.call("get")
+        return self._snapshot(field_paths)
+
+    def _snapshot(self, field_paths=None):
+        entry = self._store().get(self.id)
+        if entry is None:
+            return FakeSnapshot(self, None, None)
+        data, update_time = entry
+        if field_paths is not None:
+            data = {k: v for k, v in data.items() if k in field_paths}
+        return FakeSnapshot(self, deepcopy(data), update_time)
+
+    def _set(self, data, merge=False):
+        store = self._store()
+        if merge:
+            current = dict(store[self.id][0]) if self.id in store else {}
+            data = _apply(current, data)
+        update_time = _now()
+        store[self.id] = (deepcopy(data), update_time)
+        return update_time
+
+    def _update(self, data):
+        store = self._store()
+        if self.id not in store:
+            raise NotFound(self.path)
+        current = _apply(dict(store[self.id][0]), data)
+        update_time = _now()
+        store[self.id] = (current, update_time)
+        return update_time
+
+    def set(self, data, merge=False, **kwargs):
+        self.parent.backend.call("set")
+        return FakeWriteResult(self._set(data, merge))
+
+    def update(self, data, **kwargs):
+        self.parent.backend.call("update")
+        return FakeWriteResult(self._update(data))
+
+    def delete(self, **kwargs):
+        self.parent.backend.call("delete")
+        self._store().pop(self.id, None)
+        return _now()
+
+    def collection(self, name):
+        return self.parent.client.collection(f"{self.path}/{name}")
+
+    def on_snapshot(self, callback):
+        """Starts a listener, which only delivers the current snapshot"""
+        self.parent.backend.call("listen")
+        callback([self._snapshot()], [], _now())
+        return FakeWatch(self.parent.backend)
+
+
+class FakeWatch:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def unsubscribe(self):
+        self.backend.call("unlisten")
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), orders=(), limit=None, start_after=None):
+        self.collection = collection
+        self.filters = list(filters)
+        self.orders = list(orders)
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        args = dict(
+            filters=self.filters,
+            orders=self.orders,
+            limit=self._limit,
+            start_after=self._start_after,
+        )
+        args.update(changes)
+        return FakeQuery(self.collection, **args)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self.filters + [(field, op, value)])
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(orders=self.orders + [(field, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        return self._copy(start_after=values)
+
+    def _matches(self, data):
+        for field, op, value in self.filters:
+            current = data.get(field)
+            if op == "==" and current != value:
+                return False
+            if op == ">=" and not (current is not None and current >= value):
+                return False
+            if op == "<=" and not (current is not None and current <= value):
+                return False
+            if op == "array_contains" and value not in (current or []):
+                return False
+        return True
+
+    def stream(self, **kwargs):
+        self.collection.backend.call("query")
+        rows = [
+            (id, data, update_time)
+            for id, (data, update_time) in list(self.collection.store.items())
+            if self._matches(data)
+        ]
+        for field, direction in reversed(self.orders):
+            rows.sort(
+                key=lambda row: row[1].get(field), reverse=direction == "DESCENDING"
+            )
+        if self._start_after is not None and self.orders:
+            field = self.orders[0][0]
+            cursor = self._start_after.get(field)
+            rows = [row for row in rows if row[1].get(field) > cursor]
+        if self._limit is not None:
+            rows = rows[: self._limit]
+        for id, data, update_time in rows:
+            yield FakeSnapshot(
+                self.collection.document(id), deepcopy(data), update_time
+            )
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(self)
+        self.client = client
+        self.name = name
+        self.backend = client.backend
+        self.store = client.data.setdefault(name, {})
+
+    def document(self, id):
+        return FakeDocument(self, id)
+
+    def add(self, data, document_id=None, **kwargs):
+        self.backend.call("add")
+        document_id = document_id or f"auto{next(_clock)}"
+        if document_id in self.store:
+            raise AlreadyExists(f"{self.name}/{document_id}")
+        self.store[document_id] = (deepcopy(data), _now())
+        return _now(), self.document(document_id)
+
+
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.writes = []
+
+    def create(self, reference, data):
+        self.writes.append(("create", reference, data))
+
+    def set(self, reference, data, merge=False):
+        self.writes.append(("set", reference, (data, merge)))
+
+    def update(self, reference, data):
+        self.writes.append(("update", reference, data))
+
+    def delete(self, reference):
+        self.writes.append(("delete", reference, None))
+
+    def commit(self, **kwargs):
+        self.client.backend.call("commit")
+        with self.client._lock:
+            return self._apply()
+
+    def _apply(self):
+        for op, reference, data in self.writes:
+            if op == "update" and reference.id not in reference._store():
+                raise NotFound(reference.path)
+            if op == "create" and reference.id in reference._store():
+                raise AlreadyExists(reference.path)
+        results = []
+        for op, reference, data in self.writes:
+            if op == "create":
+                update_time = reference._set(data)
+            elif op == "set":
+                update_time = reference._set(*data)
+            elif op == "update":
+                update_time = reference._update(data)
+            else:
+                reference._store().pop(reference.id, None)
+                update_time = _now()
+            results.append(FakeWriteResult(update_time))
+        return results
+
+
+class FakeFirestore:
+    def __init__(self, latency: Latency = None):
+        """An in-memory Firestore client implementing what Database uses
+
+        Args:
+            latency (Latency): latency injected into every call. Optional.
+        """
+        self.backend = Backend("firestore", latency)
+        self.data = {}
+        self._lock = Lock()
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def get_all(self, references, field_paths=None, **kwargs):
+        self.backend.call("get_all")
+        for reference in references:
+            yield reference._snapshot(field_paths)
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, **kwargs):
+        self.bucket.backend.call("upload")
+        self.bucket.blobs[self.name] = (
+            data if isinstance(data, bytes) else data.encode()
+        )
+
+    def download_as_string(self, **kwargs):
+        self.bucket.backend.call("download")
+        return self.bucket.blobs[self.name]
+
+    def delete(self, **kwargs):
+        self.bucket.backend.call("delete")
+        self.bucket.blobs.pop(self.name, None)
+
+
+class FakeBucket:
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        self.blobs = {}
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name, **kwargs):
+        self.backend.call("get_blob")
+        return FakeBlob(self, name) if name in self.blobs else None
+
+
+class FakeStorage:
+    def __init__(self, latency: Latency = None):
+        """An in-memory Cloud Storage client implementing what Storage uses
+
+        Args:
+            latency (Latency): latency injected into every call. Optional.
+        """
+        self.backend = Backend("gcs", latency)
+        self.buckets = {}
+
+    def get_bucket(self, name, **kwargs):
+        self.backend.call("get_bucket")
+        return self.buckets.setdefault(name, FakeBucket(self.backend, name))
+
+
+class FakeTokenResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self._payload = payload
+
+    def json(self):
+        return self._payload
+
+
+class FakeAzure:
+    def __init__(self, latency: Latency = None):
+        """Answers token refreshes the way the azure oauth2/v2.0/token endpoint does
+
+        Args:
+            latency (Latency): latency injected into every call. Optional.
+        """
+        self.backend = Backend("azure", latency)
+
+    def head(self, url, **kwargs):
+        # the warm up opens the connection with a HEAD, azure refuses the method
+        self.backend.call("head")
+        return FakeTokenResponse(405, {})
+
+    def request(self, method, url, headers=None, data=None, **kwargs):
+        self.backend.call("token")
+        if "refresh_token=invalid" in (data or ""):
+            return FakeTokenResponse(400, {"error": "invalid_grant"})
+        return FakeTokenResponse(
+            200,
+            {
+                "token_type": "Bearer",
+                "access_token": f"access-{next(_clock)}",
+                "refresh_token": f"refresh-{next(_clock)}",
+                "expires_in": 3600,
+            },
+        )
+
+
+def backend_calls(*fakes) -> Counter:
+    """Adds up the calls made to the given fakes"""
+    calls = Counter()
+    for fake in fakes:
+        calls.update(fake.backend.calls)
+    return calls
+
+
+@contextmanager
+def installed(firestore_client, storage_client, azure=None):
+    """Makes Database, Storage and azure_refresh_token use the given fakes
+
+    Args:
+        firestore_client (FakeFirestore): the fake Firestore
+        storage_client (FakeStorage): the fake Cloud Storage
+        azure (FakeAzure): the fake Azure token endpoint. Optional, when
+                           missing azure_refresh_token calls TOKEN_URL.
+    """
+    fakes = {"firestore": firestore_client, "storage": storage_client}
+    with ExitStack() as stack:
+        if azure is not None:
+            fakes["http"] = azure
+            stack.enter_context(patch.dict("os.environ", {"STAGE": "bench"}))
+        stack.enter_context(clients.installed(**fakes))
+        yield
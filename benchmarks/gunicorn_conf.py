@@ -0,0 +1,35 @@
+"""
+Gunicorn config for load tests of the real main:app.
+
+With BIIT_FAKE_BACKENDS=1 every worker swaps Firestore and Cloud Storage
+for the in-memory fakes, seeded with the load test data. Without it the
+workers use the real clients, which honour FIRESTORE_EMULATOR_HOST and
+STORAGE_EMULATOR_HOST. Azure calls go to AZURE_TOKEN_URL either way.
+
+Usage:
+    gunicorn -c benchmarks/gunicorn_conf.py --workers 2 --threads 8 main:app
+"""
+
+from contextlib import ExitStack
+import os
+
+bind = os.getenv("BIIT_BIND", "127.0.0.1:8088")
+accesslog = None
+_backends = ExitStack()
+
+
+def post_worker_init(worker):
+    if os.getenv("BIIT_FAKE_BACKENDS") != "1":
+        return
+
+    from benchmarks.fakes import FakeFirestore, FakeStorage, Latency, installed
+    from benchmarks.loadtest import seed_backends
+
+    latency = Latency(
+        float(os.getenv("BIIT_FAKE_LATENCY_MS", "0")),
+        float(os.getenv("BIIT_FAKE_JITTER_MS", "0")),
+    )
+    firestore_client = FakeFirestore(latency)
+    storage_client = FakeStorage(latency)
+    seed_backends(firestore_client, storage_client)
+    _backends.enter_context(installed(firestore_client, storage_client))
@@ -0,0 +1,320 @@
+"""
+Load test harness. Starts the stand-in azure token endpoint, runs the real
+main:app under gunicorn with in-memory Firestore and Cloud Storage, and
+replays a mix of join, leave, get, ban and profile calls at increasing
+target rates to find the saturation throughput of each worker/thread
+configuration.
+
+Usage:
+    python -m benchmarks.loadtest --configs 1x8,2x4 --rates 50,100,200,400
+"""
+
+import argparse
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import random
+import subprocess
+import sys
+from threading import Lock, local
+import time
+from typing import Dict, List
+
+import requests
+
+from . import azure_stub
+from .fakes import Latency
+
+COMMUNITIES = 20
+MEMBERS = 200
+PHOTO = base64.b64encode(b"\xff\xd8\xff" + b"\x00" * 20000).decode("ascii")
+
+MIX = [
+    ("community_get", 35),
+    ("account_get", 10),
+    ("join", 20),
+    ("leave", 18),
+    ("ban", 5),
+    ("profile_get", 8),
+    ("profile_post", 4),
+]
+"""
+The operations replayed and their relative weight
+"""
+
+
+def _community(i: int) -> Dict:
+    return {
+        "name": f"load-{i}",
+        "codeofconduct": "Be nice",
+        "Admins": ["admin@purdue.edu"],
+        "Members": [f"member{m}@purdue.edu" for m in range(MEMBERS)],
+        "mpm": 2,
+        "meettype": "in person",
+        "bans": [],
+    }
+
+
+def seed_backends(firestore_client, storage_client) -> None:
+    """Fills fake backends with the communities, accounts and photos the mix uses"""
+    for i in range(COMMUNITIES):
+        firestore_client.collection("communities").document(f"load-{i}")._set(
+            _community(i)
+        )
+    for m in range(MEMBERS):
+        email = f"member{m}@purdue.edu"
+        firestore_client.collection("accounts").document(email)._set(
+            {"fname": "Load", "lname": str(m), "email": email}
+        )
+    storage_client.get_bucket("biit_profiles").blobs["load.jpg"] = base64.b64decode(
+        PHOTO
+    )
+
+
+def make_request(op: str, rng: random.Random):
+    """Builds one request of the mix
+
+    Returns:
+        Tuple[str, str, Dict]: method, path and keyword arguments for requests
+    """
+    community = f"load-{rng.randrange(COMMUNITIES)}"
+    member = f"member{rng.randrange(MEMBERS)}@purdue.edu"
+    visitor = f"visitor{rng.randrange(10 ** 9)}@purdue.edu"
+    token = "load-refresh"
+
+    if op == "community_get":
+        return "GET", "/community", {"params": {"name": community, "token": token}}
+    if op == "account_get":
+        return "GET", "/account", {"params": {"email": member, "token": token}}
+    if op == "join":
+        body = {"email": visitor, "token": token}
+        return "POST", f"/community/{community}/join", {"json": body}
+    if op == "leave":
+        body = {"email": member, "token": token}
+        return "POST", f"/community/{community}/leave", {"json": body}
+    if op == "ban":
+        body = {
+            "banner": "admin@purdue.edu",
+            "bannee": member,
+            "community": community,
+            "token": token,
+        }
+        return "POST", "/ban", {"json": body}
+    if op == "profile_get":
+        params = {"email": member, "token": token, "filename": "load.jpg"}
+        return "GET", "/profile", {"params": params}
+    if op == "profile_post":
+        form = {
+            "email": member,
+            "token": token,
+            "file": PHOTO,
+            "filename": "load.jpg",
+        }
+        return "POST", "/profile", {"data": form}
+    raise ValueError(op)
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(percentile / 100 * len(ordered)))]
+
+
+def generate(base_url: str, rate: float, duration: float, concurrency: int, seed=None):
+    """Replays the mix open loop at a target rate
+
+    Latency is measured from when each request was scheduled, so time
+    spent waiting for a free client thread counts against the server.
+
+    Args:
+        base_url (str): where the app is listening
+        rate (float): target requests per second
+        duration (float): seconds to send for
+        concurrency (int): client threads
+        seed (int): seed of the mix. Optional, every call replays a new mix
+                    when not set so joins never repeat an earlier visitor
+
+    Returns:
+        Dict: achieved throughput, error rate and latency percentiles
+    """
+    rng = random.Random(seed)
+    ops = [op for op, _ in MIX]
+    weights = [weight for _, weight in MIX]
+    sessions = local()
+    lock = Lock()
+    latencies = {op: [] for op in ops}
+    errors = [0]
+
+    def send(op, scheduled, method, path, kwargs):
+        session = getattr(sessions, "session", None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        try:
+            ok = session.request(method, base_url + path, timeout=30, **kwargs).ok
+        except requests.RequestException:
+            ok = False
+        finished = time.perf_counter()
+        with lock:
+            latencies[op].append(finished - scheduled)
+            if not ok:
+                errors[0] += 1
+        return finished
+
+    total = int(rate * duration)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        futures = []
+        for i in range(total):
+            scheduled = start + i / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            op = rng.choices(ops, weights)[0]
+            futures.append(pool.submit(send, op, scheduled, *make_request(op, rng)))
+        last = max(future.result() for future in futures)
+
+    every = [sample for samples in latencies.values() for sample in samples]
+    return {
+        "target_rps": rate,
+        "achieved_rps": round(total / (last - start), 1),
+        "error_rate": round(errors[0] / max(total, 1), 4),
+        "p50_ms": round(_percentile(every, 50) * 1000, 1),
+        "p99_ms": round(_percentile(every, 99) * 1000, 1),
+        "p99_ms_by_op": {
+            op: round(_percentile(samples, 99) * 1000, 1)
+            for op, samples in latencies.items()
+        },
+    }
+
+
+def _wait_ready(base_url: str, process, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            if requests.get(base_url + "/metrics", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready")
+
+
+def run_config(workers: int, threads: int, rates, args, token_url: str) -> Dict:
+    """Starts gunicorn with one worker/thread configuration and ramps the rate
+
+    Returns:
+        Dict: every step of the ramp and the saturation throughput
+    """
+    port = args.port
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        BIIT_FAKE_BACKENDS="1",
+        BIIT_FAKE_LATENCY_MS=str(args.backend_latency_ms),
+        BIIT_FAKE_JITTER_MS=str(args.backend_jitter_ms),
+        BIIT_BIND=f"127.0.0.1:{port}",
+        AZURE_TOKEN_URL=token_url,
+        RATELIMIT_ENABLED="0",
+    )
+    env.pop("STAGE", None)
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-c",
+            os.path.join(os.path.dirname(__file__), "gunicorn_conf.py"),
+            "--workers",
+            str(workers),
+            "--threads",
+            str(threads),
+            "main:app",
+        ],
+        env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+    steps = []
+    try:
+        _wait_ready(base_url, process)
+        for rate in rates:
+            step = generate(base_url, rate, args.step_seconds, args.concurrency)
+            steps.append(step)
+            print(
+                f"  {workers}x{threads} target={rate:>6} achieved={step['achieved_rps']:>7} "
+                f"p50={step['p50_ms']:>7}ms p99={step['p99_ms']:>7}ms "
+                f"errors={step['error_rate']:.2%}",
+                flush=True,
+            )
+            if not _sustained(step, args.slo_ms):
+                break
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    sustained = [step for step in steps if _sustained(step, args.slo_ms)]
+    best = max(sustained, key=lambda step: step["achieved_rps"], default=None)
+    return {
+        "workers": workers,
+        "threads": threads,
+        "saturation_rps": best["achieved_rps"] if best else 0.0,
+        "p99_ms_at_saturation": best["p99_ms"] if best else None,
+        "steps": steps,
+    }
+
+
+def _sustained(step: Dict, slo_ms: float) -> bool:
+    return (
+        step["achieved_rps"] >= 0.95 * step["target_rps"]
+        and step["error_rate"] < 0.01
+        and step["p99_ms"] <= slo_ms
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--configs", default="1x8", help="workers x threads, comma separated"
+    )
+    parser.add_argument("--rates", default="25,50,100,200,400", help="target rps steps")
+    parser.add_argument("--step-seconds", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--slo-ms", type=float, default=500.0)
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--azure-latency-ms", type=float, default=40.0)
+    parser.add_argument("--backend-latency-ms", type=float, default=5.0)
+    parser.add_argument("--backend-jitter-ms", type=float, default=5.0)
+    parser.add_argument("--out", help="write the report to this json file")
+    args = parser.parse_args(argv)
+
+    rates = [float(rate) for rate in args.rates.split(",")]
+    server, token_url = azure_stub.start(latency=Latency(args.azure_latency_ms))
+
+    report = []
+    try:
+        for config in args.configs.split(","):
+            workers, threads = (int(n) for n in config.lower().split("x"))
+            report.append(run_config(workers, threads, rates, args, token_url))
+    finally:
+        server.shutdown()
+
+    print(f"\n{'config':>8} {'saturation rps':>15} {'p99 ms':>8}")
+    for result in report:
+        config = f"{result['workers']}x{result['threads']}"
+        print(
+            f"{config:>8} {result['saturation_rps']:>15} "
+            f"{result['p99_ms_at_saturation']!s:>8}"
+        )
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,50 @@
-import ast
-
-from .http_responses import http200, http400, jsonHttp200
-from .query_helper import validate_body, validate_query_params, validate_photo
+from .http_responses import http200, http304, http400, jsonHttp200, document_etag
+from .query_helper import validate_photo
 from .azure import azure_refresh_token
 from .database import Database
+from .schema import Field, Schema, email, query, token
 from .storage import Storage
+from .tasks import defer
 from flask import send_file
 import base64
 
+ACCOUNT_POST = Schema(
+    Field("fname", max_length=100),
+    Field("lname", max_length=100),
+    email(),
+    token(),
+)
+
+ACCOUNT_GET = query(email(), token())
+
+ACCOUNT_UPDATE = Schema(
+    Field("fname", required=False, max_length=100),
+    Field("lname", required=False, max_length=100),
+    allow_extra=False,
+)
+"""
+The fields of an account that can be changed with a PUT
+"""
+
+ACCOUNT_PUT = query(email(), token())
+
+ACCOUNT_PUT_BODY = Schema(
+    Field("updateFields", dict, min_items=1, items=ACCOUNT_UPDATE),
+    allow_extra=False,
+)
+
+ACCOUNT_DELETE = query(email(), token())
+
+PROFILE_POST = Schema(
+    email(),
+    token(),
+    Field("file", max_length=8 * 1024 * 1024),
+    Field("filename", max_length=256),
+    max_bytes=8 * 1024 * 1024 + 16 * 1024,
+)
+
+PROFILE_GET = query(email(), token(), Field("filename", max_length=256))
+
 
 def account_post(request):
     """Handles the account POST endpoint
@@ -22,15 +59,7 @@ def account_post(request):
     Raises:
         Http 400 when the json is missing a key
     """
-    fields = ["fname", "lname", "email", "token"]
-    body = None
-
-    try:
-        body = request.get_json()
-    except:
-        return http400("Missing body")
-
-    body_validation = validate_body(body, fields)
+    body, body_validation = ACCOUNT_POST.load_json(request)
     # check that body validation succeeded
     if body_validation[1] != 200:
         return body_validation
@@ -72,16 +101,13 @@ def account_get(request):
 
     Returns:
         (json) Http 200 string response with the associated account information
+        and a weak ETag of the document, or Http 304 if it matches the If-None-Match header,
+        with the refresh token and new token in its X-Access-Token and X-Refresh-Token headers
 
     Raises:
         Http 400 when the json is missing a key
     """
-    fields = ["email", "token"]
-
-    # serializes the quert string to a dict (neeto)
-    args = request.args
-
-    query_validation = validate_query_params(args, fields)
+    args, query_validation = ACCOUNT_GET.load_args(request)
     # check that body validation succeeded
     if query_validation[1] != 200:
         return query_validation
@@ -92,41 +118,57 @@ def account_get(request):
 
     account_db = Database("accounts")
 
+    # answer polls of an unchanged account without reading it
+    if request.if_none_match:
+        update_time = account_db.update_time(args["email"])
+        if update_time is not None and request.if_none_match.contains_weak(
+            document_etag("accounts", args["email"], update_time)
+        ):
+            return http304(auth[0], auth[1])
+
     try:
+        account = account_db.get(args["email"])
         response = {
             "access_token": auth[0],
             "refresh_token": auth[1],
-            "data": account_db.get(args["email"]).to_dict(),
+            "data": account.to_dict(),
         }
-        return jsonHttp200("Account returned", response)
+        response = jsonHttp200("Account returned", response)
     except:
         return http400("Account not found")
 
+    update_time = getattr(account, "update_time", None)
+    if update_time is not None:
+        response.set_etag(
+            document_etag("accounts", args["email"], update_time), weak=True
+        )
+    return response
+
 
 def account_put(request):
     """Handles the account POST endpoint
     Validates data sent in a request then calls the database to edit the row of the account
 
     Args:
-        request: A request object that contains args with keys: email, token, and (any account values to be changed)
+        request: A request object that contains args with keys: email, token
+                 and a json object with key updateFields holding the account values to be changed
 
     Returns:
         (json): Http 200 string response with refresh token and new token
 
     Raises:
-        Http 400 when the json is missing required keys: email, token
-        or if the token is not valid
+        Http 400 when the json is missing required keys: email, token, updateFields,
+        updateFields has a field that cannot be changed, or if the token is not valid
     """
-    fields = ["email", "token", "updateFields"]
-
-    # serializes the quert string to a dict (neeto)
-    args = request.args
-
-    query_validation = validate_query_params(args, fields)
+    args, query_validation = ACCOUNT_PUT.load_args(request)
     # check that body validation succeeded
     if query_validation[1] != 200:
         return query_validation
 
+    body, body_validation = ACCOUNT_PUT_BODY.load_json(request)
+    if body_validation[1] != 200:
+        return body_validation
+
     auth = azure_refresh_token(args["token"])
     if not auth[0]:
         return http400("Not Authenticated")
@@ -135,7 +177,7 @@ def account_put(request):
     account_db = Database("accounts")
 
     try:
-        account_db.update(args["email"], ast.literal_eval(args["updateFields"]))
+        account_db.update(args["email"], body["updateFields"])
         response = {
             "access_token": auth[0],
             "refresh_token": auth[1],
@@ -161,12 +203,7 @@ def account_delete(request):
         Http 400 when the json is missing required keys: email, token
         or if the token is not valid
     """
-    fields = ["email", "token"]
-
-    # serializes the quert string to a dict (neeto)
-    args = request.args
-
-    query_validation = validate_query_params(args, fields)
+    args, query_validation = ACCOUNT_DELETE.load_args(request)
     # check that body validation succeeded
     if query_validation[1] != 200:
         return query_validation
@@ -179,7 +216,8 @@ def account_delete(request):
     storage = Storage("biit_profiles")
     try:
         account_db.delete(args["email"])
-        storage.delete(args["email"] + ".jpg")
+        # the client does not wait for the photo to be removed
+        defer(storage.delete, args["email"] + ".jpg")
         return http200("Account deleted")
     except:
         return http400("Error in account deletion")
@@ -198,15 +236,7 @@ def profile_post(request):
     Raises:
         Http 400 when the json is missing a key
     """
-    fields = ["email", "token", "file", "filename"]
-    body = None
-
-    try:
-        body = request.form
-    except:
-        return http400("Missing body")
-
-    body_validation = validate_body(body, fields)
+    body, body_validation = PROFILE_POST.load_form(request)
 
     # check that body validation succeeded
     if body_validation[1] != 200:
@@ -243,17 +273,14 @@ def profile_get(request):
     Raises:
         Http 400 when the json is missing a key or the fils is not found
     """
-    fields = ["email", "token", "filename"]
+    args, query_validation = PROFILE_GET.load_args(request)
+    # check that body validation succeeded
+    if query_validation[1] != 200 or not validate_photo(args["filename"]):
+        return query_validation
 
-    # serializes the quert string to a dict (neeto)
-    args = request.args
     auth = azure_refresh_token(args["token"])
     if not auth[0]:
         return http400("Not Authenticated")
-    query_validation = validate_query_params(args, fields)
-    # check that body validation succeeded
-    if query_validation[1] != 200 or not validate_photo(args["filename"]):
-        return query_validation
 
     profile_storage = Storage("biit_profiles")
 
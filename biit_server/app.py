@@ -9,6 +9,7 @@ from .account_handler import (
     profile_post,
 )
 from .ban_handler import ban_post, ban_put
+from .batch_handler import batch_post
 from .community_handler import (
     community_delete,
     community_get,
@@ -16,11 +17,48 @@ from .community_handler import (
     community_put,
     community_join_post,
     community_leave_post,
+    community_events_get,
+    community_search_get,
 )
+from .compression import init_compression
+from .deadline import init_deadlines
+from .events import init_events
+from .metrics import init_metrics
+from .profiler import init_profiler
+from .ratelimit import init_ratelimit
+from .timing import init_timing
+from .warmup import init_warmup
+
+MAX_CONTENT_LENGTH = 9 * 1024 * 1024
+"""
+The largest body any endpoint accepts, a profile picture upload. Each
+endpoint refuses bodies larger than its own schema allows.
+"""
+
 
 # This runs on Firebase/Cloud Run!
-def create_app():
+def create_app(config=None):
+    """Builds the flask app serving every endpoint
+
+    Args:
+        config (Dict[str, Any]): config values overriding the defaults. Optional.
+
+    Returns:
+        flask.Flask: the configured app
+    """
     app = Flask(__name__)
+    app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
+    if config:
+        app.config.update(config)
+
+    init_profiler(app)
+    init_metrics(app)
+    init_timing(app)
+    init_compression(app)
+    init_ratelimit(app)
+    init_warmup(app)
+    init_events(app)
+    init_deadlines(app)
 
     @app.route("/account", methods=["POST", "GET", "PUT", "DELETE"])
     def account_route():
@@ -50,6 +88,11 @@ def create_app():
         elif request.method == "DELETE":
             return community_delete(request)
 
+    @app.route("/community/search", methods=["GET"])
+    def community_search_route():
+        if request.method == "GET":
+            return community_search_get(request)
+
     @app.route("/community/<id>/join", methods=["POST"])
     def join_route(id):
         if request.method == "POST":
@@ -60,6 +103,11 @@ def create_app():
         if request.method == "POST":
             return community_leave_post(request, id)
 
+    @app.route("/community/<id>/events", methods=["GET"])
+    def events_route(id):
+        if request.method == "GET":
+            return community_events_get(request, id)
+
     @app.route("/ban", methods=["POST", "PUT"])
     def ban_route():
         if request.method == "POST":
@@ -76,4 +124,9 @@ def create_app():
         elif request.method == "GET":
             return profile_get(request)
 
+    @app.route("/batch", methods=["POST"])
+    def batch_route():
+        if request.method == "POST":
+            return batch_post(request)
+
     return app
@@ -1,7 +1,16 @@
-import requests
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter, time
 from typing import Tuple
 
+from . import clients
+from .deadline import CALL_TIMEOUTS, call_options, record_failure
+from .errors import DeadlineExceeded
+from .metrics import AZURE_LATENCY, AZURE_REFRESHES
+from .shared_cache import seal, shared_cache, token_key, unseal
+from .timing import timed
+
 CLIENT_ID = "c128fe76-dc54-4daa-993c-1a13c1e82080"
 """
 The client id (biit) provided by azure
@@ -17,6 +26,39 @@ REDIRECT_URI = "https://auth.expo.io/@stephend17/biit-mobile"
 The redirect url registered with azure. 
 """
 
+TOKEN_URL = os.getenv(
+    "AZURE_TOKEN_URL",
+    f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token",
+)
+"""
+The azure token endpoint. Can be pointed at a local stand-in for load tests.
+"""
+
+SHARED_TOKEN_TTL = 10.0
+"""
+Seconds the result of a refresh is shared with the other instances, sealed
+with the refresh token it came from. A refresh token revoked at azure still
+authenticates for up to this long on every instance.
+"""
+
+_authenticated = ContextVar("authenticated", default=None)
+
+
+@contextmanager
+def authenticated_as(refresh_token: str, auth: Tuple[str, str]):
+    """Within the block, refreshing refresh_token returns auth without calling azure.
+    Lets a batch of operations authenticate once.
+
+    Args:
+        refresh_token (str): the refresh token the operations were sent with
+        auth (Tuple[str, str]): the result of refreshing it
+    """
+    token = _authenticated.set((refresh_token, auth))
+    try:
+        yield
+    finally:
+        _authenticated.reset(token)
+
 
 def azure_refresh_token(refresh_token: str) -> Tuple[str, str]:
     """
@@ -39,21 +81,61 @@ def azure_refresh_token(refresh_token: str) -> Tuple[str, str]:
                          process and obtain a new refresh token.
 
     """
+    authenticated = _authenticated.get()
+    if authenticated is not None and authenticated[0] == refresh_token:
+        return authenticated[1]
+
+    # another instance may have refreshed the same token a moment ago
+    shared = shared_cache()
+    key = token_key(refresh_token)
+    cached = shared.get(key)
+    if cached is not None:
+        auth = unseal(refresh_token, cached)
+        if auth is not None:
+            return tuple(auth)
+
+    auth = _refresh(refresh_token)
+    if auth[0]:
+        shared.set(key, seal(refresh_token, list(auth)), time(), ttl=SHARED_TOKEN_TTL)
+    return auth
+
+
+@timed("azure")
+def _refresh(refresh_token: str) -> Tuple[str, str]:
     stage = os.getenv("STAGE")
     if stage == "dev":
         return ("AccessToken", "RefreshToken")
 
-    url = f"https://login.microsoftonline.com/{TENANT_ID}/oauth2/v2.0/token"
+    # imported here so requests only loads once a token is refreshed
+    import requests
+
+    url = TOKEN_URL
 
     payload = f"client_id={CLIENT_ID}&scope=https://graph.microsoft.com/User.Read&redirect_uri={REDIRECT_URI}&grant_type=refresh_token&refresh_token={refresh_token}"
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    start = perf_counter()
+    try:
+        response = clients.http_session().request(
+            "POST",
+            url,
+            headers=headers,
+            data=payload,
+            **call_options(CALL_TIMEOUTS["azure"]),
+        )
+    except (requests.RequestException, DeadlineExceeded) as e:
+        AZURE_REFRESHES.inc("error")
+        record_failure(e)
+        raise
+    finally:
+        AZURE_LATENCY.observe(perf_counter() - start)
     rjson = response.json()
 
     if response.status_code != 200:
+        AZURE_REFRESHES.inc("rejected")
         return ("", "")
 
+    AZURE_REFRESHES.inc("ok")
     return (rjson["access_token"], rjson["refresh_token"])
@@ -1,9 +1,16 @@
-from .http_responses import http200, http400, jsonHttp200
-from .query_helper import validate_body, validate_query_params
+from .http_responses import http200, http400, http404, http503, jsonHttp200
 from .azure import azure_refresh_token
 from .database import Database
+from .schema import Field, Schema, email, query, token
+from .summaries import update_members
 
-from google.cloud import firestore
+BAN_POST = Schema(
+    email("banner"), email("bannee"), Field("community", max_length=256), token()
+)
+
+BAN_PUT = query(
+    email("banner"), email("bannee"), Field("community", max_length=256), token()
+)
 
 
 def ban_post(request):
@@ -17,16 +24,9 @@ def ban_post(request):
 
     Raises:
         Http 400 when the json is missing a key
+        Http 404 when the community does not exist, Http 503 when the ban could not be written
     """
-    fields = ["banner", "bannee", "community", "token"]
-    body = None
-
-    try:
-        body = request.get_json()
-    except:
-        return http400("Missing body")
-
-    body_validation = validate_body(body, fields)
+    body, body_validation = BAN_POST.load_json(request)
     # check that body validation succeeded
     if body_validation[1] != 200:
         return body_validation
@@ -37,25 +37,25 @@ def ban_post(request):
 
     # return ban.add(args)
 
-    community_db = Database("communities")
-    community = community_db.get(body["community"]).to_dict()
-    community_db.update(
-        body["community"],
-        {"Members": [user for user in community["Members"] if user != body["bannee"]]},
-    )
-
-    ban_db = Database("communities")
-
-    banned_user = ban_db.get(body["community"]).to_dict()
+    # imported on first ban, the app starts without loading the SDK
+    from google.cloud.firestore import ArrayUnion
 
     insert_data = {
         "name": body["bannee"],
         "ordered_by": body["banner"],
     }
 
-    banned_user["bans"].append(insert_data)
-
-    ban_db.update(body["community"], {"bans": banned_user["bans"]})
+    # the bannee leaves, is banned and stops being counted in one batch
+    banned = update_members(
+        body["community"],
+        body["bannee"],
+        False,
+        changes={"bans": ArrayUnion([insert_data])},
+    )
+    if banned is False:
+        return http503("Could not ban the user")
+    if not banned[0].exists:
+        return http404("Community not found")
 
     response = {"access_token": auth[0], "refresh_token": auth[1]}
 
@@ -74,13 +74,9 @@ def ban_put(request):
 
     Raises:
         Http 400 when the json is missing a key
+        Http 404 when the community does not exist, Http 503 when it could not be read
     """
-    fields = ["banner", "bannee", "community", "token"]
-
-    # serializes the quert string to a dict (neeto)
-    args = request.args
-
-    query_validation = validate_query_params(args, fields)
+    args, query_validation = BAN_PUT.load_args(request)
     # check that body validation succeeded
     if query_validation[1] != 200:
         return query_validation
@@ -91,7 +87,12 @@ def ban_put(request):
 
     ban_db = Database("communities")
 
-    banned_user = ban_db.get(args["community"]).to_dict()
+    community = ban_db.get(args["community"])
+    if community is False:
+        return http503("Could not unban the user")
+    if not community.exists:
+        return http404("Community not found")
+    banned_user = community.to_dict()
 
     ban_db.update(
         args["community"],
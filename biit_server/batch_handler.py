@@ -0,0 +1,216 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Dict, List
+
+from flask import current_app
+from werkzeug.datastructures import ETags, Headers, MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+
+from .account_handler import (
+    account_post,
+    account_get,
+    account_put,
+    account_delete,
+    profile_get,
+    profile_post,
+)
+from .azure import authenticated_as, azure_refresh_token
+from .ban_handler import ban_post, ban_put
+from .community_handler import (
+    community_delete,
+    community_get,
+    community_post,
+    community_put,
+    community_join_post,
+    community_leave_post,
+)
+from .deadline import current_deadline, deadline, failure_response
+from .http_responses import http400, jsonHttp200
+from .schema import Field, Schema, token
+
+MAX_OPERATIONS = 50
+"""
+The most operations accepted in one batch
+"""
+
+OPERATIONS = Map(
+    [
+        Rule("/account", methods=["POST"], endpoint=account_post),
+        Rule("/account", methods=["GET"], endpoint=account_get),
+        Rule("/account", methods=["PUT"], endpoint=account_put),
+        Rule("/account", methods=["DELETE"], endpoint=account_delete),
+        Rule("/community", methods=["POST"], endpoint=community_post),
+        Rule("/community", methods=["GET"], endpoint=community_get),
+        Rule("/community", methods=["PUT"], endpoint=community_put),
+        Rule("/community", methods=["DELETE"], endpoint=community_delete),
+        Rule(
+            "/community/<community_id>/join",
+            methods=["POST"],
+            endpoint=community_join_post,
+        ),
+        Rule(
+            "/community/<community_id>/leave",
+            methods=["POST"],
+            endpoint=community_leave_post,
+        ),
+        Rule("/ban", methods=["POST"], endpoint=ban_post),
+        Rule("/ban", methods=["PUT"], endpoint=ban_put),
+        Rule("/profile", methods=["POST"], endpoint=profile_post),
+        Rule("/profile", methods=["GET"], endpoint=profile_get),
+    ]
+)
+"""
+The routes an operation can call and the handler of each
+"""
+
+BATCH_POST = Schema(
+    token(),
+    Field("operations", list, min_items=1, max_length=MAX_OPERATIONS, items=dict),
+    max_bytes=1024 * 1024,
+)
+
+_readers = ThreadPoolExecutor(max_workers=8, thread_name_prefix="batch-read")
+
+
+class BatchRequest:
+    def __init__(self, operation: Dict[str, Any], token: str) -> None:
+        """Stands in for the flask request when a handler runs as part of a batch
+
+        Args:
+            operation (Dict[str, Any]): the operation, with optional args, body and form
+            token (str): the refresh token of the batch, given to every operation
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.method = operation["method"].upper()
+        self.path = operation["path"]
+        self.args = MultiDict(operation.get("args") or {})
+        self.args["token"] = token
+        self.body = operation.get("body")
+        # only POST endpoints read the token from their body, the bodies of
+        # the others refuse fields they do not know
+        if isinstance(self.body, dict) and self.method == "POST":
+            self.body = dict(self.body, token=token)
+        self.form = MultiDict(operation.get("form") or {})
+        if self.form:
+            self.form["token"] = token
+        self.files = MultiDict()
+        self.headers = Headers()
+        # the operation was parsed with the batch, its size was checked then
+        self.content_length = None
+        self.is_json = isinstance(self.body, dict)
+        self.if_none_match = ETags()
+
+    def get_json(self):
+        if self.body is None:
+            raise ValueError("Missing body")
+        return self.body
+
+
+def _result(response) -> Dict[str, Any]:
+    if response.is_json:
+        return {"status": response.status_code, "body": response.get_json()}
+    return {"status": response.status_code, "body": response.get_data(as_text=True)}
+
+
+def _run(request: BatchRequest) -> Dict[str, Any]:
+    try:
+        handler, kwargs = OPERATIONS.bind("").match(request.path, request.method)
+    except HTTPException as e:
+        return {"status": e.code, "body": e.description}
+
+    outer = current_deadline()
+    seconds = (
+        outer.remaining()
+        if outer is not None
+        else current_app.config["DEADLINE_SECONDS"]
+    )
+    # every operation records the failures of its own backend calls, one
+    # failed read does not turn the results of the others into a 504
+    with deadline(seconds) as current:
+        try:
+            response = current_app.make_response(handler(request, **kwargs))
+        except Exception:
+            failed = failure_response(current)
+            if failed is None:
+                return {"status": 500, "body": "Internal Server Error"}
+            response = current_app.make_response(failed)
+
+    if response.status_code >= 400:
+        failed = failure_response(current)
+        if failed is not None:
+            response = current_app.make_response(failed)
+    return _result(response)
+
+
+def _run_in_app(app, request: BatchRequest) -> Dict[str, Any]:
+    # flask keeps the app context in a thread local, it is pushed again on the reader thread
+    with app.app_context():
+        return _run(request)
+
+
+def _run_reads(requests: List[BatchRequest]) -> List[Dict[str, Any]]:
+    # every read gets its own copy of the context so the request timer,
+    # deadline and authentication follow it onto the reader thread
+    app = current_app._get_current_object()
+    futures = [
+        _readers.submit(copy_context().run, _run_in_app, app, r) for r in requests
+    ]
+    return [future.result() for future in futures]
+
+
+def batch_post(request):
+    """Handles the batch POST endpoint
+    Runs several operations, each one a call to another endpoint, in one request.
+    The token is refreshed once for every operation. Runs of consecutive GET
+    operations are read concurrently, other operations run one after the other.
+
+    Args:
+        request: A request object that contains a json object with keys: token, operations.
+                 Each operation has keys: method, path and optionally args, body and form
+
+    Returns:
+        (json): Http 200 string response containing the refresh token, new token
+        and the status and body of every operation in order
+
+    Raises:
+        Http 400 when the json is missing a key or has too many operations
+    """
+    body, body_validation = BATCH_POST.load_json(request)
+    # check that body validation succeeded
+    if body_validation[1] != 200:
+        return body_validation
+
+    try:
+        requests = [BatchRequest(op, body["token"]) for op in body["operations"]]
+    except (KeyError, TypeError, AttributeError):
+        return http400("Every operation needs a method and a path")
+
+    auth = azure_refresh_token(body["token"])
+    if not auth[0]:
+        return http400("Not Authenticated")
+
+    results = []
+    with authenticated_as(body["token"], auth):
+        start = 0
+        while start < len(requests):
+            reads = requests[start].method == "GET"
+            end = start + 1
+            while end < len(requests) and (requests[end].method == "GET") == reads:
+                end += 1
+
+            if reads:
+                results.extend(_run_reads(requests[start:end]))
+            else:
+                results.extend(_run(r) for r in requests[start:end])
+            start = end
+
+    response = {
+        "access_token": auth[0],
+        "refresh_token": auth[1],
+        "results": results,
+    }
+    return jsonHttp200("Batch executed", response)
@@ -0,0 +1,268 @@
+from collections import OrderedDict
+from threading import Event, Lock
+import time
+from typing import Any, Callable, Hashable, Optional
+
+from .metrics import CACHE_REQUESTS, COALESCED_CALLS
+
+_MISSING = object()
+
+NEGATIVE_TTL = 5.0
+"""
+Seconds a not found answer is trusted. Documents created by another
+instance are seen at most this late.
+"""
+
+
+class LRUCache:
+    def __init__(
+        self, max_size: int = 128, ttl: Optional[float] = None, name: str = None
+    ) -> None:
+        """A small thread safe LRU cache with an optional time to live.
+
+        Args:
+            max_size (int): the maximum number of entries kept before the
+                            least recently used entry is evicted
+            ttl (float): seconds an entry stays valid. Optional, entries
+                         never expire when not set
+            name (str): reports hits and misses to the cache_requests_total
+                        metric under this name. Optional.
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Helper function to get an entry from the cache.
+
+        Args:
+            key (Hashable): the key the entry was stored under
+            default (Any): value returned when the key is missing or expired
+
+        Returns:
+            The cached value, or default if there is no valid entry.
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is not None and expires <= time.monotonic():
+                    del self._entries[key]
+                    entry = _MISSING
+
+            if entry is _MISSING:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        if self.name is not None:
+            CACHE_REQUESTS.inc(self.name, "miss" if entry is _MISSING else "hit")
+        return default if entry is _MISSING else value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Helper function to store an entry in the cache.
+
+        Args:
+            key (Hashable): the key to store the entry under
+            value (Any): the value to store
+            ttl (float): overrides the cache wide time to live. Optional.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def _store(self, key: Hashable, value: Any, ttl: Optional[float]) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """Helper function to drop an entry from the cache.
+
+        Args:
+            key (Hashable): the key of the entry to drop
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Drops every entry and resets the hit and miss counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class NegativeCache(LRUCache):
+    def __init__(
+        self, max_size: int = 1024, ttl: float = NEGATIVE_TTL, name: str = None
+    ) -> None:
+        """Remembers keys a backend answered not found for, with a short time to live.
+
+        A lookup that started before a write of its key must not cache its
+        answer, so lookups take a token() first and pass it to set.
+
+        Args:
+            max_size (int): the maximum number of entries kept
+            ttl (float): seconds an entry stays valid
+            name (str): reports hits and misses under this name. Optional.
+
+        Returns:
+            None
+        """
+        super().__init__(max_size=max_size, ttl=ttl, name=name)
+        self._generation = 0
+
+    def token(self) -> int:
+        """Taken before a lookup, changes with every delete"""
+        return self._generation
+
+    def set(self, key: Hashable, value: Any, token: int = None) -> None:
+        """Remembers that key was not found, unless a key was deleted since token was taken
+
+        Args:
+            key (Hashable): the key that was not found
+            value (Any): what the lookup answered
+            token (int): the token taken before the lookup. Optional.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if token is None or token == self._generation:
+                self._store(key, value, None)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name: str = None) -> None:
+        """Coalesces concurrent calls for the same key: the first caller makes
+        the call and the others wait for it and share its result.
+
+        Args:
+            name (str): reports leaders and followers to the
+                        coalesced_calls_total metric under this name. Optional.
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.name = name
+        self.leaders = 0
+        self.followers = 0
+        self._flights = {}
+        self._lock = Lock()
+
+    def do(
+        self,
+        key: Hashable,
+        function: Callable,
+        wait: float = None,
+        retry_if: Callable[[Exception], bool] = None,
+    ) -> Any:
+        """Calls function, unless a call for key is in flight, then waits for that one
+
+        Args:
+            key (Hashable): what the call fetches
+            function (Callable): the call, made without arguments
+            wait (float): the longest a follower waits for the call in flight
+                          before making its own. Optional, waits until it ends.
+            retry_if (Callable[[Exception], bool]): the errors of the call in flight
+                          after which followers make their own call instead of
+                          sharing the error, ie the leader ran out of its own time. Optional.
+
+        Returns:
+            What the call returned
+
+        Raises:
+            The error of the call, in every caller sharing it
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if self.name is not None:
+            COALESCED_CALLS.inc(self.name, "leader" if leader else "follower")
+
+        if not leader:
+            if not flight.done.wait(wait):
+                return function()
+            if flight.error is not None:
+                if retry_if is not None and retry_if(flight.error):
+                    return function()
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self.forget(key, flight)
+            flight.done.set()
+
+    def forget(self, key: Hashable, flight: _Flight = None) -> None:
+        """Lets the next caller for key start a new call, ie after a write made
+        the result of the call in flight stale
+
+        Args:
+            key (Hashable): what the call fetches
+            flight (_Flight): only forget this call. Optional.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            if flight is None or self._flights.get(key) is flight:
+                self._flights.pop(key, None)
+
+    def forget_matching(self, predicate: Callable[[Hashable], bool]) -> None:
+        """Forgets every call in flight whose key matches predicate"""
+        with self._lock:
+            for key in [key for key in self._flights if predicate(key)]:
+                del self._flights[key]
+
+    def ratio(self) -> float:
+        """The share of callers that did not make their own call"""
+        total = self.leaders + self.followers
+        return self.followers / total if total else 0.0
@@ -0,0 +1,96 @@
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Callable, Dict
+
+
+def _firestore():
+    from google.cloud import firestore
+
+    return firestore.Client()
+
+
+def _storage():
+    from google.cloud import storage
+
+    return storage.Client()
+
+
+def _http():
+    import requests
+
+    return requests.Session()
+
+
+FACTORIES: Dict[str, Callable[[], Any]] = {
+    "firestore": _firestore,
+    "storage": _storage,
+    "http": _http,
+}
+"""
+Builds each shared client. The SDKs are only imported by the factories, so
+importing biit_server stays fast and a client costs nothing until it is used.
+"""
+
+_clients: Dict[str, Any] = {}
+_lock = Lock()
+
+
+def get(name: str) -> Any:
+    """Returns a shared client, creating it on first use
+
+    Args:
+        name (str): "firestore", "storage" or "http"
+
+    Returns:
+        The client, shared by every thread of the process
+    """
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = FACTORIES[name]()
+    return client
+
+
+def firestore_client():
+    """The shared google.cloud.firestore.Client"""
+    return get("firestore")
+
+
+def storage_client():
+    """The shared google.cloud.storage.Client"""
+    return get("storage")
+
+
+def http_session():
+    """The shared requests.Session, which keeps connections to azure open"""
+    return get("http")
+
+
+def reset() -> None:
+    """Drops every shared client, the next use creates new ones"""
+    with _lock:
+        _clients.clear()
+
+
+@contextmanager
+def installed(**clients):
+    """Replaces shared clients within the block, ie with fakes in benchmarks
+
+    Usage:
+        with installed(firestore=FakeFirestore()):
+            Database("accounts").get("a@purdue.edu")
+    """
+    with _lock:
+        previous = {name: _clients.get(name) for name in clients}
+        _clients.update(clients)
+    try:
+        yield
+    finally:
+        with _lock:
+            for name, client in previous.items():
+                if client is None:
+                    _clients.pop(name, None)
+                else:
+                    _clients[name] = client
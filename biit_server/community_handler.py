@@ -1,10 +1,97 @@
-import ast
 import json
 
-from .http_responses import http200, http400, jsonHttp200
-from .query_helper import validate_query_params, validate_body
+from flask import Response, current_app
+
+from . import clients
+from .events import format_event, stream
+from .http_responses import (
+    http200,
+    http304,
+    http400,
+    http404,
+    http503,
+    jsonHttp200,
+    document_etag,
+)
+from .query_helper import decode_cursor, encode_cursor, parse_fields, paginate
 from .azure import azure_refresh_token
-from .database import Database
+from .database import Database, write_batch
+from .schema import Field, Schema, email, query, token
+from .search import SEARCH_COLLECTION, index_entry, matches, search_term
+from .summaries import (
+    MEMBER_SHARD_COLLECTION,
+    SUMMARY_COLLECTION,
+    read_summaries,
+    shard_id,
+    shard_ids,
+    summary,
+    update_members,
+)
+
+COMMUNITY_FIELDS = [
+    "name",
+    "codeofconduct",
+    "Admins",
+    "Members",
+    "mpm",
+    "meettype",
+    "bans",
+]
+"""
+The fields of a community document a client can select
+"""
+
+MAX_MEMBERS_PAGE = 500
+"""
+The most members returned in one page
+"""
+
+MAX_SEARCH_PAGE = 50
+DEFAULT_SEARCH_PAGE = 20
+"""
+The most communities returned in one page of a search, and the number
+returned when no limit is given
+"""
+
+COMMUNITY_POST = Schema(
+    Field("name", max_length=256),
+    Field("codeofconduct", max_length=10000),
+    Field("Admins", list, max_length=100, items=str),
+    Field("Members", list, max_length=10000, items=str),
+    Field("mpm", int),
+    Field("meettype", max_length=100),
+    token(),
+    max_bytes=512 * 1024,
+)
+
+COMMUNITY_GET = query(Field("name", max_length=256), token())
+
+COMMUNITY_UPDATE = Schema(
+    Field("codeofconduct", required=False, max_length=10000),
+    Field("Admins", list, required=False, max_length=100, items=str),
+    Field("mpm", int, required=False),
+    Field("meettype", required=False, max_length=100),
+    allow_extra=False,
+)
+"""
+The fields of a community that can be changed with a PUT, members and bans
+change through the join, leave and ban endpoints
+"""
+
+COMMUNITY_PUT = query(Field("name", max_length=256), email(), token())
+
+COMMUNITY_PUT_BODY = Schema(
+    Field("updateFields", dict, min_items=1, items=COMMUNITY_UPDATE),
+    allow_extra=False,
+)
+
+COMMUNITY_DELETE = query(email(), token(), Field("name", max_length=256))
+
+MEMBERSHIP = Schema(email(), token())
+
+COMMUNITY_EVENTS = query(token())
+
+COMMUNITY_SEARCH = query(Field("q", max_length=256), token())
 
 
 def community_post(request):
@@ -19,15 +106,7 @@ def community_post(request):
     Raises:
         Http 400 when the json is missing a key
     """
-    fields = ["name", "codeofconduct", "Admins", "Members", "mpm", "meettype", "token"]
-    body = None
-
-    try:
-        body = request.get_json()
-    except:
-        return http400("Missing body")
-
-    body_validation = validate_body(body, fields)
+    body, body_validation = COMMUNITY_POST.load_json(request)
     # check that body validation succeeded
     if body_validation[1] != 200:
         return body_validation
@@ -37,18 +116,30 @@ def community_post(request):
         return http400("Not Authenticated")
 
     community_db = Database("communities")
+    search_db = Database(SEARCH_COLLECTION)
 
     body["bans"] = []
 
-    try:
+    # the community, its index entry and summary are created together or not at all
+    with write_batch() as batch:
         community_db.add(body, id=body["name"])
-    except:
+        search_db.set(body["name"], index_entry(body))
+        Database(SUMMARY_COLLECTION).set(body["name"], summary(body))
+        Database(MEMBER_SHARD_COLLECTION).set(
+            shard_id(body["name"], 0),
+            {"community": body["name"], "count": len(body["Members"])},
+        )
+    if batch.failed:
         return http400("Community name already taken")
 
+    community = community_db.get(body["name"])
+    if community is False:
+        return http503("Community created but could not be read")
+
     response = {
         "access_token": auth[0],
         "refresh_token": auth[1],
-        "data": community_db.get(body["name"]).to_dict(),
+        "data": community.to_dict(),
     }
     return jsonHttp200("Community created", response)
 
@@ -60,73 +151,138 @@ def community_get(request):
     """Handles the community GET endpoint
         Validates the keys in the request then calls the database to get information about a commmunity
     Args:
-        request: A request object that contains a json object with keys: name
+        request: A request object that contains args with keys: name, token and optionally
+                 fields, a comma separated list of the fields to return, and limit and cursor
+                 to page through the members
 
     Returns:
         (str): Http 200 string response containing information about the searched community
+        with a weak ETag of the document, or Http 304 if it matches the If-None-Match header,
+        with the refresh token and new token in its X-Access-Token and X-Refresh-Token headers.
+        When a limit is given the response also contains the next_cursor of the members.
 
     Raises:
-        Http 400 when the json is missing a key
+        Http 400 when the json is missing a key or a field, limit or cursor is invalid
     """
-    fields = ["name", "token"]
-
-    args = request.args
-
-    query_validation = validate_query_params(args, fields)
+    args, query_validation = COMMUNITY_GET.load_args(request)
 
     if query_validation[1] != 200:
         return query_validation
 
+    try:
+        selected = parse_fields(args, COMMUNITY_FIELDS)
+    except ValueError as e:
+        return http400(str(e))
+
+    limit = None
+    if "limit" in args:
+        try:
+            limit = int(args["limit"])
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_MEMBERS_PAGE:
+            return http400(f"Limit must be between 1 and {MAX_MEMBERS_PAGE}")
+
     auth = azure_refresh_token(args["token"])
     if not auth[0]:
         return http400("Not Authenticated")
 
     community_db = Database("communities")
 
+    # answer polls of an unchanged community without reading it
+    if request.if_none_match:
+        update_time = community_db.update_time(args["name"])
+        if update_time is not None and request.if_none_match.contains_weak(
+            document_etag("communities", args["name"], update_time)
+        ):
+            return http304(auth[0], auth[1])
+
+    # only the selected fields are read from firestore
+    read_options = {"fields": selected} if selected is not None else {}
     try:
+        community = community_db.get(args["name"], **read_options)
         response = {
             "access_token": auth[0],
             "refresh_token": auth[1],
-            "data": community_db.get(args["name"]).to_dict(),
+            "data": community.to_dict(),
         }
-        return jsonHttp200("Community Received", response)
     except:
         return http400("Community not found")
 
+    if limit is not None:
+        members = (response["data"] or {}).get("Members")
+        next_cursor = None
+        if members is not None:
+            try:
+                members, next_cursor = paginate(members, args.get("cursor"), limit)
+            except ValueError as e:
+                return http400(str(e))
+            response["data"]["Members"] = members
+        response["next_cursor"] = next_cursor
+
+    response = jsonHttp200("Community Received", response)
+
+    update_time = getattr(community, "update_time", None)
+    if update_time is not None:
+        response.set_etag(
+            document_etag("communities", args["name"], update_time), weak=True
+        )
+    return response
+
 
 def community_put(request):
     """Handles the community PUT endpoint
         Validates the keys in the request then calls the database to update a commmunity
     Args:
-        request: A request object that contains a json object with keys: name, email, token, and (values to change for a community)
+        request: A request object that contains args with keys: name, email, token
+                 and a json object with key updateFields holding the values to change for a community
 
     Returns:
         (json): Http 200 string response containing the refresh token and new token
 
     Raises:
-        Http 400 when the json is missing a key
+        Http 400 when the json is missing a key or updateFields has a field that cannot be changed
+        Http 404 when the community does not exist, Http 503 when it could not be read
     """
-    fields = ["name", "email", "token", "updateFields"]
-
-    # serializes the quert string to a dict (neeto)
-    args = request.args
-
-    query_validation = validate_query_params(args, fields)
+    args, query_validation = COMMUNITY_PUT.load_args(request)
     # check that body validation succeeded
     if query_validation[1] != 200:
         return query_validation
 
+    body, body_validation = COMMUNITY_PUT_BODY.load_json(request)
+    if body_validation[1] != 200:
+        return body_validation
+
     auth = azure_refresh_token(args["token"])
     if not auth[0]:
         return http400("Not Authenticated")
 
     community_db = Database("communities")
 
-    community_db.update(args["name"], ast.literal_eval(args["updateFields"]))
+    with write_batch() as batch:
+        community_db.update(args["name"], body["updateFields"])
+        # searches return the meettype, the name never changes
+        if "meettype" in body["updateFields"]:
+            entry = index_entry(
+                {"name": args["name"], "meettype": body["updateFields"]["meettype"]}
+            )
+            Database(SEARCH_COLLECTION).set(args["name"], entry)
+        changed = summary(body["updateFields"])
+        if changed:
+            Database(SUMMARY_COLLECTION).set(args["name"], changed, merge=True)
+
+    community = community_db.get(args["name"])
+    if community is False:
+        return http503("Could not read the community")
+    if not community.exists:
+        return http404("Community not found")
+    if batch.failed:
+        return http400("Community update error")
+
     response = {
         "access_token": auth[0],
         "refresh_token": auth[1],
-        "data": community_db.get(args["name"]).to_dict(),
+        "data": community.to_dict(),
     }
     return jsonHttp200("Community Updated", response)
 
@@ -143,12 +299,7 @@ def community_delete(request):
     Raises:
         Http 400 when the json is missing a key
     """
-    fields = ["email", "token", "name"]
-
-    # serializes the quert string to a dict (neeto)
-    args = request.args
-
-    query_validation = validate_query_params(args, fields)
+    args, query_validation = COMMUNITY_DELETE.load_args(request)
     # check that body validation succeeded
     if query_validation[1] != 200:
         return query_validation
@@ -160,13 +311,20 @@ def community_delete(request):
     # return community.delete(args)
     community_db = Database("communities")
 
-    try:
+    with write_batch() as batch:
         community_db.delete(args["name"])
-        response = {"access_token": auth[0], "refresh_token": auth[1]}
-        return jsonHttp200("Community Deleted", response)
-    except:
+        Database(SEARCH_COLLECTION).delete(args["name"])
+        Database(SUMMARY_COLLECTION).delete(args["name"])
+        # a community created later with the same name starts from no members
+        shard_db = Database(MEMBER_SHARD_COLLECTION)
+        for id in shard_ids(args["name"]):
+            shard_db.delete(id)
+    if batch.failed:
         return http400("Community update error")
 
+    response = {"access_token": auth[0], "refresh_token": auth[1]}
+    return jsonHttp200("Community Deleted", response)
+
 
 def community_join_post(request, community_id):
     """Handles the community joining POST endpoint
@@ -179,16 +337,10 @@ def community_join_post(request, community_id):
 
     Raises:
         Http 400 when the json is missing a key
+        Http 400 when the user already is a member
+        Http 404 when the community does not exist, Http 503 when the members could not be changed
     """
-    fields = ["email", "token"]
-    body = None
-
-    try:
-        body = request.get_json()
-    except:
-        return http400("Missing body")
-
-    body_validation = validate_body(body, fields)
+    body, body_validation = MEMBERSHIP.load_json(request)
     # check that body validation succeeded
     if body_validation[1] != 200:
         return body_validation
@@ -197,19 +349,24 @@ def community_join_post(request, community_id):
     if not auth[0]:
         return http400("Not Authenticated")
 
-    community_db = Database("communities")
-    community = community_db.get(community_id).to_dict()
+    # the member is added and counted in one batch, only if not a member yet
+    joined = update_members(community_id, body["email"], True)
+    if joined is False:
+        return http503("Could not join the community")
+    if not joined[0].exists:
+        return http404("Community not found")
+    if not joined[1]:
+        return http400("Already a member of the community")
 
-    if body["email"] in community["Members"]:
-        raise Exception
+    community_db = Database("communities")
+    community = community_db.get(community_id)
+    if community is False:
+        return http503("Could not read the community")
 
-    community_db.update(
-        community_id, {"Members": community["Members"] + [body["email"]]})
-      
     response = {
         "access_token": auth[0],
         "refresh_token": auth[1],
-        "data": community_db.get(community_id).to_dict(),
+        "data": community.to_dict(),
     }
 
     return jsonHttp200("Community Joined", response)
@@ -226,16 +383,9 @@ def community_leave_post(request, community_id):
 
     Raises:
         Http 400 when the json is missing a key
+        Http 404 when the community does not exist, Http 503 when the members could not be changed
     """
-    fields = ["token", "email"]
-    body = None
-
-    try:
-        body = request.get_json()
-    except:
-        return http400("Missing body")
-
-    body_validation = validate_body(body, fields)
+    body, body_validation = MEMBERSHIP.load_json(request)
     # check that body validation succeeded
     if body_validation[1] != 200:
         return body_validation
@@ -244,17 +394,151 @@ def community_leave_post(request, community_id):
     if not auth[0]:
         return http400("Not Authenticated")
 
+    # the member is removed and uncounted in one batch, only if a member
+    left = update_members(community_id, body["email"], False)
+    if left is False:
+        return http503("Could not leave the community")
+    if not left[0].exists:
+        return http404("Community not found")
+
     community_db = Database("communities")
-    community = community_db.get(community_id).to_dict()
-    community_db.update(
-        community_id,
-        {"Members": [user for user in community["Members"] if user != body["email"]]},
-    )
+    community = community_db.get(community_id)
+    if community is False:
+        return http503("Could not read the community")
+
     response = {
         "access_token": auth[0],
         "refresh_token": auth[1],
-        "data": community_db.get(community_id).to_dict(),
+        "data": community.to_dict(),
     }
 
     return jsonHttp200("Community Left", response)
 
+
+def community_events_get(request, community_id):
+    """Handles the community events GET endpoint
+        Streams the joins, leaves and bans of a community as server-sent events,
+        instead of the client polling the community GET endpoint
+    Args:
+        request: A request object that contains query args: token
+
+    Returns:
+        A text/event-stream response. Its first event, ready, holds the refresh token
+        and new token, then come joined, left, banned, unbanned and deleted events.
+        A resync event means events were missed and the community should be read again.
+
+    Raises:
+        Http 400 when the token is missing or invalid
+        Http 503 when the instance has too many streams open
+    """
+    args, query_validation = COMMUNITY_EVENTS.load_args(request)
+    # check that query validation succeeded
+    if query_validation[1] != 200:
+        return query_validation
+
+    auth = azure_refresh_token(args["token"])
+    if not auth[0]:
+        return http400("Not Authenticated")
+
+    hub = current_app.extensions["events"]
+    subscriber = hub.subscribe(clients.firestore_client(), community_id)
+    if subscriber is None:
+        return http503("Too many event streams")
+
+    # the body is sent after the app context is gone
+    keepalive = current_app.config["EVENTS_KEEPALIVE"]
+    max_duration = current_app.config["EVENTS_MAX_DURATION"]
+
+    def body():
+        yield format_event("ready", {"access_token": auth[0], "refresh_token": auth[1]})
+        yield from stream(hub, subscriber, keepalive, max_duration)
+
+    response = Response(
+        body(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # the server closes the response even when the client left before the
+    # body started, which the generator cannot see
+    response.call_on_close(lambda: hub.unsubscribe(subscriber))
+    return response
+
+
+def community_search_get(request):
+    """Handles the community search GET endpoint
+        Finds the communities whose name has a word starting with the search, in
+        one query of the search index instead of reading every community
+    Args:
+        request: A request object that contains query args: q, token and optionally
+                 limit and cursor to page through the communities found
+
+    Returns:
+        (json): Http 200 string response containing the refresh token and new token,
+        the name, meettype, mpm and members count of the communities found sorted by
+        name, and the next_cursor of the search, None on the last page
+
+    Raises:
+        Http 400 when the token is missing or invalid, or the q, limit or cursor is invalid
+    """
+    args, query_validation = COMMUNITY_SEARCH.load_args(request)
+    # check that query validation succeeded
+    if query_validation[1] != 200:
+        return query_validation
+
+    term = search_term(args["q"])
+    if not term:
+        return http400("Search must contain a letter or a digit")
+
+    limit = DEFAULT_SEARCH_PAGE
+    if "limit" in args:
+        try:
+            limit = int(args["limit"])
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= MAX_SEARCH_PAGE:
+            return http400(f"Limit must be between 1 and {MAX_SEARCH_PAGE}")
+
+    position, last = 0, None
+    if args.get("cursor"):
+        try:
+            position, last = decode_cursor(args["cursor"])
+        except ValueError as e:
+            return http400(str(e))
+
+    auth = azure_refresh_token(args["token"])
+    if not auth[0]:
+        return http400("Not Authenticated")
+
+    found = Database(SEARCH_COLLECTION).query(
+        "terms",
+        "array_contains",
+        term,
+        order_by="name",
+        limit=limit,
+        start_after=last,
+    )
+    if found is False:
+        return http400("Search error")
+
+    entries = [entry.to_dict() for entry in found]
+    next_cursor = None
+    if len(entries) == limit:
+        next_cursor = encode_cursor(position + limit, entries[-1]["name"])
+
+    # the index only holds the first characters of each word
+    entries = [entry for entry in entries if matches(entry["name"], args["q"])]
+    summaries = read_summaries([entry["name"] for entry in entries])
+    if summaries is False:
+        return http400("Search error")
+
+    response = {
+        "access_token": auth[0],
+        "refresh_token": auth[1],
+        # communities without a summary yet are listed with what the index holds
+        "data": [
+            found or {"name": entry["name"], "meettype": entry.get("meettype")}
+            for entry, found in zip(entries, summaries)
+        ],
+        "next_cursor": next_cursor,
+    }
+    return jsonHttp200("Communities Found", response)
@@ -0,0 +1,104 @@
+import gzip
+
+from flask import request
+
+from .timing import span
+
+try:
+    import brotli
+except ImportError:  # brotli is in requirements.txt, without it gzip is served
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/javascript",
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/csv",
+}
+"""
+Mimetypes worth compressing. Images and other binary payloads
+are already compressed so they are always sent as is.
+"""
+
+COMPRESSION_DEFAULTS = {
+    "COMPRESS_ENABLED": True,
+    "COMPRESS_MIN_SIZE": 500,
+    "COMPRESS_LEVEL": 6,
+    "COMPRESS_BR_LEVEL": 4,
+}
+"""
+Default config values, any of them can be overridden through create_app
+"""
+
+
+def _choose_encoding(accept_encodings) -> str:
+    """Picks the best encoding the client accepts
+
+    Args:
+        accept_encodings: the parsed Accept-Encoding header of the request
+
+    Returns:
+        str: "br" or "gzip", whichever has the highest quality with br winning
+        ties, or an empty string when nothing is acceptable
+    """
+    available = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(available, key=accept_encodings.quality)
+    return best if accept_encodings.quality(best) > 0 else ""
+
+
+def _compress(data: bytes, encoding: str, config) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESS_BR_LEVEL"])
+    return gzip.compress(data, compresslevel=config["COMPRESS_LEVEL"], mtime=0)
+
+
+def init_compression(app) -> None:
+    """Registers negotiated gzip/brotli compression of responses on an app
+
+    Args:
+        app (flask.Flask): the app to compress the responses of
+
+    Returns:
+        None
+    """
+    for key, value in COMPRESSION_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.after_request
+    def compress_response(response):
+        config = app.config
+        if not config["COMPRESS_ENABLED"]:
+            return response
+
+        if (
+            response.direct_passthrough
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+
+        encoding = _choose_encoding(request.accept_encodings)
+        if not encoding:
+            return response
+
+        data = response.get_data()
+        if len(data) < config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        # bodies carry the refreshed tokens of the caller, they are never
+        # the same twice so the output is not cached
+        with span("compress"):
+            compressed = _compress(data, encoding, config)
+
+        if len(compressed) >= len(data):
+            return response
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        return response
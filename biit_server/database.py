@@ -1,6 +1,209 @@
+from contextlib import contextmanager
+from copy import deepcopy
+from contextvars import ContextVar
 from typing import Any, Dict, List
 
-from google.cloud import firestore
+from . import clients
+from .cache import LRUCache, NegativeCache, SingleFlight
+from .deadline import accepted, current_deadline, record_failure
+from .errors import is_timeout
+from .hedging import HEDGE_COLLECTIONS, hedged
+from .listeners import LISTEN_COLLECTIONS, _listeners
+from .metrics import FIRESTORE_READS, FIRESTORE_WRITES, REGISTRY
+from .retry import with_retries
+from .shared_cache import (
+    SHARED_CACHE_COLLECTIONS,
+    document_key,
+    shared_cache,
+    version_of,
+)
+from .timing import timed
+
+UPDATE_TIME_TTL = 5.0
+"""
+Seconds a document's update_time is trusted without asking Firestore.
+This bounds how long a conditional GET can miss a write that was made
+by another instance.
+"""
+
+_update_times = LRUCache(max_size=1024, ttl=UPDATE_TIME_TTL, name="update_time")
+"""
+Last seen update_time of documents keyed by (collection, id), shared by
+every Database object in the process.
+"""
+
+_missing = NegativeCache(max_size=4096, name="firestore_missing")
+"""
+Documents Firestore answered not found for, keyed by (collection, id). Holds
+the client and the snapshot of the answer.
+"""
+
+_gets = SingleFlight(name="firestore_get")
+"""
+Document reads in flight keyed by (collection, id, fields, client), concurrent
+reads of the same document share one call to Firestore. A reader waits at
+most its own time left for the read in flight, and reads again itself when
+that read ran out of the time of the request that made it.
+"""
+
+REGISTRY.gauge(
+    "firestore_get_dedup_ratio",
+    "Share of document reads served by a read already in flight",
+    function=lambda: _gets.ratio(),
+)
+
+_active_batch = ContextVar("active_batch", default=None)
+
+
+class CachedSnapshot:
+    """A document read from the shared cache, standing in for a firestore snapshot"""
+
+    exists = True
+
+    def __init__(self, id, entry: Dict[str, Any]) -> None:
+        self.id = id
+        # only ever formatted into ETags, so the text of the original is kept
+        self.update_time = entry["update_time"]
+        self._data = entry["data"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return deepcopy(self._data)
+
+    def get(self, field):
+        return deepcopy(self._data[field])
+
+
+def _written_at(result):
+    """The update_time Firestore gave a write, from what the call returned.
+    None when the client does not say.
+
+    Args:
+        result: a WriteResult, the results of a batch, the (update_time, reference)
+                of an add, or the Timestamp of a delete
+    """
+    if isinstance(result, (list, tuple)):
+        result = result[0] if result else None
+    return getattr(result, "update_time", result)
+
+
+def _invalidate(key, written=None) -> None:
+    """Forgets what is known of a written document, keyed by (collection, id)
+
+    Args:
+        key (Tuple[str, Any]): (collection, id) of the document
+        written: the update_time Firestore gave the write. Optional.
+    """
+    _update_times.delete(key)
+    _missing.delete(key)
+    _listeners.written(key)
+    if key[0] in SHARED_CACHE_COLLECTIONS:
+        shared_cache().invalidate(document_key(*key), version_of(written))
+    # a read in flight may have started before the write, later reads do not join it
+    _gets.forget_matching(lambda flight: flight[:2] == key)
+
+
+def _write(target, op: str, reference, data) -> None:
+    """Adds a queued write to a firestore batch"""
+    if op == "delete":
+        target.delete(reference)
+    elif op == "merge":
+        target.set(reference, data, merge=True)
+    else:
+        getattr(target, op)(reference, data)
+
+
+class WriteBatch:
+    MAX_WRITES = 500
+    """
+    The most writes firestore accepts in one batch
+    """
+
+    def __init__(self) -> None:
+        """Writes made through Database while the batch is active.
+        They are committed together as firestore batched writes.
+        """
+        super().__init__()
+        self.failed = False
+        self._client = None
+        self._writes = []
+
+    def queue(self, client, op: str, reference, data, key) -> None:
+        """Queues one write
+
+        Args:
+            client (google.cloud.firestore.client): the client the write is made with
+            op (str): "create", "set", "merge", "update" or "delete"
+            reference: the document written to
+            data (Dict[str, Any]): the fields written, None for deletes
+            key (Tuple[str, Any]): (collection, id) of the document
+
+        Returns:
+            None
+        """
+        if self._client is not None and client is not self._client:
+            self.commit()
+        self._client = client
+        self._writes.append((op, reference, data, key))
+
+    def commit(self) -> bool:
+        """Commits every queued write, MAX_WRITES at a time.
+        failed is set once any of them was not committed.
+
+        Returns:
+            boolean, True if every write was committed.
+        """
+        writes, self._writes = self._writes, []
+        ok = True
+        for start in range(0, len(writes), self.MAX_WRITES):
+            chunk = writes[start : start + self.MAX_WRITES]
+            batch = self._client.batch()
+            for op, reference, data, _ in chunk:
+                _write(batch, op, reference, data)
+            written = None
+            try:
+                # a batch creates documents, it is only retried when refused
+                results = with_retries("firestore", batch.commit, idempotent=False)
+                written = _written_at(results)
+            except Exception as e:
+                record_failure(e)
+                ok = False
+                self.failed = True
+            for _, _, _, key in chunk:
+                _invalidate(key, written)
+        return ok
+
+
+@contextmanager
+def write_batch():
+    """Groups the writes made through Database inside the block into batched writes.
+    Pending writes are committed before any read, so reads always see them.
+    A block inside another one adds its writes to the outer batch, they are
+    committed with it.
+
+    Usage:
+        with write_batch() as batch:
+            Database("communities").delete("a")
+            Database("communities").delete("b")
+        failed = batch.failed
+    """
+    outer = _active_batch.get()
+    if outer is not None:
+        yield outer
+        return
+
+    batch = WriteBatch()
+    token = _active_batch.set(batch)
+    try:
+        yield batch
+    finally:
+        _active_batch.reset(token)
+    batch.commit()
+
+
+def _flush_writes() -> None:
+    batch = _active_batch.get()
+    if batch is not None:
+        batch.commit()
 
 
 class Database:
@@ -9,7 +212,7 @@ class Database:
 
         Args:
             collection (str): the name of the collection
-            firestore (google.cloud.firestore.client): A Firestore client object, or a mock test object.
+            firestore (google.cloud.firestore.client): A Firestore client object, or a mock test object. Optional, the shared client is used when not set.
 
         Returns:
             None
@@ -17,10 +220,38 @@ class Database:
         super().__init__()
         self.collection_name = collection
         self.firestore = (
-            firestore_client if firestore_client != None else firestore.Client()
+            firestore_client if firestore_client != None else clients.firestore_client()
         )
         self.collection_ref = self.firestore.collection(self.collection_name)
 
+    def _share(self, snapshot) -> None:
+        """Puts a document read from Firestore in the shared cache"""
+        cache = shared_cache()
+        if not cache.enabled:
+            return
+        version = version_of(snapshot.update_time)
+        if version is None:
+            return
+        cache.set(
+            document_key(self.collection_name, snapshot.id),
+            {"data": snapshot.to_dict(), "update_time": str(snapshot.update_time)},
+            version,
+        )
+
+    def _listened(self, id):
+        """The local copy of a document kept current by a listener, or None"""
+        if self.collection_name not in LISTEN_COLLECTIONS:
+            return None
+        return _listeners.get(self.firestore, self.collection_name, id)
+
+    def _known_missing(self, id):
+        """The snapshot of a recent not found answer for the document, or None"""
+        entry = _missing.get((self.collection_name, id))
+        if entry is None or entry[0] is not self.firestore:
+            return None
+        return entry[1]
+
+    @timed("firestore")
     def add(self, obj, id=None) -> bool:
         """Helper function to add object into the database.
 
@@ -31,43 +262,262 @@ class Database:
         Returns:
             boolean, True if the document is successfully added, False if there was an error.
         """
+        FIRESTORE_WRITES.inc(self.collection_name)
+        batch = _active_batch.get()
+        if batch is not None:
+            reference = self.collection_ref.document(id)
+            batch.queue(
+                self.firestore, "create", reference, obj, (self.collection_name, id)
+            )
+            return True
+
         try:
-            self.collection_ref.add(obj, document_id=id)
+            result = with_retries(
+                "firestore",
+                self.collection_ref.add,
+                obj,
+                document_id=id,
+                idempotent=False,
+            )
+            _invalidate((self.collection_name, id), _written_at(result))
             return True
-        except Exception:
+        except Exception as e:
+            record_failure(e)
             return False
 
-    def get(self, id) -> Dict[str, Any]:
+    @timed("firestore")
+    def get(self, id, fields: List[str] = None) -> Dict[str, Any]:
         """Helper function to get documents from the database.
+        Concurrent reads of the same document share one call to Firestore.
 
         Args:
             id (int, str): An identifying string or int.
+            fields (List[str]): Only read these fields of the document. Optional, reads every field when not set.
 
         Returns:
             Dict[str, Any] if the document is successfully added. Boolean value of False if there was an error.
         """
+        _flush_writes()
+        local = self._listened(id) if fields is None else None
+        if local is not None:
+            return local
+
+        missing = self._known_missing(id)
+        if missing is not None:
+            return missing
+
+        token = _missing.token()
+        options = {} if fields is None else {"field_paths": fields}
+
+        shared = fields is None and self.collection_name in SHARED_CACHE_COLLECTIONS
+
+        def read():
+            if shared:
+                entry = shared_cache().get(document_key(self.collection_name, id))
+                if entry is not None:
+                    return CachedSnapshot(id, entry)
+
+            FIRESTORE_READS.inc(self.collection_name)
+            document = self.collection_ref.document(id)
+            call = lambda: with_retries("firestore", document.get, **options)
+            if self.collection_name in HEDGE_COLLECTIONS:
+                results = hedged(self.collection_name, call)
+            else:
+                results = call()
+            if shared and results.exists:
+                self._share(results)
+            return results
+
+        key = (
+            self.collection_name,
+            id,
+            tuple(fields) if fields is not None else None,
+            self.firestore,
+        )
+        current = current_deadline()
+        wait = max(current.remaining(), 0.0) if current is not None else None
         try:
-            results = self.collection_ref.document(id).get()
+            results = _gets.do(key, read, wait=wait, retry_if=is_timeout)
+            if results.exists:
+                _update_times.set((self.collection_name, id), results.update_time)
+            else:
+                _missing.set(
+                    (self.collection_name, id), (self.firestore, results), token
+                )
             return results
-        except Exception:
+        except Exception as e:
+            record_failure(e)
             return False
 
-    def query(self, field, operation, value) -> List[Dict[str, Any]]:
+    @timed("firestore")
+    def get_many(self, ids: List[Any]) -> List[Any]:
+        """Helper function to get several documents of the collection at once.
+        Documents in the shared cache are read from it in one round trip,
+        the others from Firestore in one call.
+
+        Args:
+            ids (List[int, str]): the ids of the documents
+
+        Returns:
+            List of the snapshot of each document, in the order of ids. Boolean value of False if there was an error.
+        """
+        _flush_writes()
+        found = {}
+        shared = self.collection_name in SHARED_CACHE_COLLECTIONS
+        if shared:
+            keys = [document_key(self.collection_name, id) for id in ids]
+            for id, entry in zip(ids, shared_cache().get_many(keys)):
+                if entry is not None:
+                    found[str(id)] = CachedSnapshot(id, entry)
+
+        missing = [id for id in dict.fromkeys(ids) if str(id) not in found]
+        if missing:
+            FIRESTORE_READS.inc(self.collection_name, amount=len(missing))
+            references = [self.collection_ref.document(id) for id in missing]
+            try:
+                snapshots = with_retries(
+                    "firestore",
+                    lambda **options: list(
+                        self.firestore.get_all(
+                            references, **accepted(self.firestore.get_all, options)
+                        )
+                    ),
+                )
+            except Exception as e:
+                record_failure(e)
+                return False
+            for snapshot in snapshots:
+                found[snapshot.id] = snapshot
+                if snapshot.exists:
+                    _update_times.set(
+                        (self.collection_name, snapshot.id), snapshot.update_time
+                    )
+                    if shared:
+                        self._share(snapshot)
+
+        # snapshots know their id as a string
+        return [found.get(str(id)) for id in ids]
+
+    @timed("firestore")
+    def update_time(self, id):
+        """Helper function to get when a document was last changed without reading its fields.
+        Uses the cached value of a recent read when there is one.
+
+        Args:
+            id (int, str): An identifying string or int.
+
+        Returns:
+            The update_time of the document. None if the document does not exist or there was an error.
+        """
+        key = (self.collection_name, id)
+        batch = _active_batch.get()
+        if batch is None:
+            local = self._listened(id)
+            if local is not None:
+                return local.update_time
+        update_time = _update_times.get(key) if batch is None else None
+        if update_time is not None:
+            return update_time
+
+        _flush_writes()
+        if self._known_missing(id) is not None:
+            return None
+
+        FIRESTORE_READS.inc(self.collection_name)
+        try:
+            results = with_retries(
+                "firestore", self.collection_ref.document(id).get, field_paths=[]
+            )
+        except Exception as e:
+            record_failure(e)
+            return None
+
+        if not results.exists:
+            return None
+
+        _update_times.set(key, results.update_time)
+        return results.update_time
+
+    @timed("firestore")
+    def query(
+        self, field, operation, value, order_by=None, limit=None, start_after=None
+    ) -> List[Dict[str, Any]]:
         """Helper function to query documents based on parameters.
 
         Args:
             field (str): The field that you want to query on.
-            operation (str): Can be "==", ">=", "<=". Find out more at this link: https://googleapis.dev/python/firestore/latest/query.html#google.cloud.firestore_v1.query.Query.where
+            operation (str): Can be "==", ">=", "<=", "array_contains". Find out more at this link: https://googleapis.dev/python/firestore/latest/query.html#google.cloud.firestore_v1.query.Query.where
             value (str): The value you are comparing to.
+            order_by (str): The field the documents are sorted by. Optional.
+            limit (int): The most documents returned. Optional.
+            start_after (Any): The order_by value of the last document of the previous page. Optional.
         Returns:
             List[Dict[str, Any]] if there are no errors. Boolean value of False if there is an error.
         """
+        _flush_writes()
         try:
-            results = self.collection_ref.where(field, operation, value).stream()
-            return [value for value in results]
-        except Exception:
+            query = self.collection_ref.where(field, operation, value)
+            if order_by is not None:
+                query = query.order_by(order_by)
+                if start_after is not None:
+                    query = query.start_after({order_by: start_after})
+            if limit is not None:
+                query = query.limit(limit)
+            # the stream is read inside the retries, it can fail midway
+            results = with_retries(
+                "firestore",
+                lambda **options: list(query.stream(**accepted(query.stream, options))),
+            )
+        except Exception as e:
+            record_failure(e)
+            FIRESTORE_READS.inc(self.collection_name)
             return False
 
+        # a query is billed one read per returned document, and at least one read
+        FIRESTORE_READS.inc(self.collection_name, amount=max(len(results), 1))
+        return results
+
+    @timed("firestore")
+    def set(self, id, obj, merge=False) -> bool:
+        """Helper function to create or replace a document.
+
+        Args:
+            id (str, int): The id of the document.
+            obj (Dict[str, Any]): A Dictionary containing the whole document.
+            merge (bool): Whether only the given fields are written, creating the document if needed. Optional.
+        Returns:
+            boolean, True if the document is successfully written, False if there was an error.
+        """
+
+        FIRESTORE_WRITES.inc(self.collection_name)
+        batch = _active_batch.get()
+        if batch is not None:
+            reference = self.collection_ref.document(id)
+            batch.queue(
+                self.firestore,
+                "merge" if merge else "set",
+                reference,
+                obj,
+                (self.collection_name, id),
+            )
+            return True
+
+        try:
+            # merged fields can be transforms such as increments, never applied twice
+            result = with_retries(
+                "firestore",
+                self.collection_ref.document(id).set,
+                obj,
+                merge=merge,
+                idempotent=not merge,
+            )
+            _invalidate((self.collection_name, id), _written_at(result))
+            return True
+        except Exception as e:
+            record_failure(e)
+            return False
+
+    @timed("firestore")
     def update(self, id, update_dict) -> bool:
         """Helper function to query documents based on parameters.
 
@@ -78,13 +528,29 @@ class Database:
             True.
         """
 
+        FIRESTORE_WRITES.inc(self.collection_name)
+        batch = _active_batch.get()
+        if batch is not None:
+            reference = self.collection_ref.document(id)
+            batch.queue(
+                self.firestore,
+                "update",
+                reference,
+                update_dict,
+                (self.collection_name, id),
+            )
+            return True
+
         try:
             results = self.collection_ref.document(id)
-            results.update(update_dict)
+            result = with_retries("firestore", results.update, update_dict)
+            _invalidate((self.collection_name, id), _written_at(result))
             return True
-        except Exception:
+        except Exception as e:
+            record_failure(e)
             return False
 
+    @timed("firestore")
     def delete(self, id) -> bool:
         """Helper function to delete documents based on parameters.
 
@@ -94,8 +560,19 @@ class Database:
             True.
         """
 
+        FIRESTORE_WRITES.inc(self.collection_name)
+        batch = _active_batch.get()
+        if batch is not None:
+            reference = self.collection_ref.document(id)
+            batch.queue(
+                self.firestore, "delete", reference, None, (self.collection_name, id)
+            )
+            return True
+
         try:
-            results = self.collection_ref.document(id).delete()
+            result = with_retries("firestore", self.collection_ref.document(id).delete)
+            _invalidate((self.collection_name, id), _written_at(result))
             return True
-        except Exception:
+        except Exception as e:
+            record_failure(e)
             return False
@@ -0,0 +1,227 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import inspect
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict
+
+from flask import g, request
+
+from .errors import BackendUnavailable, DeadlineExceeded, is_timeout
+from .http_responses import http503, http504
+
+logger = logging.getLogger("biit_server.deadline")
+
+DEADLINE_DEFAULTS = {
+    "DEADLINE_SECONDS": float(os.getenv("DEADLINE_SECONDS", "10")),
+    "DEADLINE_ROUTES": {"/profile": 20.0, "/batch": 20.0},
+    "DEADLINE_HEADER": "X-Request-Timeout",
+}
+"""
+Default config values, any of them can be overridden through create_app.
+
+DEADLINE_SECONDS is the budget of a request, DEADLINE_ROUTES overrides it
+for a route rule. A client can ask for a shorter budget, in seconds, with
+the DEADLINE_HEADER.
+"""
+
+CALL_TIMEOUTS = {"firestore": 5.0, "gcs": 15.0, "azure": 5.0}
+"""
+The longest a single call to each backend may take, even with more time left
+"""
+
+_current_deadline = ContextVar("deadline", default=None)
+_takes_timeout = {}
+
+
+class Deadline:
+    """The time a request, or a background task, has left"""
+
+    __slots__ = ("expires", "failure")
+
+    def __init__(self, seconds: float) -> None:
+        self.expires = time.monotonic() + seconds
+        self.failure = None
+
+    def remaining(self) -> float:
+        """Seconds left, negative once the deadline passed"""
+        return self.expires - time.monotonic()
+
+
+def current_deadline() -> Deadline:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline(seconds: float):
+    """Runs the block with a deadline, for work outside of a request
+
+    Usage:
+        with deadline(5):
+            Database("communities").get("a")
+    """
+    token = _current_deadline.set(Deadline(seconds))
+    try:
+        yield _current_deadline.get()
+    finally:
+        _current_deadline.reset(token)
+
+
+def takes_timeout(function: Callable) -> bool:
+    """Whether a backend call accepts a timeout argument. The pinned clients
+    all do, test doubles like mockfirestore do not. A call without one is
+    logged the first time it is seen, it is not bounded by the deadline.
+
+    Args:
+        function (Callable): the backend call
+
+    Returns:
+        boolean, True when the call has a timeout parameter or takes any keyword
+    """
+    # keyed on the code, lambdas made on each call share it
+    key = getattr(getattr(function, "__func__", function), "__code__", None)
+    if key in _takes_timeout:
+        return _takes_timeout[key]
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        parameters = ()
+    takes = any(p.name == "timeout" or p.kind is p.VAR_KEYWORD for p in parameters)
+    if key is not None:
+        _takes_timeout[key] = takes
+    if not takes:
+        name = getattr(function, "__qualname__", repr(function))
+        logger.warning(json.dumps({"deadline": "no timeout", "call": name}))
+    return takes
+
+
+def call_options(cap: float = None, function: Callable = None) -> Dict[str, Any]:
+    """The keyword arguments giving a backend call the time left as its timeout.
+    Fails fast when no time is left.
+
+    Args:
+        cap (float): the longest a single call may take. Optional.
+        function (Callable): the backend call, no timeout is given when it does
+                             not take one. Optional.
+
+    Returns:
+        Dict[str, Any]: {"timeout": seconds}, empty outside of a request or deadline block
+
+    Raises:
+        DeadlineExceeded when the deadline already passed
+    """
+    current = _current_deadline.get()
+    if current is None:
+        return {}
+
+    remaining = current.remaining()
+    if remaining <= 0:
+        current.failure = "deadline"
+        raise DeadlineExceeded("No time left for the call")
+    if function is not None and not takes_timeout(function):
+        return {}
+    return {"timeout": min(remaining, cap) if cap is not None else remaining}
+
+
+def accepted(function: Callable, options: Dict[str, Any]) -> Dict[str, Any]:
+    """The options given to a wrapper by with_retries, without the timeout
+    when the call it wraps does not take one
+
+    Usage:
+        with_retries("firestore", lambda **options: list(query.stream(**accepted(query.stream, options))))
+    """
+    if "timeout" in options and not takes_timeout(function):
+        return {k: v for k, v in options.items() if k != "timeout"}
+    return options
+
+
+def record_failure(error: Exception) -> None:
+    """Remembers that a backend call of the current request failed for lack of
+    time or availability, so the response becomes a 504 or 503 even when the
+    handler answers otherwise
+
+    Args:
+        error (Exception): the error of the call
+
+    Returns:
+        None
+    """
+    current = _current_deadline.get()
+    if current is None:
+        return
+    if is_timeout(error):
+        current.failure = "deadline"
+    elif isinstance(error, BackendUnavailable) and current.failure is None:
+        current.failure = "unavailable"
+
+
+def failure_response(current: Deadline):
+    """The response of a request whose backend calls ran out of time or
+    availability, or None when none did
+
+    Args:
+        current (Deadline): the deadline the calls were made under
+
+    Returns:
+        An Http 504 or 503, or None
+    """
+    if current is None or current.failure is None:
+        return None
+    if current.failure == "deadline":
+        return http504("Deadline exceeded")
+    return http503("Backend unavailable")
+
+
+def init_deadlines(app) -> None:
+    """Gives every request a deadline from the budget of its route. Backend
+    calls get the time left as their timeout, and a request whose backend
+    call ran out of time is answered with a 504.
+
+    Args:
+        app (flask.Flask): the app to set deadlines on
+
+    Returns:
+        None
+    """
+    for key, value in DEADLINE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.before_request
+    def start_deadline():
+        route = request.url_rule.rule if request.url_rule else None
+        seconds = app.config["DEADLINE_ROUTES"].get(
+            route, app.config["DEADLINE_SECONDS"]
+        )
+        asked = request.headers.get(app.config["DEADLINE_HEADER"])
+        if asked:
+            try:
+                seconds = min(seconds, max(float(asked), 0.0))
+            except ValueError:
+                pass
+        g.deadline_token = _current_deadline.set(Deadline(seconds))
+
+    @app.errorhandler(DeadlineExceeded)
+    def deadline_exceeded(error):
+        return http504("Deadline exceeded")
+
+    @app.errorhandler(BackendUnavailable)
+    def backend_unavailable(error):
+        return http503("Backend unavailable")
+
+    @app.after_request
+    def finish_deadline(response):
+        # handlers turn every error into a 400, the failure recorded by the
+        # backend call says what really happened. Handlers that answered
+        # anyway, ie from a cache, keep their answer.
+        if response.status_code < 400:
+            return response
+        failed = failure_response(_current_deadline.get())
+        return response if failed is None else app.make_response(failed)
+
+    @app.teardown_request
+    def reset_deadline(exception=None):
+        token = g.pop("deadline_token", None)
+        if token is not None:
+            _current_deadline.reset(token)
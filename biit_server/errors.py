@@ -0,0 +1,66 @@
+class BackendError(Exception):
+    """A backend call failed in a way the handler cannot recover from"""
+
+
+class DeadlineExceeded(BackendError):
+    """The request ran out of time before or during a backend call"""
+
+
+class BackendUnavailable(BackendError):
+    """A backend kept failing with errors that are usually temporary"""
+
+
+_TIMEOUT_NAMES = {"DeadlineExceeded", "Timeout", "ReadTimeout", "ConnectTimeout"}
+
+
+def is_timeout(error: Exception) -> bool:
+    """Whether an error means a backend call ran out of time
+
+    Args:
+        error (Exception): raised by a firestore, cloud storage or azure call
+
+    Returns:
+        boolean, True for our DeadlineExceeded, grpc DEADLINE_EXCEEDED and http timeouts
+    """
+    if isinstance(error, (DeadlineExceeded, TimeoutError)):
+        return True
+    # the SDKs are imported lazily, their errors are recognized by name so
+    # checking an error never imports them
+    return any(cls.__name__ in _TIMEOUT_NAMES for cls in type(error).__mro__)
+
+
+_REFUSED_NAMES = {"ServiceUnavailable", "TooManyRequests", "Aborted"}
+"""
+grpc UNAVAILABLE, RESOURCE_EXHAUSTED and ABORTED, and their http counterparts:
+the backend refused the call, so it was not applied
+"""
+
+_TRANSIENT_NAMES = {"InternalServerError", "BadGateway", "GatewayTimeout"}
+"""
+Errors that are usually temporary, but the call may have been applied
+"""
+
+
+def is_retryable(error: Exception, idempotent: bool = True) -> bool:
+    """Whether a failed backend call is worth retrying
+
+    Args:
+        error (Exception): raised by a firestore, cloud storage or azure call
+        idempotent (bool): whether the call can safely be applied twice
+
+    Returns:
+        boolean, True for errors that are usually temporary. Unless the call is
+        idempotent, only errors meaning the call was not applied count.
+    """
+    if isinstance(error, BackendError):
+        return False
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & _REFUSED_NAMES:
+        return True
+    if not idempotent:
+        return False
+    return (
+        bool(names & _TRANSIENT_NAMES)
+        or is_timeout(error)
+        or (isinstance(error, ConnectionError) or "ConnectionError" in names)
+    )
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import queue
+from threading import Lock
+import time
+from typing import Any, Dict, Iterator, Optional
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger("biit_server.events")
+
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "8"))
+"""
+The threads of the gunicorn worker serving the app, see the Dockerfile
+"""
+
+EVENTS_DEFAULTS = {
+    "EVENTS_MAX_SUBSCRIBERS": int(
+        os.getenv("EVENTS_MAX_SUBSCRIBERS", str(WORKER_THREADS // 2))
+    ),
+    "EVENTS_QUEUE_SIZE": 64,
+    "EVENTS_KEEPALIVE": 15.0,
+    "EVENTS_MAX_DURATION": 300.0,
+}
+"""
+Default config values, any of them can be overridden through create_app.
+
+EVENTS_MAX_SUBSCRIBERS caps the streams open on the instance, the next ones
+are answered with a 503. An open stream holds a worker thread until it
+closes, so by default half of the WORKER_THREADS may stream and the others
+keep serving requests. Each stream buffers at most EVENTS_QUEUE_SIZE
+events; a client that falls further behind is sent a resync event and
+disconnected. EVENTS_KEEPALIVE is the seconds between comments keeping
+idle streams open, and a stream is closed after EVENTS_MAX_DURATION so
+clients reconnect before the platform cuts the request.
+"""
+
+EVENTS_PUBLISHED = REGISTRY.counter(
+    "community_events_total", "Community change events sent to streams", ("event",)
+)
+EVENT_STREAMS = REGISTRY.gauge(
+    "community_event_streams", "Community event streams open on the instance"
+)
+
+
+def diff(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+    """The change events between two versions of a community document
+
+    Args:
+        before (Dict[str, Any]): the previous version, None if there was none
+        after (Dict[str, Any]): the new version, None if the community was deleted
+
+    Returns:
+        List[Tuple[str, Dict[str, Any]]]: the name and data of each event
+    """
+    if after is None:
+        return [("deleted", {})] if before is not None else []
+    before = before or {}
+
+    events = []
+    members = before.get("Members") or []
+    current = after.get("Members") or []
+    events += [("joined", {"email": m}) for m in current if m not in members]
+    events += [("left", {"email": m}) for m in members if m not in current]
+
+    bans = {ban.get("name") for ban in before.get("bans") or []}
+    current = {ban.get("name") for ban in after.get("bans") or []}
+    events += [("banned", {"email": m}) for m in sorted(current - bans)]
+    events += [("unbanned", {"email": m}) for m in sorted(bans - current)]
+    return events
+
+
+class Subscriber:
+    def __init__(self, topic: "Topic", queue_size: int) -> None:
+        """The events waiting to be sent to one stream
+
+        Args:
+            topic (Topic): the community the stream follows
+            queue_size (int): the most events buffered for the stream
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.topic = topic
+        self.queue = queue.Queue(queue_size)
+        self.overflowed = False
+
+    def push(self, event: str, data: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait((event, data))
+        except queue.Full:
+            # the client is too slow, it resyncs instead of the buffer growing
+            self.overflowed = True
+
+
+class Topic:
+    def __init__(self, community_id: str, lock: Lock) -> None:
+        """The streams following one community, fed by one snapshot listener
+
+        Args:
+            community_id (str): the community followed
+            lock (Lock): the lock of the hub, held while subscribers change
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.community_id = community_id
+        self.subscribers = set()
+        self._lock = lock
+        self.watch = None
+        self.document = None
+        self.started = False
+
+    def on_snapshot(self, snapshots, changes, read_time) -> None:
+        snapshot = snapshots[0] if snapshots else None
+        document = snapshot.to_dict() if snapshot is not None else None
+        previous, self.document = self.document, document
+        if not self.started:
+            # the first snapshot is the state the stream starts from
+            self.started = True
+            return
+        # the listener thread runs while streams open and close
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for event, data in diff(previous, document):
+            EVENTS_PUBLISHED.inc(event)
+            for subscriber in subscribers:
+                subscriber.push(event, data)
+
+
+class EventHub:
+    def __init__(self, max_subscribers: int, queue_size: int) -> None:
+        """Fans the changes of each community out to every stream following it.
+        A community has one listener on its document while it has streams.
+
+        Args:
+            max_subscribers (int): the most streams open at once
+            queue_size (int): the most events buffered for each stream
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.count = 0
+        self._topics = {}
+        self._lock = Lock()
+
+    def subscribe(self, firestore_client, community_id: str) -> Optional[Subscriber]:
+        """Opens a stream of the changes of a community
+
+        Args:
+            firestore_client (google.cloud.firestore.client): the client listening to the document
+            community_id (str): the community followed
+
+        Returns:
+            Subscriber, None when too many streams are open
+        """
+        with self._lock:
+            if self.count >= self.max_subscribers:
+                return None
+            topic = self._topics.get(community_id)
+            new = topic is None
+            if new:
+                topic = self._topics[community_id] = Topic(community_id, self._lock)
+            subscriber = Subscriber(topic, self.queue_size)
+            topic.subscribers.add(subscriber)
+            self.count += 1
+        EVENT_STREAMS.inc()
+
+        if new:
+            try:
+                document = firestore_client.collection("communities").document(
+                    community_id
+                )
+                topic.watch = document.on_snapshot(topic.on_snapshot)
+            except Exception:
+                self.unsubscribe(subscriber)
+                raise
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Closes a stream, and the listener of its community after the last one.
+        Closing a stream again does nothing."""
+        topic = subscriber.topic
+        with self._lock:
+            if subscriber not in topic.subscribers:
+                return
+            topic.subscribers.discard(subscriber)
+            self.count -= 1
+            last = not topic.subscribers
+            if last:
+                del self._topics[topic.community_id]
+        EVENT_STREAMS.inc(amount=-1)
+        if last and topic.watch is not None:
+            try:
+                topic.watch.unsubscribe()
+            except Exception as e:
+                logger.warning(
+                    json.dumps({"unlisten": topic.community_id, "error": repr(e)})
+                )
+
+
+def format_event(event: str, data: Dict[str, Any]) -> str:
+    """Formats one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream(
+    hub: EventHub, subscriber: Subscriber, keepalive: float, max_duration: float
+) -> Iterator[str]:
+    """The body of a server-sent events response, unsubscribes when it ends
+
+    Args:
+        hub (EventHub): the hub the subscriber belongs to
+        subscriber (Subscriber): the stream
+        keepalive (float): seconds between comments sent while idle
+        max_duration (float): seconds before the stream is closed
+
+    Returns:
+        Iterator[str]: the chunks of the body
+    """
+    end = time.monotonic() + max_duration
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            left = end - time.monotonic()
+            if left <= 0:
+                return
+            try:
+                event, data = subscriber.queue.get(timeout=min(keepalive, left))
+            except queue.Empty:
+                if subscriber.overflowed:
+                    yield format_event("resync", {})
+                    return
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event, data)
+            if subscriber.overflowed and subscriber.queue.empty():
+                yield format_event("resync", {})
+                return
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+def init_events(app) -> EventHub:
+    """Creates the event hub of an app
+
+    Args:
+        app (flask.Flask): the app streaming community changes
+
+    Returns:
+        EventHub: the hub, also kept in app.extensions["events"]
+    """
+    for key, value in EVENTS_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    hub = EventHub(
+        app.config["EVENTS_MAX_SUBSCRIBERS"], app.config["EVENTS_QUEUE_SIZE"]
+    )
+    app.extensions["events"] = hub
+    return hub
@@ -0,0 +1,122 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+import os
+from threading import Lock
+import time
+from typing import Callable
+
+from .metrics import FIRESTORE_READS, HEDGED_READS
+from .retry import RetryBudget
+
+HEDGE_COLLECTIONS = {
+    name for name in os.getenv("HEDGE_COLLECTIONS", "").split(",") if name
+}
+"""
+The collections whose document reads are hedged, ie "communities,accounts".
+Hedging is off when empty.
+"""
+
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.05"))
+"""
+A second read is sent once the first one is slower than HEDGE_PERCENTILE of
+recent reads of the collection, for at most HEDGE_MAX_RATE of the reads.
+"""
+
+HEDGE_MIN_DELAY = 0.005
+HEDGE_DEFAULT_DELAY = 0.1
+HEDGE_MIN_SAMPLES = 50
+"""
+The delay is HEDGE_DEFAULT_DELAY until HEDGE_MIN_SAMPLES reads were measured,
+and never below HEDGE_MIN_DELAY
+"""
+
+_reads = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedged-read")
+
+
+class LatencyWindow:
+    def __init__(self, size: int = 1000, refresh: int = 50) -> None:
+        """The latencies of the last reads of a collection, to pick the hedge delay from
+
+        Args:
+            size (int): how many reads are kept
+            refresh (int): how many new reads between two computations of the percentile
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.refresh = refresh
+        self._samples = deque(maxlen=size)
+        self._lock = Lock()
+        self._since = 0
+        self._delay = HEDGE_DEFAULT_DELAY
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self._since += 1
+            if self._since < self.refresh or len(self._samples) < HEDGE_MIN_SAMPLES:
+                return
+            self._since = 0
+            ordered = sorted(self._samples)
+        index = min(int(len(ordered) * HEDGE_PERCENTILE), len(ordered) - 1)
+        self._delay = max(ordered[index], HEDGE_MIN_DELAY)
+
+    def delay(self) -> float:
+        """Seconds to wait for a read before hedging it"""
+        return self._delay
+
+
+_windows = {}
+_budget = RetryBudget(ratio=HEDGE_MAX_RATE, minimum=1)
+
+
+def _window(collection: str) -> LatencyWindow:
+    window = _windows.get(collection)
+    if window is None:
+        window = _windows.setdefault(collection, LatencyWindow())
+    return window
+
+
+def _timed_read(window: LatencyWindow, read: Callable):
+    start = time.perf_counter()
+    result = read()
+    window.add(time.perf_counter() - start)
+    return result
+
+
+def hedged(collection: str, read: Callable):
+    """Makes an idempotent read, and a second identical one when the first
+    is slower than usual. The answer of whichever finishes first is returned.
+
+    Args:
+        collection (str): the collection read, picks the delay and labels metrics
+        read (Callable): the read, called without arguments
+
+    Returns:
+        What the read returns
+
+    Raises:
+        The error of the read when every read made failed
+    """
+    window = _window(collection)
+    _budget.deposit()
+    first = _reads.submit(copy_context().run, _timed_read, window, read)
+    done, _ = wait([first], timeout=window.delay())
+    if done or not _budget.withdraw():
+        return first.result()
+
+    HEDGED_READS.inc(collection, "fired")
+    FIRESTORE_READS.inc(collection)
+    second = _reads.submit(copy_context().run, read)
+    pending = {first, second}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        succeeded = [future for future in done if future.exception() is None]
+        if succeeded:
+            if first not in succeeded:
+                HEDGED_READS.inc(collection, "won")
+            return succeeded[0].result()
+    return first.result()
@@ -1,15 +1,53 @@
 from flask import jsonify
 from typing import Dict, Any
+import hashlib
+
+from .timing import span
 
 
 def http405():
     return "Method not allowed", 405
 
 
+def http304(access_token: str = None, refresh_token: str = None):
+    """An empty Not Modified response. A 304 has no body, so the refreshed
+    tokens are sent in the X-Access-Token and X-Refresh-Token headers."""
+    headers = {}
+    if access_token is not None:
+        headers["X-Access-Token"] = access_token
+    if refresh_token is not None:
+        headers["X-Refresh-Token"] = refresh_token
+    return "", 304, headers
+
+
 def http400(description: str):
     return f"Bad Request: {description}", 400
 
 
+def http404(description: str):
+    return f"Not Found: {description}", 404
+
+
+def http411(description: str):
+    return f"Length Required: {description}", 411
+
+
+def http413(description: str):
+    return f"Payload Too Large: {description}", 413
+
+
+def http429(description: str, retry_after: int):
+    return f"Too Many Requests: {description}", 429, {"Retry-After": str(retry_after)}
+
+
+def http503(description: str):
+    return f"Service Unavailable: {description}", 503
+
+
+def http504(description: str):
+    return f"Gateway Timeout: {description}", 504
+
+
 def http200(description: str = ""):
     if description == "":
         return "OK", 200
@@ -29,4 +67,20 @@ def jsonHttp200(message: str, data: Dict[str, Any]):
     response = data
     response["message"] = message
     response["status_code"] = 200
-    return jsonify(response)
+    with span("json"):
+        return jsonify(response)
+
+
+def document_etag(collection: str, id: str, update_time) -> str:
+    """Builds the ETag of a firestore document
+
+    Args:
+        collection (str): Collection the document is in
+        id (str): Id of the document
+        update_time: update_time of the document snapshot
+
+    Returns:
+        str: An opaque tag that changes whenever the document changes
+    """
+    key = f"{collection}/{id}@{update_time}".encode("utf-8")
+    return hashlib.sha1(key).hexdigest()
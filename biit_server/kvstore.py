@@ -0,0 +1,238 @@
+from threading import Lock
+import time
+from typing import Any, List, Optional, Tuple
+
+
+def encode_versioned(version: float, value: str) -> str:
+    """Prefixes a value with its version, the way set_versioned stores it"""
+    return f"{version!r}|{value}"
+
+
+def decode_versioned(raw) -> Tuple[Optional[float], Optional[str]]:
+    """Splits a value stored by set_versioned
+
+    Args:
+        raw (str, bytes): the stored value, None when the key is missing
+
+    Returns:
+        Tuple[float, str]: the version and the value, (None, None) for a missing key
+    """
+    if raw is None:
+        return None, None
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8")
+    version, _, value = raw.partition("|")
+    return float(version), value
+
+
+class MemoryStore:
+    def __init__(self) -> None:
+        """An in-process key-value store with expiring keys.
+        Stands in for a shared store in tests and single instance deployments.
+        """
+        super().__init__()
+        self._data = {}
+        self._lock = Lock()
+
+    def _live(self, key: str):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key: str) -> Any:
+        """Helper function to get a value from the store.
+
+        Args:
+            key (str): the key of the value
+
+        Returns:
+            The value, or None if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Helper function to store a value.
+
+        Args:
+            key (str): the key to store the value under
+            value (Any): the value
+            ttl (float): seconds until the key expires. Optional.
+
+        Returns:
+            None
+        """
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+
+    def delete(self, key: str) -> None:
+        """Helper function to remove a key from the store."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Helper function to atomically increment a counter.
+        The expiry is only set when the counter is created.
+
+        Args:
+            key (str): the key of the counter
+            amount (int): how much to add
+            ttl (float): seconds until a new counter expires. Optional.
+
+        Returns:
+            int: the value after the increment
+        """
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                expires = time.monotonic() + ttl if ttl is not None else None
+                entry = (0, expires)
+            value = entry[0] + amount
+            self._data[key] = (value, entry[1])
+            return value
+
+    def mget(self, keys: List[str]) -> List[Any]:
+        """Helper function to get several values at once.
+
+        Args:
+            keys (List[str]): the keys of the values
+
+        Returns:
+            List[Any]: the value of each key, None for missing or expired ones
+        """
+        with self._lock:
+            entries = [self._live(key) for key in keys]
+        return [entry[0] if entry is not None else None for entry in entries]
+
+    def set_versioned(
+        self, key: str, value: str, version: float, ttl: Optional[float] = None
+    ) -> bool:
+        """Helper function to store a value unless a newer version is stored.
+        Read the value back with get or mget and decode_versioned.
+
+        Args:
+            key (str): the key to store the value under
+            value (str): the value
+            version (float): the version of the value
+            ttl (float): seconds until the key expires. Optional.
+
+        Returns:
+            boolean, False if the stored version is the same or newer
+        """
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None and decode_versioned(entry[0])[0] >= version:
+                return False
+            self._data[key] = (encode_versioned(version, value), expires)
+            return True
+
+    def ping(self) -> bool:
+        return True
+
+
+class RedisStore:
+    def __init__(self, url: str = None, client=None, prefix: str = "biit:") -> None:
+        """A key-value store shared by every instance, spoken to over the Redis protocol.
+        Works with Redis, Memorystore or any local stand-in speaking the protocol.
+
+        Args:
+            url (str): a redis:// url. Ignored when a client is given.
+            client (redis.Redis): A redis client object, or a mock test object. Optional.
+            prefix (str): prepended to every key
+
+        Returns:
+            None
+        """
+        super().__init__()
+        if client is None:
+            # only needed when a shared store is configured
+            import redis
+
+            client = redis.Redis.from_url(url, socket_timeout=0.25)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Any:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        px = int(ttl * 1000) if ttl is not None else None
+        self.client.set(self.prefix + key, value, px=px)
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        key = self.prefix + key
+        if ttl is None:
+            return self.client.incrby(key, amount)
+        # SET NX only creates a missing counter, with its expiry. MULTI runs
+        # both together, so the counter cannot expire between them.
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(key, 0, px=int(ttl * 1000), nx=True)
+        pipe.incrby(key, amount)
+        return pipe.execute()[1]
+
+    _SET_VERSIONED = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local version = tonumber(string.match(current, '^[^|]*'))
+    if version and version >= tonumber(ARGV[1]) then
+        return 0
+    end
+end
+if ARGV[3] == '' then
+    redis.call('SET', KEYS[1], ARGV[2])
+else
+    redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+end
+return 1
+"""
+
+    def mget(self, keys: List[str]) -> List[Any]:
+        if not keys:
+            return []
+        return self.client.mget([self.prefix + key for key in keys])
+
+    def set_versioned(
+        self, key: str, value: str, version: float, ttl: Optional[float] = None
+    ) -> bool:
+        # compared and set by the server in one step, so no older version
+        # written by another instance can win
+        px = str(int(ttl * 1000)) if ttl is not None else ""
+        stored = self.client.eval(
+            self._SET_VERSIONED,
+            1,
+            self.prefix + key,
+            repr(version),
+            encode_versioned(version, value),
+            px,
+        )
+        return bool(stored)
+
+    def ping(self) -> bool:
+        return bool(self.client.ping())
+
+
+def store_from_url(url: Optional[str]):
+    """Builds the store described by a url
+
+    Args:
+        url (str): "memory://" or a redis:// url. Optional.
+
+    Returns:
+        MemoryStore or RedisStore, or None when no url is given
+    """
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return MemoryStore()
+    return RedisStore(url)
@@ -0,0 +1,192 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+from threading import Lock
+
+from .cache import LRUCache
+from .metrics import CACHE_REQUESTS, REGISTRY
+
+logger = logging.getLogger("biit_server.listeners")
+
+LISTEN_COLLECTIONS = {
+    name for name in os.getenv("LISTEN_COLLECTIONS", "").split(",") if name
+}
+"""
+The collections whose hottest documents are kept current by snapshot
+listeners, ie "communities". Listening is off when empty.
+"""
+
+LISTEN_MAX_DOCUMENTS = int(os.getenv("LISTEN_MAX_DOCUMENTS", "100"))
+LISTEN_MIN_READS = int(os.getenv("LISTEN_MIN_READS", "5"))
+LISTEN_WINDOW = 60.0
+"""
+A document read LISTEN_MIN_READS times within LISTEN_WINDOW seconds gets a
+listener. At most LISTEN_MAX_DOCUMENTS are listened to, the least recently
+read one stops being listened to first.
+"""
+
+
+_FRESH = object()
+
+
+class _Listener:
+    __slots__ = ("client", "watch", "snapshot", "stale")
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.watch = None
+        self.snapshot = None
+        # the update_time of the copy when this process last wrote the document
+        self.stale = _FRESH
+
+
+class DocumentListeners:
+    def __init__(
+        self,
+        max_documents: int = LISTEN_MAX_DOCUMENTS,
+        min_reads: int = LISTEN_MIN_READS,
+        window: float = LISTEN_WINDOW,
+    ) -> None:
+        """Keeps a local copy of the hottest documents, updated by Firestore
+        snapshot listeners, so reading them costs no call to Firestore.
+
+        Args:
+            max_documents (int): the most documents listened to at once
+            min_reads (int): the reads within window that make a document hot
+            window (float): seconds reads of a document are counted for
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.max_documents = max_documents
+        self.min_reads = min_reads
+        self._reads = LRUCache(max_size=max_documents * 16, ttl=window)
+        self._listeners = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, client, collection: str, id):
+        """The local copy of a document, counting the read towards listening to it
+
+        Args:
+            client (google.cloud.firestore.client): the client reading the document
+            collection (str): the collection of the document
+            id (str): the id of the document
+
+        Returns:
+            The snapshot of the document, None when it is not listened to yet
+            or its copy may be older than a write of this process
+        """
+        key = (collection, id)
+        with self._lock:
+            listener = self._listeners.get(key)
+            if listener is not None:
+                self._listeners.move_to_end(key)
+        if listener is not None:
+            if listener.client is not client:
+                return None
+            active = getattr(listener.watch, "is_active", True)
+            if active and listener.snapshot is not None and listener.stale is _FRESH:
+                CACHE_REQUESTS.inc("listeners", "hit")
+                return listener.snapshot
+            CACHE_REQUESTS.inc("listeners", "miss")
+            if not active:
+                self.stop(key)
+            return None
+
+        reads = self._reads.get(key, 0) + 1
+        self._reads.set(key, reads)
+        if reads >= self.min_reads:
+            self.listen(client, collection, id)
+        return None
+
+    def listen(self, client, collection: str, id) -> None:
+        """Starts listening to a document, and stops listening to the least
+        recently read one when too many are listened to"""
+        key = (collection, id)
+        listener = _Listener(client)
+        with self._lock:
+            if key in self._listeners:
+                return
+            self._listeners[key] = listener
+            evicted = []
+            while len(self._listeners) > self.max_documents:
+                evicted.append(self._listeners.popitem(last=False))
+        for evicted_key, evicted_listener in evicted:
+            self._unsubscribe(evicted_key, evicted_listener)
+
+        def on_snapshot(snapshots, changes, read_time):
+            snapshot = snapshots[0] if snapshots else None
+            version = snapshot.update_time if snapshot is not None else None
+            if listener.stale is not _FRESH and version == listener.stale:
+                return
+            listener.stale = _FRESH
+            listener.snapshot = snapshot
+
+        try:
+            listener.watch = (
+                client.collection(collection).document(id).on_snapshot(on_snapshot)
+            )
+            with self._lock:
+                evicted = self._listeners.get(key) is not listener
+            if evicted:
+                # evicted by another thread before the watch was set
+                self._unsubscribe(key, listener)
+        except Exception as e:
+            logger.warning(
+                json.dumps({"listen": f"{collection}/{id}", "error": repr(e)})
+            )
+            with self._lock:
+                if self._listeners.get(key) is listener:
+                    del self._listeners[key]
+
+    def written(self, key) -> None:
+        """Stops serving the local copy of a document this process wrote to,
+        until the listener brings another version
+
+        Args:
+            key (Tuple[str, Any]): (collection, id) of the document
+
+        Returns:
+            None
+        """
+        listener = self._listeners.get(key)
+        if listener is not None:
+            snapshot = listener.snapshot
+            listener.stale = snapshot.update_time if snapshot is not None else None
+
+    def stop(self, key) -> None:
+        with self._lock:
+            listener = self._listeners.pop(key, None)
+        if listener is not None:
+            self._unsubscribe(key, listener)
+
+    def _unsubscribe(self, key, listener: _Listener) -> None:
+        try:
+            if listener.watch is not None:
+                listener.watch.unsubscribe()
+        except Exception as e:
+            logger.warning(
+                json.dumps({"unlisten": "/".join(map(str, key)), "error": repr(e)})
+            )
+
+    def clear(self) -> None:
+        """Stops every listener"""
+        with self._lock:
+            listeners, self._listeners = self._listeners, OrderedDict()
+        for key, listener in listeners.items():
+            self._unsubscribe(key, listener)
+        self._reads.clear()
+
+    def __len__(self) -> int:
+        return len(self._listeners)
+
+
+_listeners = DocumentListeners()
+
+REGISTRY.gauge(
+    "firestore_listeners",
+    "Documents kept current by snapshot listeners",
+    function=lambda: len(_listeners),
+)
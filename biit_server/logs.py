@@ -0,0 +1,156 @@
+import atexit
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import sys
+import time
+from typing import List
+
+from .metrics import REGISTRY
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+"""
+The most records waiting for the flusher, so logging memory stays bounded
+"""
+
+LOG_DROPPED = REGISTRY.counter(
+    "log_records_dropped_total", "Log records dropped by a full queue", ("level",)
+)
+
+_listener = None
+
+
+def _queue_depth() -> int:
+    listener = _listener
+    return listener.queue.qsize() if listener is not None else 0
+
+
+LOG_QUEUE_DEPTH = REGISTRY.gauge(
+    "log_queue_depth", "Log records waiting for the flusher", function=_queue_depth
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as the json lines Cloud Logging reads from stdout.
+    Messages that are json objects are merged into the entry."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        entry = {"severity": record.levelname, "logger": record.name}
+        if message.startswith("{"):
+            try:
+                entry.update(json.loads(message))
+            except ValueError:
+                entry["message"] = message
+        else:
+            entry["message"] = message
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class NonBlockingHandler(QueueHandler):
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE) -> None:
+        """Hands records to the flusher thread without waiting.
+
+        When the queue is full, info and debug records are dropped. A warning
+        or error evicts the oldest waiting record instead. Drops are counted
+        in the log_records_dropped_total metric.
+
+        Args:
+            queue_size (int): the most records waiting for the flusher
+        """
+        super().__init__(queue.Queue(queue_size))
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting is left to the flusher, only the arguments are resolved
+        # here since they may change once the request thread moves on
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+
+        if record.levelno >= logging.WARNING:
+            try:
+                evicted = self.queue.get_nowait()
+                LOG_DROPPED.inc(evicted.levelname)
+                self.queue.put_nowait(record)
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        LOG_DROPPED.inc(record.levelname)
+
+
+def start_logging(
+    handlers: List[logging.Handler] = None,
+    level: int = logging.INFO,
+    queue_size: int = LOG_QUEUE_SIZE,
+) -> QueueListener:
+    """Routes every log record through a bounded queue to a background flusher,
+    so request threads never wait on log I/O. Replaces the handlers of the
+    root logger, calling it again replaces the previous pipeline.
+
+    Args:
+        handlers (List[logging.Handler]): where the flusher writes records.
+                                          Optional, json lines on stdout when not set.
+        level (int): the lowest level logged
+        queue_size (int): the most records waiting for the flusher
+
+    Returns:
+        logging.handlers.QueueListener: the running flusher
+    """
+    global _listener
+
+    if handlers is None:
+        stdout = logging.StreamHandler(sys.stdout)
+        stdout.setFormatter(JsonFormatter())
+        handlers = [stdout]
+
+    stop_logging()
+    handler = NonBlockingHandler(queue_size)
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging() -> None:
+    """Flushes the waiting records and stops the flusher"""
+    global _listener
+
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, NonBlockingHandler):
+            root.removeHandler(handler)
+
+    while True:
+        try:
+            listener.stop()
+            return
+        except queue.Full:
+            # the flusher is still draining a full queue
+            time.sleep(0.01)
+
+
+# records still waiting at shutdown are written before the process exits
+atexit.register(stop_logging)
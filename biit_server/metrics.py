@@ -0,0 +1,455 @@
+from bisect import bisect_left
+import glob
+import hmac
+import json
+import os
+import re
+import tempfile
+from threading import Lock, local
+from time import monotonic, perf_counter
+from typing import Callable, Dict, List, Tuple
+import weakref
+
+from flask import Response, g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""
+Default latency histogram buckets, in seconds
+"""
+
+METRICS_DEFAULTS = {
+    "METRICS_ENABLED": True,
+    "METRICS_DIR": os.getenv("METRICS_DIR"),
+    "METRICS_FLUSH_INTERVAL": 5.0,
+    "METRICS_TOKEN": os.getenv("METRICS_TOKEN"),
+}
+"""
+Default config values, any of them can be overridden through create_app.
+Set METRICS_DIR to a directory shared by every gunicorn worker to have
+/metrics report the totals of all of them. /metrics is only served to
+requests with an "Authorization: Bearer <METRICS_TOKEN>" header, or only
+to requests from the local host when METRICS_TOKEN is not set.
+"""
+
+
+class _Owner:
+    """Held by the thread local of a thread, collected when the thread exits"""
+
+    __slots__ = ("values", "__weakref__")
+
+    def __init__(self, values: Dict) -> None:
+        self.values = values
+
+
+class _Metric:
+    """Base class of metrics. Every thread updates its own shard so
+    updates never wait on a lock, shards are only summed when scraped.
+    The shard of a thread that exited is folded into one shared shard, so
+    threads of executor pools coming and going do not add up."""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = local()
+        self._retired = {}
+        self._shards = [self._retired]
+        self._lock = Lock()
+
+    def _shard(self) -> Dict:
+        try:
+            return self._local.owner.values
+        except AttributeError:
+            values = {}
+            owner = self._local.owner = _Owner(values)
+            with self._lock:
+                self._shards.append(values)
+            weakref.finalize(owner, self._release, values)
+            return values
+
+    def _release(self, values: Dict) -> None:
+        # the thread is gone, nothing updates its shard anymore
+        with self._lock:
+            self._shards = [shard for shard in self._shards if shard is not values]
+            self._fold(self._retired, values)
+
+    def _fold(self, target: Dict, values: Dict) -> None:
+        for labels, value in values.items():
+            target[labels] = target.get(labels, 0) + value
+
+    def _copies(self) -> List[Dict]:
+        with self._lock:
+            shards = list(self._shards)
+            # the retired shard is only changed under the lock
+            retired = self._retired.copy()
+        # dict.copy is atomic, so a shard can be copied while its thread updates it
+        return [retired] + [shard.copy() for shard in shards[1:]]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        """Increments the counter
+
+        Args:
+            *labels: the label values, in the order of labelnames
+            amount (float): how much to add. Optional.
+
+        Returns:
+            None
+        """
+        values = self._shard()
+        values[labels] = values.get(labels, 0) + amount
+
+    def collect(self) -> Dict[Tuple, float]:
+        """Sums every shard of the counter
+
+        Returns:
+            Dict[Tuple, float]: the value of each set of labels
+        """
+        totals = {}
+        for shard in self._copies():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), function: Callable = None):
+        """A gauge is either incremented like a counter or read from a function when scraped
+
+        Args:
+            function (Callable): returns the current value of the gauge. Optional.
+        """
+        super().__init__(name, help, labelnames)
+        self.function = function
+
+    def collect(self) -> Dict[Tuple, float]:
+        if self.function is not None:
+            return {(): self.function()}
+        return super().collect()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        """Records one observation
+
+        Args:
+            value (float): the observed value
+            *labels: the label values, in the order of labelnames
+
+        Returns:
+            None
+        """
+        values = self._shard()
+        entry = values.get(labels)
+        if entry is None:
+            entry = values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def _fold(self, target: Dict, values: Dict) -> None:
+        for labels, (counts, total, count) in values.items():
+            entry = target.get(labels)
+            if entry is None:
+                target[labels] = [list(counts), total, count]
+                continue
+            # a new entry, collect may be copying the previous one
+            target[labels] = [
+                [a + b for a, b in zip(entry[0], counts)],
+                entry[1] + total,
+                entry[2] + count,
+            ]
+
+    def collect(self) -> Dict[Tuple, list]:
+        """Sums every shard of the histogram
+
+        Returns:
+            Dict[Tuple, list]: [bucket counts, sum, count] of each set of labels
+        """
+        totals = {}
+        for shard in self._copies():
+            for labels, (counts, total, count) in shard.items():
+                entry = totals.setdefault(
+                    labels, [[0] * (len(self.buckets) + 1), 0.0, 0]
+                )
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+        return totals
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        """Holds every metric of the process and renders them for scraping"""
+        super().__init__()
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames=(), function=None) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, function))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Collects the current value of every metric
+
+        Returns:
+            Dict[str, dict]: a json serializable snapshot of the registry
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        snapshot = {}
+        for metric in metrics:
+            snapshot[metric.name] = {
+                "kind": metric.kind,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": [[list(k), v] for k, v in metric.collect().items()],
+            }
+        return snapshot
+
+    def write_snapshot(self, directory: str) -> None:
+        """Writes the snapshot of this process to a shared directory
+
+        Args:
+            directory (str): the directory every worker process writes to
+
+        Returns:
+            None
+        """
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path, os.path.join(directory, f"metrics-{os.getpid()}.json"))
+
+    def render(self, directory: str = None) -> str:
+        """Renders the registry in the prometheus text format
+
+        Args:
+            directory (str): a directory of worker snapshots to add up. Optional.
+
+        Returns:
+            str: the text to serve on /metrics
+        """
+        snapshots = [self.snapshot()]
+        if directory:
+            own = os.path.join(directory, f"metrics-{os.getpid()}.json")
+            for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+                if path == own:
+                    continue
+                if not _alive(path):
+                    # a worker that exited, its requests are not counted anymore
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+
+        return _render(_merge(snapshots))
+
+
+def _alive(path: str) -> bool:
+    """Whether the worker process that wrote a snapshot is still running"""
+    match = re.search(r"metrics-(\d+)\.json$", path)
+    if match is None:
+        return False
+    try:
+        os.kill(int(match.group(1)), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # the process exists but belongs to another user
+        pass
+    return True
+
+
+def _merge(snapshots: List[Dict[str, dict]]) -> Dict[str, dict]:
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, samples={}))
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if metric["kind"] == "histogram":
+                    entry = target["samples"].setdefault(
+                        key, [[0] * len(value[0]), 0.0, 0]
+                    )
+                    entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                    entry[1] += value[1]
+                    entry[2] += value[2]
+                else:
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+    return merged
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _render(merged: Dict[str, dict]) -> str:
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        names = metric["labelnames"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for labels, value in sorted(metric["samples"].items()):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(names, labels)} {value}")
+                continue
+
+            counts, total, count = value
+            cumulative = 0
+            bounds = [str(bucket) for bucket in metric["buckets"]] + ["+Inf"]
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                le = _format_labels(names, labels, f'le="{bound}"')
+                lines.append(f"{name}_bucket{le} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(names, labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(names, labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+"""
+The registry every module of the app records its metrics in
+"""
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Requests handled", ("route", "method", "status")
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Request latency", ("route", "method")
+)
+FIRESTORE_READS = REGISTRY.counter(
+    "firestore_reads_total", "Billed firestore document reads", ("collection",)
+)
+FIRESTORE_WRITES = REGISTRY.counter(
+    "firestore_writes_total", "Billed firestore document writes", ("collection",)
+)
+GCS_BYTES = REGISTRY.counter(
+    "gcs_bytes_total", "Bytes moved to and from cloud storage", ("direction",)
+)
+AZURE_REFRESHES = REGISTRY.counter(
+    "azure_refresh_total", "Azure token refreshes", ("outcome",)
+)
+AZURE_LATENCY = REGISTRY.histogram(
+    "azure_refresh_duration_seconds", "Azure token refresh latency"
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests_total", "Cache lookups", ("cache", "result")
+)
+COALESCED_CALLS = REGISTRY.counter(
+    "coalesced_calls_total",
+    "Calls made by a leader, or shared with one by a follower",
+    ("name", "role"),
+)
+HEDGED_READS = REGISTRY.counter(
+    "firestore_hedged_reads_total",
+    "Second reads sent for slow firestore reads, and how many answered first",
+    ("collection", "result"),
+)
+BACKEND_RETRIES = REGISTRY.counter(
+    "backend_retries_total", "Retried backend calls", ("backend", "error")
+)
+BACKEND_GIVEUPS = REGISTRY.counter(
+    "backend_giveups_total",
+    "Backend calls that failed with a retryable error and were not retried",
+    ("backend", "reason"),
+)
+
+
+def _allowed(token: str) -> bool:
+    """Whether the current request may read /metrics"""
+    if token:
+        expected = f"Bearer {token}".encode("utf-8")
+        given = request.headers.get("Authorization", "").encode("utf-8")
+        return hmac.compare_digest(given, expected)
+    return request.remote_addr in ("127.0.0.1", "::1")
+
+
+def init_metrics(app) -> None:
+    """Registers request metrics and the /metrics route on an app
+
+    Args:
+        app (flask.Flask): the app to record the requests of
+
+    Returns:
+        None
+    """
+    for key, value in METRICS_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    last_flush = [0.0]
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+        HTTP_LATENCY.observe(perf_counter() - start, route, request.method)
+
+        directory = app.config["METRICS_DIR"]
+        if (
+            directory
+            and monotonic() - last_flush[0] > app.config["METRICS_FLUSH_INTERVAL"]
+        ):
+            last_flush[0] = monotonic()
+            REGISTRY.write_snapshot(directory)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_route():
+        if not _allowed(app.config["METRICS_TOKEN"]):
+            return "Forbidden", 403
+        return Response(
+            REGISTRY.render(app.config["METRICS_DIR"]),
+            mimetype="text/plain",
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
@@ -0,0 +1,147 @@
+import cProfile
+import hmac
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import time
+from threading import Lock
+from typing import Dict, List
+
+from flask import g, request
+
+logger = logging.getLogger("biit_server.profiler")
+
+PROFILE_DEFAULTS = {
+    "PROFILE_SAMPLE_RATE": float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    "PROFILE_HEADER": "X-Biit-Profile",
+    "PROFILE_SECRET": os.getenv("PROFILE_SECRET"),
+    "PROFILE_DIR": os.getenv("PROFILE_DIR"),
+    "PROFILE_TOP": 20,
+}
+"""
+Default config values, any of them can be overridden through create_app.
+Profiling is off unless PROFILE_SAMPLE_RATE is above 0 or PROFILE_SECRET
+is set and sent in the PROFILE_HEADER of a request.
+"""
+
+_profile_lock = Lock()
+"""
+Only one request per process is profiled at a time, so concurrent
+profiles never distort each other
+"""
+
+
+def _route_slug(route: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+
+
+def top_functions(profiler: cProfile.Profile, limit: int) -> List[Dict]:
+    """Summarizes a profile as the functions with the most cumulative time
+
+    Args:
+        profiler (cProfile.Profile): a finished profile
+        limit (int): how many functions to return
+
+    Returns:
+        List[Dict]: function, calls, own time and cumulative time in milliseconds
+    """
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda row: row[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{os.path.basename(file)}:{line}({name})",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        }
+        for (file, line, name), (_, calls, own, cumulative, _) in rows
+    ]
+
+
+def _should_profile(config) -> bool:
+    secret = config["PROFILE_SECRET"]
+    header = request.headers.get(config["PROFILE_HEADER"])
+    if secret and header and hmac.compare_digest(header, secret):
+        g.profile_requested = True
+        return True
+    rate = config["PROFILE_SAMPLE_RATE"]
+    return rate > 0 and random.random() < rate
+
+
+def init_profiler(app) -> None:
+    """Registers the sampling profiler hook on an app
+
+    Sampled requests are profiled with cProfile. The top functions are
+    logged tagged with the route, and the full profile is written to
+    PROFILE_DIR when it is set. Requests that asked for a profile with
+    the secret header also get the top functions back in a header.
+
+    Args:
+        app (flask.Flask): the app to profile the requests of
+
+    Returns:
+        None
+    """
+    for key, value in PROFILE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.before_request
+    def start_profile():
+        if not _should_profile(app.config):
+            return
+        if not _profile_lock.acquire(blocking=False):
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiling tool is already running
+            _profile_lock.release()
+            return
+        g.profiler = profiler
+
+    @app.after_request
+    def finish_profile(response):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return response
+
+        profiler.disable()
+        _profile_lock.release()
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        top = top_functions(profiler, app.config["PROFILE_TOP"])
+        logger.info(
+            json.dumps(
+                {
+                    "route": route,
+                    "method": request.method,
+                    "status": response.status_code,
+                    "top": top,
+                }
+            )
+        )
+
+        directory = app.config["PROFILE_DIR"]
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            name = f"{_route_slug(route)}-{request.method}-{time.time_ns()}-{os.getpid()}.prof"
+            profiler.dump_stats(os.path.join(directory, name))
+
+        if g.pop("profile_requested", False):
+            response.headers["X-Biit-Profile-Top"] = ", ".join(
+                f"{row['function']}={row['cumulative_ms']}ms" for row in top[:5]
+            )
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exception=None):
+        # in case the request failed before after_request ran
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
@@ -1,25 +1,7 @@
-from .http_responses import http200, http400
+import base64
+import json
 import re
-
-
-def validate_body(body, fields):
-    """
-    Validates that the given fields exist in the body
-    """
-    for field in fields:
-        if field not in body:
-            return http400(f"Missing field {field} in request")
-    return http200()
-
-
-def validate_query_params(query_params, fields):
-    """
-    Validates that the given fields exist in the body
-    """
-    for field in fields:
-        if field not in query_params:
-            return http400(f"Missing query parameter {field}")
-    return http200()
+from typing import Any, List, Optional, Tuple
 
 
 def validate_photo(filename: str):
@@ -35,3 +17,83 @@ def validate_photo(filename: str):
     if not re.match("([A-Za-z0-9])*.(jpg|png)", filename):
         return False
     return True
+
+
+def parse_fields(query_params, allowed: List[str]) -> Optional[List[str]]:
+    """Reads the comma separated fields query parameter
+
+    Args:
+        query_params: the query parameters of the request
+        allowed (List[str]): the fields that can be asked for
+
+    Returns:
+        (List[str]): The fields asked for, None when every field is wanted
+
+    Raises:
+        ValueError when a field is not allowed
+    """
+    if "fields" not in query_params:
+        return None
+    fields = [field.strip() for field in query_params["fields"].split(",")]
+    fields = [field for field in fields if field]
+    for field in fields:
+        if field not in allowed:
+            raise ValueError(f"Unknown field {field}")
+    return fields
+
+
+def encode_cursor(position: int, last: Any) -> str:
+    """Builds the opaque cursor of the page ending with last at position"""
+    raw = json.dumps([position, last]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, Any]:
+    """Reads a cursor built by encode_cursor
+
+    Raises:
+        ValueError when the cursor is malformed
+    """
+    try:
+        position, last = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return int(position), last
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def paginate(
+    items: List[Any], cursor: Optional[str], limit: int
+) -> Tuple[List[Any], Optional[str]]:
+    """Returns one page of a list
+
+    The cursor remembers the last item of the previous page as well as its
+    position, so a page starts in the right place even after items before it
+    were removed.
+
+    Args:
+        items (List[Any]): the whole list
+        cursor (str): the cursor returned with the previous page, None for the first page
+        limit (int): the most items in the page
+
+    Returns:
+        (Tuple[List[Any], str]): The page and the cursor of the next page, None on the last page
+
+    Raises:
+        ValueError when the cursor is malformed
+    """
+    start = 0
+    if cursor:
+        position, last = decode_cursor(cursor)
+
+        if 0 < position <= len(items) and items[position - 1] == last:
+            start = position
+        elif last in items:
+            start = items.index(last) + 1
+        else:
+            start = min(max(position, 0), len(items))
+
+    end = start + limit
+    page = items[start:end]
+    if end >= len(items):
+        return page, None
+    return page, encode_cursor(end, page[-1])
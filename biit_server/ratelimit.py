@@ -0,0 +1,299 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import math
+import os
+from threading import BoundedSemaphore, Lock
+import time
+from typing import Dict, Tuple
+
+from flask import g, request
+
+from .batch_handler import BATCH_POST, MAX_OPERATIONS
+from .http_responses import http429
+from .kvstore import store_from_url
+from .metrics import REGISTRY
+
+logger = logging.getLogger("biit_server.ratelimit")
+
+RATELIMIT_DEFAULTS = {
+    "RATELIMIT_ENABLED": os.getenv("RATELIMIT_ENABLED", "1") == "1",
+    "RATELIMIT_CALLER": (10.0, 20),
+    "RATELIMIT_ADDRESS": (50.0, 100),
+    "RATELIMIT_TRUSTED_PROXIES": int(os.getenv("RATELIMIT_TRUSTED_PROXIES", "1")),
+    "RATELIMIT_ROUTES": {},
+    "RATELIMIT_MAX_CONCURRENT": int(os.getenv("RATELIMIT_MAX_CONCURRENT", "0")),
+    "RATELIMIT_EXEMPT": {"/metrics", "/warmup"},
+    "RATELIMIT_STORE_URL": os.getenv("RATELIMIT_STORE_URL"),
+}
+"""
+Default config values, any of them can be overridden through create_app.
+
+RATELIMIT_CALLER is the (requests per second, burst) allowed to each caller,
+identified by its token, and RATELIMIT_ADDRESS the one allowed to each client
+address whatever tokens it sends. The address is the X-Forwarded-For entry
+added by the last of RATELIMIT_TRUSTED_PROXIES proxies in front of the app
+(one on Cloud Run), 0 uses the address of the connection.
+RATELIMIT_ROUTES maps a route rule to the (requests per second, burst)
+allowed to all callers of the route together, ie {"/community": (50, 100)}.
+RATELIMIT_MAX_CONCURRENT caps the requests handled at once by the process,
+0 disables the cap. RATELIMIT_STORE_URL shares the limits between instances
+through a key-value store, see kvstore.store_from_url.
+A /batch counts as one request per operation, up to the burst of a limit.
+"""
+
+RATELIMIT_STORE_RETRY = 5.0
+"""
+Seconds the shared store is bypassed after it failed, before it is tried
+again. The limits of the process apply meanwhile.
+"""
+
+REJECTIONS = REGISTRY.counter(
+    "ratelimit_rejections_total", "Requests shed with a 429", ("reason",)
+)
+
+
+class LocalBuckets:
+    def __init__(self, max_keys: int = 10000) -> None:
+        """Token buckets kept in the process
+
+        Args:
+            max_keys (int): buckets kept, the least recently used one is dropped past it
+        """
+        super().__init__()
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key: str, rate: float, burst: int, count: int = 1) -> float:
+        """Takes tokens from a bucket
+
+        Args:
+            key (str): the bucket
+            rate (float): tokens added per second
+            burst (int): the size of the bucket
+            count (int): the tokens taken, at most burst are taken
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they are available
+        """
+        count = min(count, burst)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            taken = tokens >= count
+            if taken:
+                tokens -= count
+            self._buckets[key] = (tokens, now)
+
+            # one bucket in, at most one out, new keys never cost a sweep
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+        return 0.0 if taken else (count - tokens) / rate
+
+    def refund(self, key: str, rate: float, burst: int, count: int = 1) -> None:
+        """Puts back tokens taken for a request that was rejected by another bucket"""
+        count = min(count, burst)
+        with self._lock:
+            if key in self._buckets:
+                tokens, last = self._buckets[key]
+                self._buckets[key] = (min(burst, tokens + count), last)
+
+
+class SharedBuckets:
+    def __init__(self, store) -> None:
+        """Limits shared between instances through a key-value store.
+        Each bucket is approximated by a counter that allows burst requests
+        per window of burst / rate seconds, which only needs an atomic
+        increment from the store. The buckets of the process are used
+        while the store is failing.
+
+        Args:
+            store (MemoryStore, RedisStore): the shared store
+        """
+        super().__init__()
+        self.store = store
+        self.local = LocalBuckets()
+        self._down_until = 0.0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _failed(self, error: Exception) -> None:
+        with self._lock:
+            first = time.monotonic() >= self._down_until
+            self._down_until = time.monotonic() + RATELIMIT_STORE_RETRY
+        if first:
+            logger.warning(json.dumps({"ratelimit": "local", "error": repr(error)}))
+
+    def take(self, key: str, rate: float, burst: int, count: int = 1) -> float:
+        if not self.enabled:
+            return self.local.take(key, rate, burst, count)
+        count = min(count, burst)
+        window = burst / rate
+        now = time.time()
+        slot = int(now // window)
+        try:
+            used = self.store.incr(
+                f"ratelimit:{key}:{slot}", amount=count, ttl=window * 2
+            )
+        except Exception as e:
+            # never turn an outage of the shared store into an outage of the app
+            self._failed(e)
+            return self.local.take(key, rate, burst, count)
+        if used <= burst:
+            return 0.0
+        return (slot + 1) * window - now
+
+    def refund(self, key: str, rate: float, burst: int, count: int = 1) -> None:
+        if not self.enabled:
+            return self.local.refund(key, rate, burst, count)
+        count = min(count, burst)
+        window = burst / rate
+        slot = int(time.time() // window)
+        try:
+            # past the end of the window the next one is only looser by a request
+            self.store.incr(f"ratelimit:{key}:{slot}", amount=-count, ttl=window * 2)
+        except Exception as e:
+            self._failed(e)
+
+
+def client_address(trusted_proxies: int) -> str:
+    """The address of the client, as seen by the outermost trusted proxy.
+    Entries of X-Forwarded-For before it are chosen by the client.
+
+    Args:
+        trusted_proxies (int): the proxies in front of the app, each adding one entry
+
+    Returns:
+        str: the address
+    """
+    hops = [
+        hop.strip() for hop in request.headers.get("X-Forwarded-For", "").split(",")
+    ]
+    hops = [hop for hop in hops if hop]
+    if trusted_proxies <= 0 or len(hops) < trusted_proxies:
+        return request.remote_addr
+    return hops[-trusted_proxies]
+
+
+def caller_identity(trusted_proxies: int) -> str:
+    """Identifies the caller of the current request by the refresh token it
+    sends, falling back to the client address. Emails are not used, any
+    client can send anyone's.
+
+    Args:
+        trusted_proxies (int): see client_address
+
+    Returns:
+        str: the identity used for per caller limits
+    """
+    token = request.args.get("token")
+    # never parse a body the handler would refuse for its size, nor one of unknown size
+    small = request.content_length is not None and request.content_length <= 16 * 1024
+    if token is None and request.is_json and small:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict) and isinstance(body.get("token"), str):
+            token = body["token"]
+    if token:
+        # tokens are secrets, only their hash is kept or sent to the store
+        return "token:" + hashlib.sha256(token.encode("utf-8")).hexdigest()[:32]
+    return f"ip:{client_address(trusted_proxies)}"
+
+
+def request_weight(route: str) -> int:
+    """The tokens the current request takes from each of its buckets.
+    A /batch takes one per operation, other requests one.
+
+    Args:
+        route (str): the route rule of the request
+
+    Returns:
+        int: the weight of the request
+    """
+    if route != "/batch":
+        return 1
+    length = request.content_length
+    if length is None:
+        # a chunked batch is not read here, it is counted as the largest one
+        return MAX_OPERATIONS
+    if length > BATCH_POST.max_bytes or not request.is_json:
+        return 1
+    body = request.get_json(silent=True)
+    operations = body.get("operations") if isinstance(body, dict) else None
+    # a batch of too many operations is refused before any of them runs
+    if not isinstance(operations, list) or len(operations) > MAX_OPERATIONS:
+        return 1
+    return max(1, len(operations))
+
+
+def init_ratelimit(app) -> None:
+    """Registers admission control on an app. Requests over the limits
+    are answered with a 429 and a Retry-After header before the
+    handler, and so the azure refresh, runs.
+
+    Args:
+        app (flask.Flask): the app to limit the requests of
+
+    Returns:
+        None
+    """
+    for key, value in RATELIMIT_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    if not app.config["RATELIMIT_ENABLED"]:
+        return
+
+    store = store_from_url(app.config["RATELIMIT_STORE_URL"])
+    buckets = SharedBuckets(store) if store is not None else LocalBuckets()
+    app.extensions["ratelimit"] = buckets
+
+    max_concurrent = app.config["RATELIMIT_MAX_CONCURRENT"]
+    slots = BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+
+    def limits(route: str) -> Dict[str, Tuple[float, int]]:
+        trusted = app.config["RATELIMIT_TRUSTED_PROXIES"]
+        # rotating tokens does not get a client past the limit of its address
+        found = {
+            f"caller:{caller_identity(trusted)}": app.config["RATELIMIT_CALLER"],
+            f"address:{client_address(trusted)}": app.config["RATELIMIT_ADDRESS"],
+        }
+        route_limit = app.config["RATELIMIT_ROUTES"].get(route)
+        if route_limit is not None:
+            found[f"route:{route}"] = route_limit
+        return found
+
+    @app.before_request
+    def admit_request():
+        route = request.url_rule.rule if request.url_rule else None
+        if route is None or route in app.config["RATELIMIT_EXEMPT"]:
+            return
+
+        weight = request_weight(route)
+        taken = []
+        for key, (rate, burst) in limits(route).items():
+            wait = buckets.take(key, rate, burst, weight)
+            if wait > 0:
+                # the request does not count against the buckets that admitted it
+                for admitted in taken:
+                    buckets.refund(*admitted)
+                reason = key.split(":", 1)[0]
+                REJECTIONS.inc(reason)
+                return http429("Rate limit exceeded", math.ceil(wait))
+            taken.append((key, rate, burst, weight))
+
+        if slots is not None:
+            if not slots.acquire(blocking=False):
+                REJECTIONS.inc("concurrency")
+                return http429("Server busy", 1)
+            g.ratelimit_slot = True
+
+    @app.teardown_request
+    def release_slot(exception=None):
+        if g.pop("ratelimit_slot", False):
+            slots.release()
@@ -0,0 +1,145 @@
+import os
+import random
+from threading import Lock
+import time
+from typing import Callable
+
+from .deadline import CALL_TIMEOUTS, call_options, current_deadline
+from .errors import BackendUnavailable, is_retryable
+from .metrics import BACKEND_GIVEUPS, BACKEND_RETRIES
+
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+"""
+The most times a backend call is made, the first attempt included
+"""
+
+RETRY_BASE = 0.05
+RETRY_MAX_BACKOFF = 1.0
+"""
+Seconds of the first backoff, doubled on each retry up to RETRY_MAX_BACKOFF.
+The sleep is drawn uniformly below it, so instances do not retry in step.
+"""
+
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN = 10.0
+"""
+Retries may add at most RETRY_BUDGET_RATIO to the calls of the process,
+plus RETRY_BUDGET_MIN retries for when traffic is low.
+"""
+
+
+class RetryBudget:
+    def __init__(
+        self, ratio: float = RETRY_BUDGET_RATIO, minimum: float = RETRY_BUDGET_MIN
+    ) -> None:
+        """A token bucket shared by every backend call of the process. Each call
+        deposits ratio of a token and each retry withdraws a whole one, so when
+        a backend fails for everyone retries stop instead of multiplying its load.
+
+        Args:
+            ratio (float): the retries allowed per call
+            minimum (float): the tokens available without any call, and the most
+                             calls can save up beyond it
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.ratio = ratio
+        self.minimum = minimum
+        self.capacity = minimum * 2
+        self._tokens = minimum
+        self._lock = Lock()
+
+    def deposit(self) -> None:
+        """Records a call"""
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.capacity)
+
+    def withdraw(self) -> bool:
+        """Takes a token for a retry
+
+        Returns:
+            boolean, False if the budget is spent and the call should not be retried
+        """
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def reset(self) -> None:
+        with self._lock:
+            self._tokens = self.minimum
+
+
+_budget = RetryBudget()
+
+
+def backoff(attempt: int) -> float:
+    """Seconds to sleep before a retry, with full jitter
+
+    Args:
+        attempt (int): the attempt that failed, 0 for the first one
+
+    Returns:
+        float: the seconds to sleep
+    """
+    return random.uniform(0, min(RETRY_MAX_BACKOFF, RETRY_BASE * 2**attempt))
+
+
+def with_retries(
+    backend: str,
+    function: Callable,
+    *args,
+    idempotent: bool = True,
+    attempts: int = RETRY_ATTEMPTS,
+    **kwargs,
+):
+    """Calls a backend, retrying errors that are usually temporary. Each attempt
+    gets the time left of the deadline as its timeout, and no retry is made
+    once the sleep before it would use up the deadline.
+
+    Args:
+        backend (str): "firestore", "gcs" or "azure", picks the timeout cap and labels metrics
+        function (Callable): the backend call
+        *args, **kwargs: the arguments of the call
+        idempotent (bool): whether the call can safely be applied twice. Calls that
+                           are not are only retried when the backend refused them.
+        attempts (int): the most times the call is made
+
+    Returns:
+        What the call returns
+
+    Raises:
+        BackendUnavailable when the call kept failing with retryable errors,
+        the error of the call when it is not retryable, and DeadlineExceeded
+        when no time is left
+    """
+    _budget.deposit()
+    for attempt in range(attempts):
+        try:
+            options = call_options(CALL_TIMEOUTS[backend], function)
+            return function(*args, **kwargs, **options)
+        except Exception as e:
+            if not is_retryable(e, idempotent):
+                raise
+            error = e
+
+        reason = None
+        sleep = backoff(attempt)
+        current = current_deadline()
+        if attempt + 1 >= attempts:
+            reason = "attempts"
+        elif current is not None and current.remaining() <= sleep:
+            reason = "deadline"
+        elif not _budget.withdraw():
+            reason = "budget"
+        if reason is not None:
+            BACKEND_GIVEUPS.inc(backend, reason)
+            raise BackendUnavailable(
+                f"{backend} failed {attempt + 1} times, last with {error!r}"
+            ) from error
+
+        BACKEND_RETRIES.inc(backend, type(error).__name__)
+        time.sleep(sleep)
@@ -0,0 +1,225 @@
+import json
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .http_responses import http200, http400, http411, http413
+
+_TYPE_NAMES = {str: "a string", int: "an integer", list: "a list", dict: "an object"}
+
+
+class Field:
+    __slots__ = ("name", "type", "required", "max_length", "min_items", "items")
+
+    def __init__(
+        self,
+        name: str,
+        type: type = str,
+        required: bool = True,
+        max_length: int = None,
+        min_items: int = None,
+        items: Any = None,
+    ) -> None:
+        """One field of a request
+
+        Args:
+            name (str): the key of the field
+            type (type): str, int, list or dict
+            required (bool): whether the field has to be sent
+            max_length (int): the longest str, or the most entries of a list or dict. Optional.
+            min_items (int): the fewest entries of a list or dict. Optional.
+            items (type, Schema): the type of every entry of a list, or the schema of a dict. Optional.
+        """
+        self.name = name
+        self.type = type
+        self.required = required
+        self.max_length = max_length
+        self.min_items = min_items
+        self.items = items
+
+
+def _compile(field: Field) -> Callable[[Any], Optional[str]]:
+    """Builds the check of one field, so a request only runs the checks the field needs"""
+    name = field.name
+    expected = field.type
+    type_error = f"Field {name} must be {_TYPE_NAMES[expected]}"
+    checks = []
+
+    if field.max_length is not None:
+        max_length = field.max_length
+
+        def check_length(value):
+            if len(value) > max_length:
+                return f"Field {name} is too long"
+
+        checks.append(check_length)
+
+    if field.min_items is not None:
+        min_items = field.min_items
+
+        def check_min_items(value):
+            if len(value) < min_items:
+                return f"Field {name} needs at least {min_items} entries"
+
+        checks.append(check_min_items)
+
+    if isinstance(field.items, Schema):
+        nested = field.items
+
+        def check_nested(value):
+            return nested.check(value)
+
+        checks.append(check_nested)
+
+    elif field.items is not None:
+        item_type = field.items
+        item_error = f"Field {name} must only contain {_TYPE_NAMES[item_type]}s"
+
+        def check_items(value):
+            for item in value:
+                if type(item) is not item_type:
+                    return item_error
+
+        checks.append(check_items)
+
+    def check(value):
+        # type() rather than isinstance() so True is not an int
+        if type(value) is not expected:
+            return type_error
+        for extra in checks:
+            error = extra(value)
+            if error is not None:
+                return error
+
+    return check
+
+
+class Schema:
+    def __init__(
+        self,
+        *fields: Field,
+        allow_extra: bool = True,
+        max_bytes: int = 16 * 1024,
+        missing: str = "Missing field {} in request",
+    ) -> None:
+        """The fields an endpoint accepts. The fields are compiled into one
+        check each when the schema is made, at import time of the handlers.
+
+        Args:
+            fields (Field): the fields of the request
+            allow_extra (bool): whether fields not in the schema are accepted
+            max_bytes (int): the largest body accepted, checked before it is parsed
+            missing (str): the message of a missing field, formatted with its name
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.fields = {field.name: field for field in fields}
+        self.allow_extra = allow_extra
+        self.max_bytes = max_bytes
+        self._missing = missing
+        self._required = tuple(field.name for field in fields if field.required)
+        self._checks = {field.name: _compile(field) for field in fields}
+
+    def check(self, data: Dict[str, Any]) -> Optional[str]:
+        """Checks data against the schema
+
+        Args:
+            data (Dict[str, Any]): the fields sent
+
+        Returns:
+            (str): The first problem found, None when the data is valid
+        """
+        for name in self._required:
+            if name not in data:
+                return self._missing.format(name)
+
+        checks = self._checks
+        for name in data:
+            check = checks.get(name)
+            if check is None:
+                if not self.allow_extra:
+                    return f"Unknown field {name}"
+                continue
+            error = check(data[name])
+            if error is not None:
+                return error
+        return None
+
+    def validate(self, data: Dict[str, Any]) -> Tuple[str, int]:
+        """Checks data against the schema
+
+        Returns:
+            Http 200 when the data is valid, otherwise Http 400 describing the problem
+        """
+        error = self.check(data)
+        if error is not None:
+            return http400(error)
+        return http200()
+
+    def load_json(self, request) -> Tuple[Any, Tuple[str, int]]:
+        """Parses and checks the json body of a request.
+        Bodies larger than max_bytes are refused without being read.
+
+        Args:
+            request: A request object with a json body
+
+        Returns:
+            (Tuple[Dict[str, Any], Tuple[str, int]]): The body, and Http 200 when it is valid
+            otherwise Http 400 or 413 describing the problem
+        """
+        length = getattr(request, "content_length", None)
+        if length is not None and length > self.max_bytes:
+            return None, http413(f"Body is larger than {self.max_bytes} bytes")
+
+        stream = getattr(request, "stream", None)
+        try:
+            if length is None and stream is not None:
+                # a chunked body has no length, no more than max_bytes of it are read
+                data = stream.read(self.max_bytes + 1)
+                if len(data) > self.max_bytes:
+                    return None, http413(f"Body is larger than {self.max_bytes} bytes")
+                body = json.loads(data)
+            else:
+                body = request.get_json()
+        except:
+            return None, http400("Missing body")
+
+        if not isinstance(body, dict):
+            return None, http400("Missing body")
+        return body, self.validate(body)
+
+    def load_form(self, request) -> Tuple[Any, Tuple[str, int]]:
+        """Checks the form of a request, see load_json"""
+        length = getattr(request, "content_length", None)
+        if length is not None and length > self.max_bytes:
+            return None, http413(f"Body is larger than {self.max_bytes} bytes")
+        if length is None and getattr(request, "stream", None) is not None:
+            # a form is parsed whole, its size must be known first
+            return None, http411("Forms need a Content-Length")
+
+        try:
+            form = request.form
+        except:
+            return None, http400("Missing body")
+        return form, self.validate(form)
+
+    def load_args(self, request) -> Tuple[Any, Tuple[str, int]]:
+        """Checks the query parameters of a request, see load_json"""
+        args = request.args
+        return args, self.validate(args)
+
+
+def query(*fields: Field, **options) -> Schema:
+    """Builds the schema of query parameters, which are always strings"""
+    options.setdefault("missing", "Missing query parameter {}")
+    return Schema(*fields, **options)
+
+
+def email(name: str = "email", **options) -> Field:
+    """A field holding an email address"""
+    return Field(name, max_length=254, **options)
+
+
+def token() -> Field:
+    """The refresh token every endpoint is sent"""
+    return Field("token", max_length=4096)
@@ -0,0 +1,108 @@
+import re
+import unicodedata
+from typing import Any, Dict, List
+
+from . import clients
+from .database import Database, write_batch
+
+SEARCH_COLLECTION = "community_search"
+"""
+The collection holding one index entry per community, with the same id
+"""
+
+SEARCH_MAX_PREFIX = 20
+SEARCH_MAX_TERMS = 200
+"""
+Prefixes are indexed up to SEARCH_MAX_PREFIX characters, longer searches are
+matched on their first SEARCH_MAX_PREFIX characters then filtered. An entry
+holds at most SEARCH_MAX_TERMS terms, so the last words of very long names
+may not be searchable on their own.
+"""
+
+
+def normalize(text: str) -> str:
+    """The searchable form of a text: lowercase, without accents and with
+    single spaces between its words
+
+    Args:
+        text (str): a community name or a search
+
+    Returns:
+        str: ie "cafe swim club" for "Café  Swim-Club!"
+    """
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.findall(r"[^\W_]+", stripped.casefold()))
+
+
+def index_terms(name: str) -> List[str]:
+    """The terms a community is found by: the prefixes of its name starting at
+    each of its words, so "swim club" is found by "sw", "swim c" and "cl"
+
+    Args:
+        name (str): the name of the community
+
+    Returns:
+        List[str]: the terms, without duplicates
+    """
+    normalized = normalize(name)
+    starts = [0] + [m.end() for m in re.finditer(" ", normalized)]
+
+    terms = {}
+    for start in starts:
+        suffix = normalized[start : start + SEARCH_MAX_PREFIX].rstrip()
+        for end in range(1, len(suffix) + 1):
+            terms.setdefault(suffix[:end].rstrip(), None)
+            if len(terms) >= SEARCH_MAX_TERMS:
+                return list(terms)
+    return list(terms)
+
+
+def index_entry(community: Dict[str, Any]) -> Dict[str, Any]:
+    """The index entry of a community
+
+    Args:
+        community (Dict[str, Any]): the community document, with at least name and meettype
+
+    Returns:
+        Dict[str, Any]: the entry, its name and meettype are returned by searches
+    """
+    return {
+        "name": community["name"],
+        "meettype": community.get("meettype"),
+        "terms": index_terms(community["name"]),
+    }
+
+
+def search_term(search: str) -> str:
+    """The term looked up in the index for a search, "" when it has no words"""
+    return normalize(search)[:SEARCH_MAX_PREFIX].rstrip()
+
+
+def matches(name: str, search: str) -> bool:
+    """Whether a community name starts with the search at one of its words,
+    used to filter the entries of searches longer than SEARCH_MAX_PREFIX"""
+    normalized = normalize(name)
+    search = normalize(search)
+    starts = [0] + [m.end() for m in re.finditer(" ", normalized)]
+    return any(normalized.startswith(search, start) for start in starts)
+
+
+def reindex(firestore_client=None) -> int:
+    """Writes the index entry of every community, for communities created
+    before the index existed. Reads the whole collection, run it once.
+
+    Args:
+        firestore_client (google.cloud.firestore.client): Optional, the shared client is used when not set.
+
+    Returns:
+        int: the number of communities indexed
+    """
+    firestore_client = firestore_client or clients.firestore_client()
+    search_db = Database(SEARCH_COLLECTION, firestore_client)
+    count = 0
+    with write_batch():
+        for snapshot in firestore_client.collection("communities").stream():
+            search_db.set(snapshot.id, index_entry(snapshot.to_dict()))
+            count += 1
+    return count
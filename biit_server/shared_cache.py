@@ -0,0 +1,262 @@
+import base64
+from contextlib import contextmanager
+import hashlib
+import json
+import logging
+import os
+from threading import Lock
+import time
+from typing import Any, List, Optional
+
+from .kvstore import decode_versioned, store_from_url
+from .metrics import CACHE_REQUESTS
+
+logger = logging.getLogger("biit_server.shared_cache")
+
+SHARED_CACHE_URL = os.getenv("SHARED_CACHE_URL")
+"""
+The key-value store shared by every instance, see kvstore.store_from_url.
+The shared tier is off when not set.
+"""
+
+SHARED_CACHE_COLLECTIONS = {
+    name
+    for name in os.getenv("SHARED_CACHE_COLLECTIONS", "communities,accounts").split(",")
+    if name
+}
+"""
+The collections whose documents are cached in the shared tier
+"""
+
+SHARED_CACHE_TTL = float(os.getenv("SHARED_CACHE_TTL", "30"))
+SHARED_CACHE_TOMBSTONE_TTL = 2.0
+SHARED_CACHE_TOMBSTONE_ANY = float(2**53)
+"""
+Seconds a cached document lives. A write leaves a tombstone versioned with
+the time Firestore gave the write for SHARED_CACHE_TOMBSTONE_TTL, so reads
+that started before it cannot put the old version back. Entries are versioned
+with the update_time Firestore gave them, both come from the same clock.
+A write whose time is unknown leaves a tombstone no version replaces.
+"""
+
+SHARED_CACHE_RETRY = 5.0
+"""
+Seconds the tier is bypassed after it failed, before it is tried again
+"""
+
+
+class SharedCache:
+    def __init__(self, store=None, ttl: float = SHARED_CACHE_TTL) -> None:
+        """A cache shared by every instance, in front of Firestore and azure.
+        Every call is bypassed while the store is failing, so an outage of
+        the store only costs the misses.
+
+        Args:
+            store (MemoryStore, RedisStore): the shared store. Optional, the tier is off when not set.
+            ttl (float): seconds an entry lives
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.store = store
+        self.ttl = ttl
+        self._down_until = 0.0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None and time.monotonic() >= self._down_until
+
+    def _failed(self, error: Exception) -> None:
+        CACHE_REQUESTS.inc("shared", "error")
+        with self._lock:
+            first = time.monotonic() >= self._down_until
+            self._down_until = time.monotonic() + SHARED_CACHE_RETRY
+        if first:
+            logger.warning(
+                json.dumps({"shared_cache": "bypassed", "error": repr(error)})
+            )
+
+    def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Reads several entries in one round trip
+
+        Args:
+            keys (List[str]): the keys of the entries
+
+        Returns:
+            List[Any]: the value of each entry, None for misses and while the tier is down
+        """
+        if not keys or not self.enabled:
+            return [None] * len(keys)
+        try:
+            raws = self.store.mget(keys)
+        except Exception as e:
+            self._failed(e)
+            return [None] * len(keys)
+
+        values = []
+        for raw in raws:
+            _, value = decode_versioned(raw)
+            # an empty value is the tombstone of a write
+            values.append(json.loads(value) if value else None)
+            CACHE_REQUESTS.inc("shared", "hit" if value else "miss")
+        return values
+
+    def get(self, key: str) -> Optional[Any]:
+        """Reads one entry, see get_many"""
+        return self.get_many([key])[0]
+
+    def set(self, key: str, value: Any, version: float, ttl: float = None) -> bool:
+        """Stores an entry unless a newer version is stored
+
+        Args:
+            key (str): the key of the entry
+            value (Any): a json serializable value
+            version (float): the version of the value, ie the update_time of a document
+            ttl (float): seconds the entry lives. Optional.
+
+        Returns:
+            boolean, True if the entry was stored
+        """
+        if not self.enabled:
+            return False
+        try:
+            encoded = json.dumps(value, separators=(",", ":"))
+        except (TypeError, ValueError):
+            # documents with values json cannot hold are only cached locally
+            return False
+        try:
+            return self.store.set_versioned(
+                key, encoded, version, self.ttl if ttl is None else ttl
+            )
+        except Exception as e:
+            self._failed(e)
+            return False
+
+    def invalidate(self, key: str, version: float = None) -> None:
+        """Replaces an entry with a tombstone
+
+        Args:
+            key (str): the key of the entry
+            version (float): the version written, ie the update_time of the write.
+                             Optional, no version replaces the tombstone when not set.
+
+        Returns:
+            None
+        """
+        if not self.enabled:
+            return
+        if version is None:
+            version = SHARED_CACHE_TOMBSTONE_ANY
+        try:
+            self.store.set_versioned(key, "", version, SHARED_CACHE_TOMBSTONE_TTL)
+        except Exception as e:
+            self._failed(e)
+
+
+_shared = None
+_shared_lock = Lock()
+
+
+def shared_cache() -> SharedCache:
+    """The shared tier of the process, built from SHARED_CACHE_URL on first use"""
+    global _shared
+
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = SharedCache(store_from_url(SHARED_CACHE_URL))
+    return _shared
+
+
+@contextmanager
+def installed(cache: SharedCache):
+    """Replaces the shared tier of the process within the block
+
+    Usage:
+        with installed(SharedCache(MemoryStore())):
+            Database("communities").get("a")
+    """
+    global _shared
+
+    previous, _shared = _shared, cache
+    try:
+        yield cache
+    finally:
+        _shared = previous
+
+
+def document_key(collection: str, id) -> str:
+    return f"doc:{collection}:{id}"
+
+
+def token_key(refresh_token: str) -> str:
+    # refresh tokens are secrets, the key only holds their hash. The entry
+    # itself is sealed with the refresh token, see seal.
+    return "azure:" + hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()
+
+
+def _sealing_key(secret: str) -> bytes:
+    # a different hash of the secret than token_key, the key cannot be read from the store
+    return hashlib.sha256(b"biit-sealed-entry:" + secret.encode("utf-8")).digest()
+
+
+def seal(secret: str, value: Any) -> str:
+    """Encrypts an entry with a key derived from a secret the client sends,
+    so the store never holds it readable and only a caller holding the secret
+    can open it
+
+    Args:
+        secret (str): ie the refresh token the entry was refreshed from
+        value (Any): a json serializable value
+
+    Returns:
+        str: the nonce and the AES-GCM ciphertext of value, base64 encoded
+    """
+    # imported here so the app starts without loading it
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    nonce = os.urandom(12)
+    sealed = AESGCM(_sealing_key(secret)).encrypt(
+        nonce, json.dumps(value).encode("utf-8"), None
+    )
+    return base64.b64encode(nonce + sealed).decode("ascii")
+
+
+def unseal(secret: str, sealed: Any) -> Optional[Any]:
+    """Decrypts an entry written by seal
+
+    Args:
+        secret (str): the secret the entry was sealed with
+        sealed (Any): the entry read from the store
+
+    Returns:
+        The value, or None when the entry is not sealed with secret
+    """
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    try:
+        data = base64.b64decode(sealed)
+        opened = AESGCM(_sealing_key(secret)).decrypt(data[:12], data[12:], None)
+    except (TypeError, ValueError, InvalidTag):
+        return None
+    return json.loads(opened)
+
+
+def version_of(update_time) -> Optional[float]:
+    """The version of a document, from the update_time of a snapshot or of a write
+
+    Args:
+        update_time: a protobuf Timestamp, as google-cloud-firestore 1.x gives
+                     them, or a datetime
+
+    Returns:
+        float: seconds since the epoch, None when update_time is neither
+    """
+    if hasattr(update_time, "seconds") and hasattr(update_time, "nanos"):
+        return int(update_time.seconds) + int(update_time.nanos) / 1e9
+    if hasattr(update_time, "timestamp"):
+        return update_time.timestamp()
+    return None
@@ -1,6 +1,18 @@
-from google.cloud import storage
 import base64
 
+from . import clients
+from .cache import NegativeCache
+from .deadline import record_failure
+from .metrics import GCS_BYTES
+from .retry import with_retries
+from .timing import timed
+
+_missing = NegativeCache(max_size=4096, name="gcs_missing")
+"""
+Blobs cloud storage answered not found for, keyed by (bucket, name). Holds
+the client the answer came from.
+"""
+
 
 class Storage:
     def __init__(self, bucket, storage_client=None) -> None:
@@ -8,16 +20,19 @@ class Storage:
 
         Args:
             bucket (str): the name of the bucket
-            storage (google.cloud.storage.client): A storage client object
+            storage (google.cloud.storage.client): A storage client object. Optional, the shared client is used when not set.
 
         Returns:
             None
         """
         super().__init__()
         self.name = bucket
-        self.storage = storage_client if storage_client != None else storage.Client()
-        self.bucket = self.storage.get_bucket(self.name)
+        self.storage = (
+            storage_client if storage_client != None else clients.storage_client()
+        )
+        self.bucket = with_retries("gcs", self.storage.get_bucket, self.name)
 
+    @timed("gcs")
     def add(self, file, name: str) -> bool:
         """Helper function to add file into the storage bucket.
 
@@ -29,9 +44,13 @@ class Storage:
             boolean, True if the document is successfully added, False if there was an error.
         """
         blob = self.bucket.blob(name)
-        blob.upload_from_string(file)
+        # uploading the same bytes twice leaves the same blob
+        with_retries("gcs", blob.upload_from_string, file)
+        _missing.delete((self.name, name))
+        GCS_BYTES.inc("out", amount=len(file))
         return True
 
+    @timed("gcs")
     def get(self, name):
         """Helper function to get documents from the database.
 
@@ -41,14 +60,24 @@ class Storage:
         Returns:
             File if the document is successfully returned. Boolean value of False if there was an error.
         """
+        if _missing.get((self.name, name)) is self.storage:
+            return False
+
+        token = _missing.token()
         try:
-            blob = self.bucket.get_blob(name)
-            file_obj = blob.download_as_string()
+            blob = with_retries("gcs", self.bucket.get_blob, name)
+            if blob is None:
+                _missing.set((self.name, name), self.storage, token)
+                return False
+            file_obj = with_retries("gcs", blob.download_as_string)
+            GCS_BYTES.inc("in", amount=len(file_obj))
             byte_file = base64.b64encode(file_obj)
             return byte_file.decode("ascii")
-        except Exception:
+        except Exception as e:
+            record_failure(e)
             return False
 
+    @timed("gcs")
     def delete(self, name):
         """Helper function to delete documents from the database.
 
@@ -58,8 +87,8 @@ class Storage:
         Returns:
             True if deleted
         """
-        blob = self.bucket.get_blob(name)
+        blob = with_retries("gcs", self.bucket.get_blob, name)
 
         if blob:
-            file_obj = blob.delete()
+            file_obj = with_retries("gcs", blob.delete)
         return True
@@ -0,0 +1,165 @@
+import os
+import random
+from typing import Any, Dict, List
+
+from . import clients
+from .database import Database, write_batch
+
+SUMMARY_COLLECTION = "community_summaries"
+"""
+The collection holding the summary of each community, with the same id
+"""
+
+SUMMARY_FIELDS = ["name", "meettype", "mpm"]
+"""
+The fields of a community copied into its summary
+"""
+
+MEMBER_SHARDS = int(os.getenv("MEMBER_SHARDS", "4"))
+MEMBER_SHARD_COLLECTION = "community_member_shards"
+"""
+The member count of a community is split over MEMBER_SHARDS counters, so
+concurrent joins rarely write to the same counter. Reading a count reads
+every shard, and it should only ever be raised: counts held by shards above
+it would be lost.
+"""
+
+
+def summary(community: Dict[str, Any]) -> Dict[str, Any]:
+    """The summary of a community, without its member count
+
+    Args:
+        community (Dict[str, Any]): the community document, or the fields of it that changed
+
+    Returns:
+        Dict[str, Any]: the SUMMARY_FIELDS of the community
+    """
+    return {key: community[key] for key in SUMMARY_FIELDS if key in community}
+
+
+def shard_id(name: str, shard: int) -> str:
+    return f"{name}#{shard}"
+
+
+def shard_ids(name: str) -> List[str]:
+    """The ids of every member count shard of a community"""
+    return [shard_id(name, shard) for shard in range(MEMBER_SHARDS)]
+
+
+def member_count(name: str, delta: int):
+    """The write adding delta to the member count of a community
+
+    Usage:
+        Database(MEMBER_SHARD_COLLECTION).set(*member_count("a", 1), merge=True)
+
+    Returns:
+        Tuple[str, Dict[str, Any]]: the id of a random shard and its fields
+    """
+    # imported on first write, the app starts without loading the SDK
+    from google.cloud.firestore import Increment
+
+    shard = shard_id(name, random.randrange(MEMBER_SHARDS))
+    return shard, {"community": name, "count": Increment(delta)}
+
+
+def update_members(
+    community_id: str, email: str, joined: bool, changes: Dict[str, Any] = None
+):
+    """Adds or removes a member of a community with ArrayUnion or ArrayRemove,
+    in one batched write with the change of its member count when the members
+    change. No transaction holds the community while its members are read, so
+    joins of a popular community do not queue behind each other; two requests
+    racing for the same member can both count it, until rebuild recounts.
+
+    Args:
+        community_id (str): the name of the community
+        email (str): the member
+        joined (bool): True to add the member, False to remove them
+        changes (Dict[str, Any]): other fields of the community written in the same batch. Optional.
+
+    Returns:
+        Tuple[DocumentSnapshot, bool]: the members of the community before the
+        change, and whether they changed. False if there was an error.
+    """
+    # imported on first write, the app starts without loading the SDK
+    from google.cloud.firestore import ArrayRemove, ArrayUnion
+
+    community_db = Database("communities")
+    # reading only the members skips the cached copies of the whole document
+    community = community_db.get(community_id, fields=["Members"])
+    if community is False:
+        return False
+    if not community.exists:
+        return community, False
+
+    changed = (email in (community.to_dict().get("Members") or [])) != joined
+    update = dict(changes or {})
+    with write_batch() as batch:
+        if changed:
+            update["Members"] = (ArrayUnion if joined else ArrayRemove)([email])
+            Database(MEMBER_SHARD_COLLECTION).set(
+                *member_count(community_id, 1 if joined else -1), merge=True
+            )
+        if update:
+            community_db.update(community_id, update)
+    if batch.failed:
+        return False
+    return community, changed
+
+
+def read_summaries(names: List[str], firestore_client=None) -> List[Dict[str, Any]]:
+    """Reads the summaries and member counts of communities, in two calls
+
+    Args:
+        names (List[str]): the names of the communities
+        firestore_client (google.cloud.firestore.client): Optional, the shared client is used when not set.
+
+    Returns:
+        List[Dict[str, Any]]: the summary of each community with its members count,
+        None for communities without a summary. False if there was an error.
+    """
+    summaries = Database(SUMMARY_COLLECTION, firestore_client).get_many(names)
+    shards = Database(MEMBER_SHARD_COLLECTION, firestore_client).get_many(
+        [id for name in names for id in shard_ids(name)]
+    )
+    if summaries is False or shards is False:
+        return False
+
+    found = []
+    for i, snapshot in enumerate(summaries):
+        if snapshot is None or not snapshot.exists:
+            found.append(None)
+            continue
+        counters = shards[i * MEMBER_SHARDS : (i + 1) * MEMBER_SHARDS]
+        found.append(
+            dict(
+                snapshot.to_dict(),
+                members=sum(s.get("count") for s in counters if s and s.exists),
+            )
+        )
+    return found
+
+
+def rebuild(firestore_client=None) -> int:
+    """Writes the summary and member count of every community, for communities
+    created before summaries existed. Reads the whole collection, run it once.
+
+    Args:
+        firestore_client (google.cloud.firestore.client): Optional, the shared client is used when not set.
+
+    Returns:
+        int: the number of communities summarized
+    """
+    firestore_client = firestore_client or clients.firestore_client()
+    summary_db = Database(SUMMARY_COLLECTION, firestore_client)
+    shard_db = Database(MEMBER_SHARD_COLLECTION, firestore_client)
+    count = 0
+    with write_batch():
+        for snapshot in firestore_client.collection("communities").stream():
+            community = snapshot.to_dict()
+            summary_db.set(snapshot.id, summary(community))
+            for shard, id in enumerate(shard_ids(snapshot.id)):
+                members = len(community.get("Members") or []) if shard == 0 else 0
+                shard_db.set(id, {"community": snapshot.id, "count": members})
+            count += 1
+    return count
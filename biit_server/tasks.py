@@ -0,0 +1,207 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import signal
+import sys
+from threading import Condition, Lock, Thread, current_thread, main_thread
+import time
+from typing import Callable
+
+from .deadline import deadline
+from .metrics import REGISTRY
+
+logger = logging.getLogger("biit_server.tasks")
+
+TASKS_WORKERS = int(os.getenv("TASKS_WORKERS", "2"))
+TASKS_QUEUE_SIZE = int(os.getenv("TASKS_QUEUE_SIZE", "1000"))
+TASKS_RETRIES = int(os.getenv("TASKS_RETRIES", "3"))
+TASKS_DEADLINE = float(os.getenv("TASKS_DEADLINE", "30"))
+"""
+The budget of each attempt of a task, its backend calls time out with it
+"""
+TASKS_DRAIN_TIMEOUT = float(os.getenv("TASKS_DRAIN_TIMEOUT", "8"))
+"""
+Cloud Run leaves 10 seconds between SIGTERM and SIGKILL, the drain has to fit in it
+"""
+
+TASKS = REGISTRY.counter(
+    "background_tasks_total", "Background tasks by outcome", ("outcome",)
+)
+
+
+class BackgroundExecutor:
+    def __init__(
+        self,
+        workers: int = TASKS_WORKERS,
+        queue_size: int = TASKS_QUEUE_SIZE,
+        retries: int = TASKS_RETRIES,
+        backoff: float = 0.2,
+    ) -> None:
+        """Runs work the client does not wait for on a few worker threads.
+        The workers start with the first task, so a forked process gets its own.
+
+        Args:
+            workers (int): the worker threads
+            queue_size (int): the most tasks waiting, submit refuses tasks beyond it
+            retries (int): how many times a failing task is retried
+            backoff (float): seconds before the first retry, doubled for each next one
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = queue.Queue(queue_size)
+        self._threads = []
+        self._lock = Lock()
+        self._idle = Condition(self._lock)
+        self._pending = 0
+        self._draining = False
+
+    def depth(self) -> int:
+        """Tasks waiting or running"""
+        return self._pending
+
+    def submit(self, function: Callable, *args, **kwargs) -> bool:
+        """Queues a task without waiting
+
+        Args:
+            function (Callable): the task
+            *args, **kwargs: the arguments of the task
+
+        Returns:
+            boolean, False if the task was refused because the queue is full or draining
+        """
+        with self._lock:
+            if self._draining:
+                return False
+            if len(self._threads) < self.workers:
+                self._start_workers()
+            try:
+                self.queue.put_nowait((function, args, kwargs))
+            except queue.Full:
+                return False
+            self._pending += 1
+            return True
+
+    def _start_workers(self) -> None:
+        while len(self._threads) < self.workers:
+            thread = Thread(
+                target=self._work, name=f"task-{len(self._threads)}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self) -> None:
+        while True:
+            function, args, kwargs = self.queue.get()
+            try:
+                self._run(function, args, kwargs)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+    def _run(self, function: Callable, args, kwargs) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                with deadline(TASKS_DEADLINE):
+                    function(*args, **kwargs)
+                TASKS.inc("ok" if attempt == 0 else "retried")
+                return
+            except Exception as e:
+                error = e
+            if attempt < self.retries:
+                time.sleep(self.backoff * 2**attempt)
+
+        TASKS.inc("failed")
+        logger.error(
+            json.dumps(
+                {
+                    "task": getattr(function, "__qualname__", repr(function)),
+                    "attempts": self.retries + 1,
+                    "error": repr(error),
+                }
+            )
+        )
+
+    def join(self, timeout: float = None) -> bool:
+        """Waits until no task is waiting or running, still accepting new ones
+
+        Args:
+            timeout (float): the most seconds to wait. Optional.
+
+        Returns:
+            boolean, True if the executor became idle in time
+        """
+        with self._lock:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def drain(self, timeout: float = TASKS_DRAIN_TIMEOUT) -> bool:
+        """Stops accepting tasks and waits for the queued ones to finish
+
+        Args:
+            timeout (float): the most seconds to wait
+
+        Returns:
+            boolean, True if every task finished in time
+        """
+        with self._lock:
+            self._draining = True
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+
+_executor = BackgroundExecutor()
+
+REGISTRY.gauge(
+    "background_tasks_queue_depth",
+    "Background tasks waiting or running",
+    function=lambda: _executor.depth(),
+)
+
+
+def defer(function: Callable, *args, **kwargs) -> None:
+    """Runs a task after the response, on the background executor of the process.
+    When the executor refuses the task it runs right away instead, so the
+    work is delayed at most and never lost.
+
+    Args:
+        function (Callable): the task
+        *args, **kwargs: the arguments of the task
+
+    Returns:
+        None
+    """
+    if _executor.submit(function, *args, **kwargs):
+        return
+
+    TASKS.inc("inline")
+    _executor._run(function, args, kwargs)
+
+
+def wait_for_tasks(timeout: float = TASKS_DRAIN_TIMEOUT) -> bool:
+    """Waits for the deferred tasks of the process, see BackgroundExecutor.join"""
+    return _executor.join(timeout)
+
+
+def drain_on_exit(timeout: float = TASKS_DRAIN_TIMEOUT) -> None:
+    """Drains the executor when the process exits. When nothing else handles
+    SIGTERM yet it is turned into a normal exit so the drain also runs then;
+    gunicorn workers already exit normally on SIGTERM.
+
+    Args:
+        timeout (float): the most seconds to wait for queued tasks
+
+    Returns:
+        None
+    """
+    atexit.register(_executor.drain, timeout)
+    if current_thread() is main_thread() and (
+        signal.getsignal(signal.SIGTERM) is signal.SIG_DFL
+    ):
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
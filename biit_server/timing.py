@@ -0,0 +1,172 @@
+from contextvars import ContextVar
+from functools import wraps
+import json
+import logging
+from time import perf_counter
+
+from flask import g, request
+
+logger = logging.getLogger("biit_server.requests")
+
+TIMING_DEFAULTS = {
+    "TIMING_ENABLED": True,
+    "TIMING_HEADER": True,
+    "TIMING_LOG": True,
+}
+"""
+Default config values, any of them can be overridden through create_app
+"""
+
+_current_timer = ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Collects how long each phase of a single request took"""
+
+    __slots__ = ("start", "durations", "counts")
+
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        self.durations = {}
+        self.counts = {}
+
+    def add(self, name: str, duration: float) -> None:
+        """Records one timed call of a phase
+
+        Args:
+            name (str): name of the phase, ie firestore, gcs or azure
+            duration (float): seconds the call took
+
+        Returns:
+            None
+        """
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def elapsed(self) -> float:
+        """Seconds since the request started"""
+        return perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """Formats the phases as the value of a Server-Timing header"""
+        metrics = [
+            f'{name};desc="{self.counts[name]} calls";dur={duration * 1000:.2f}'
+            for name, duration in self.durations.items()
+        ]
+        metrics.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+def current_timer():
+    """Gets the timer of the request being handled
+
+    Returns:
+        RequestTimer: the timer, or None when called outside of a request
+    """
+    return _current_timer.get()
+
+
+class span:
+    """Context manager timing one phase of the current request.
+    Does nothing when there is no request being timed.
+
+    Usage:
+        with span("firestore"):
+            ...
+    """
+
+    __slots__ = ("name", "timer", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.timer = _current_timer.get()
+
+    def __enter__(self):
+        if self.timer is not None:
+            self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timer is not None:
+            self.timer.add(self.name, perf_counter() - self.start)
+        return False
+
+
+def timed(name: str):
+    """Decorator timing every call of a function as a phase of the current request
+
+    Args:
+        name (str): name of the phase the calls count towards
+
+    Returns:
+        The decorator
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            timer = _current_timer.get()
+            if timer is None:
+                return func(*args, **kwargs)
+
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer.add(name, perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def init_timing(app) -> None:
+    """Registers per request phase timing on an app. Adds a Server-Timing
+    header to every response and logs one json line per request.
+
+    Args:
+        app (flask.Flask): the app to time the requests of
+
+    Returns:
+        None
+    """
+    for key, value in TIMING_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    @app.before_request
+    def start_timer():
+        if app.config["TIMING_ENABLED"]:
+            g.timer_token = _current_timer.set(RequestTimer())
+
+    @app.after_request
+    def finish_timer(response):
+        timer = _current_timer.get()
+        if timer is None:
+            return response
+
+        if app.config["TIMING_HEADER"]:
+            response.headers["Server-Timing"] = timer.server_timing()
+
+        if app.config["TIMING_LOG"] and logger.isEnabledFor(logging.INFO):
+            line = {
+                "route": request.url_rule.rule if request.url_rule else None,
+                "method": request.method,
+                "status": response.status_code,
+                "duration_ms": round(timer.elapsed() * 1000, 2),
+                "phases": {
+                    name: {
+                        "duration_ms": round(duration * 1000, 2),
+                        "calls": timer.counts[name],
+                    }
+                    for name, duration in timer.durations.items()
+                },
+            }
+            logger.info(json.dumps(line))
+
+        return response
+
+    @app.teardown_request
+    def reset_timer(exception=None):
+        token = g.pop("timer_token", None)
+        if token is not None:
+            _current_timer.reset(token)
@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+from threading import Event, Lock, Thread
+import time
+from typing import List
+
+from . import clients
+from .azure import TOKEN_URL
+from .database import Database
+from .deadline import deadline
+from .errors import BackendUnavailable
+from .http_responses import http503, jsonHttp200
+from .retry import with_retries
+from .storage import Storage
+
+logger = logging.getLogger("biit_server.warmup")
+
+WARMUP_DEFAULTS = {
+    "WARMUP_BACKGROUND": os.getenv("WARMUP_BACKGROUND", "0") == "1",
+    "WARMUP_COMMUNITIES": [
+        name for name in os.getenv("WARMUP_COMMUNITIES", "").split(",") if name
+    ],
+    "WARMUP_BUCKET": "biit_profiles",
+    "WARMUP_TIMEOUT": 2.0,
+    "WARMUP_DEADLINE": 10.0,
+}
+"""
+Default config values, any of them can be overridden through create_app.
+
+WARMUP_BACKGROUND starts warming up as soon as the app is created, instead
+of on the first call to /warmup. WARMUP_COMMUNITIES are the hottest
+communities, read during the warm up so their first readers hit warm caches.
+WARMUP_TIMEOUT is how long /warmup waits for a warm up in progress.
+WARMUP_DEADLINE is the budget of the backend calls of a background warm up,
+a warm up run by /warmup has the deadline of the request.
+"""
+
+
+class Warmup:
+    def __init__(self, steps: List, budget: float = None) -> None:
+        """Runs the warm up of an instance once, and remembers whether it succeeded
+
+        Args:
+            steps (List[Tuple[str, Callable]]): the name and function of each step, run in order
+            budget (float): the deadline, in seconds, of a background warm up. Optional.
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.steps = steps
+        self.budget = budget
+        self.durations = {}
+        self.errors = {}
+        self._done = Event()
+        self._lock = Lock()
+        self._running = False
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and not self.errors
+
+    def run(self) -> bool:
+        """Runs every step unless the instance is ready or another thread is warming it up.
+        A failed warm up is retried on the next call.
+
+        Returns:
+            boolean, True if the instance is ready
+        """
+        with self._lock:
+            if self.ready or self._running:
+                return self.ready
+            self._running = True
+            self._done.clear()
+
+        durations, errors = {}, {}
+        for name, step in self.steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                errors[name] = repr(e)
+            durations[name] = round((time.perf_counter() - start) * 1000, 3)
+
+        self.durations, self.errors = durations, errors
+        logger.info(
+            json.dumps({"ready": not errors, "steps": durations, "errors": errors})
+        )
+        with self._lock:
+            self._running = False
+            self._done.set()
+        return self.ready
+
+    def start(self) -> Thread:
+        """Runs the warm up on a background thread"""
+        thread = Thread(target=self._run_in_background, name="warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def _run_in_background(self) -> bool:
+        if self.budget is None:
+            return self.run()
+        with deadline(self.budget):
+            return self.run()
+
+    def wait(self, timeout: float) -> bool:
+        """Waits for a warm up in progress
+
+        Returns:
+            boolean, True if the instance is ready
+        """
+        self._done.wait(timeout)
+        return self.ready
+
+
+def default_steps(config) -> List:
+    """The steps warming up an instance: create the shared clients, open
+    a connection to each backend, then read the hottest communities.
+
+    Args:
+        config: the config of the app
+
+    Returns:
+        List[Tuple[str, Callable]]: the name and function of each step
+    """
+
+    def firestore():
+        # reading a document opens the grpc channel, a missing one is fine.
+        # Called directly, the Database helpers answer errors with None.
+        document = (
+            clients.firestore_client().collection("communities").document("warmup")
+        )
+        with_retries("firestore", document.get, field_paths=[])
+
+    def storage():
+        Storage(config["WARMUP_BUCKET"])
+
+    def azure():
+        if os.getenv("STAGE") == "dev":
+            return
+        # any answer means the TLS session to azure is open and pooled
+        clients.http_session().head(TOKEN_URL, timeout=config["WARMUP_TIMEOUT"])
+
+    def communities():
+        community_db = Database("communities")
+        for name in config["WARMUP_COMMUNITIES"]:
+            if community_db.get(name) is False:
+                raise BackendUnavailable(f"could not read community {name}")
+
+    return [
+        ("firestore", firestore),
+        ("storage", storage),
+        ("azure", azure),
+        ("communities", communities),
+    ]
+
+
+def init_warmup(app, steps: List = None) -> None:
+    """Registers the /warmup route on an app, for the startup probe of the platform.
+    It answers 200 once every backend client is connected and the hottest
+    communities are read, and 503 until then.
+
+    Args:
+        app (flask.Flask): the app to warm up
+        steps (List[Tuple[str, Callable]]): replaces the default steps. Optional.
+
+    Returns:
+        None
+    """
+    for key, value in WARMUP_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    warmup = Warmup(
+        steps if steps is not None else default_steps(app.config),
+        app.config["WARMUP_DEADLINE"],
+    )
+    app.extensions["warmup"] = warmup
+
+    if app.config["WARMUP_BACKGROUND"]:
+        warmup.start()
+
+    @app.route("/warmup", methods=["GET"])
+    def warmup_route():
+        if app.config["WARMUP_BACKGROUND"]:
+            ready = warmup.wait(app.config["WARMUP_TIMEOUT"])
+        else:
+            ready = warmup.run() or warmup.wait(app.config["WARMUP_TIMEOUT"])
+
+        if not ready:
+            if warmup.errors:
+                # start over so the next probe retries the failed steps
+                if app.config["WARMUP_BACKGROUND"]:
+                    warmup.start()
+                return http503("Warm up failed: " + ", ".join(sorted(warmup.errors)))
+            return http503("Warming up")
+        return jsonHttp200("Ready", {"steps": dict(warmup.durations)})
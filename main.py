@@ -1,16 +1,22 @@
 from biit_server import create_app
-import google.cloud.logging
+from biit_server.logs import start_logging
+from biit_server.tasks import drain_on_exit
 
+# json lines on stdout, written by a background flusher
+start_logging()
+# background tasks still queued get a chance to finish on shutdown
+drain_on_exit()
 app = create_app()
 
 if __name__ == "__main__":
+    # only needed when running locally, Cloud Run collects stdout
+    import google.cloud.logging
+
     # Instantiates a client
     client = google.cloud.logging.Client()
 
     # Retrieves a Cloud Logging handler based on the environment
-    # you're running in and integrates the handler with the
-    # Python logging module. By default this captures all logs
-    # at INFO level and higher
-    client.get_default_handler()
-    client.setup_logging()
-    create_app().run()
+    # you're running in. Records still go through the queue so
+    # sending them never blocks a request
+    start_logging([client.get_default_handler()])
+    app.run()
@@ -109,8 +109,8 @@ def test_account_put(client):
             query_string={
                 "email": "test@email.com",
                 "token": "TestToken",
-                "updateFields": {"email": "e@mail.in.gov"},
             },
+            json={"updateFields": {"lname": "last"}},
             follow_redirects=True,
         )
         assert (
@@ -118,6 +118,8 @@ def test_account_put(client):
             == rv.data
         )
 
+        instance.update.assert_called_once_with("test@email.com", {"lname": "last"})
+
 
 def test_account_delete(client):
     """
@@ -203,3 +205,34 @@ def test_profile_get(client):
             b'{"access_token":"RefreshToken","data":"hello","message":"File Received","refresh_token":"AccessToken","status_code":200}\n'
             == rv.data
         )
+
+
+def test_account_get_etag(client):
+    """
+    Tests that account get answers a poll of an unchanged account with a 304
+    carrying the refreshed tokens
+    """
+    with patch.object(
+        account_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.account_handler.Database"
+    ) as mock_database:
+        instance = mock_database.return_value
+        instance.update_time.return_value = "v1"
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+
+        etag = biit_server.http_responses.document_etag(
+            "accounts", "test@email.com", "v1"
+        )
+        rv = client.get(
+            "/account",
+            query_string={"email": "test@email.com", "token": "henlo"},
+            headers={"If-None-Match": f'W/"{etag}"'},
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 304
+        assert rv.headers["X-Access-Token"] == "RefreshToken"
+        assert rv.headers["X-Refresh-Token"] == "AccessToken"
+        instance.update_time.assert_called_once_with("test@email.com")
+        instance.get.assert_not_called()
@@ -2,6 +2,7 @@ import pytest
 from biit_server import create_app, ban_handler
 from unittest.mock import patch
 from mockfirestore import MockFirestore
+from google.cloud.firestore import ArrayUnion
 
 
 @pytest.fixture
@@ -13,6 +14,8 @@ def client():
 
 
 class MockBanEmpty:
+    exists = True
+
     def __init__(self, member):
         self.bans = []
         self.members = [member]
@@ -22,6 +25,8 @@ class MockBanEmpty:
 
 
 class MockBan:
+    exists = True
+
     def __init__(self, member):
         self.bans = [member]
 
@@ -29,6 +34,13 @@ class MockBan:
         return {"bans": self.bans}
 
 
+class MockMissing:
+    exists = False
+
+    def to_dict(self):
+        return None
+
+
 def test_ban_post(client):
     """
     Tests that account post works correctly
@@ -38,11 +50,9 @@ def test_ban_post(client):
     with patch.object(
         ban_handler, "azure_refresh_token"
     ) as mock_azure_refresh_token, patch(
-        "biit_server.ban_handler.Database"
-    ) as mock_database:
-        instance = mock_database.return_value
-        instance.get.return_value = MockBanEmpty("last")
-        instance.update.return_value = True
+        "biit_server.ban_handler.update_members"
+    ) as mock_update_members:
+        mock_update_members.return_value = (MockBanEmpty("last"), True)
 
         mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
         rv = client.post(
@@ -60,6 +70,13 @@ def test_ban_post(client):
             == rv.data
         )
 
+        mock_update_members.assert_called_once_with(
+            "com",
+            "last",
+            False,
+            changes={"bans": ArrayUnion([{"name": "last", "ordered_by": "first"}])},
+        )
+
 
 def test_ban_put(client):
     """
@@ -98,3 +115,30 @@ def test_ban_put(client):
             b'{"access_token":"RefreshToken","message":"last has been unbanned","refresh_token":"AccessToken","status_code":200}\n'
             == rv.data
         )
+
+
+@pytest.mark.parametrize("found, status", [(False, 503), (MockMissing(), 404)])
+def test_ban_put_unreadable(client, found, status):
+    """
+    Tests that unbanning from a community that cannot be read or does not exist fails
+    """
+    with patch.object(
+        ban_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.ban_handler.Database"
+    ) as mock_database:
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+        instance = mock_database.return_value
+        instance.get.return_value = found
+        rv = client.put(
+            "/ban",
+            query_string={
+                "banner": "first",
+                "bannee": "last",
+                "community": "com",
+                "token": "test",
+            },
+        )
+
+    assert rv.status_code == status
+    instance.update.assert_not_called()
@@ -0,0 +1,186 @@
+import pytest
+from benchmarks.fakes import (
+    FakeAzure,
+    FakeDocument,
+    FakeFirestore,
+    FakeStorage,
+    backend_calls,
+    installed,
+)
+from biit_server import create_app
+from biit_server.batch_handler import BatchRequest, _readers, _run_in_app
+from biit_server.database import Database, write_batch
+
+
+@pytest.fixture
+def backends():
+    firestore_client = FakeFirestore()
+    storage_client = FakeStorage()
+    azure = FakeAzure()
+    for name in ("first", "second", "third"):
+        firestore_client.collection("communities").document(name)._set(
+            {"name": name, "Members": ["a@purdue.edu"], "Admins": []}
+        )
+    with installed(firestore_client, storage_client, azure):
+        yield firestore_client, azure
+
+
+@pytest.fixture
+def client():
+    cli = create_app({"TESTING": True, "TIMING_LOG": False})
+    with cli.test_client() as client:
+        yield client
+
+
+def test_batch_post(client, backends):
+    """
+    Tests that a batch authenticates once, reads concurrently and commits
+    the writes of each operation together
+    """
+    firestore_client, azure = backends
+    operations = [
+        {"method": "GET", "path": "/community", "args": {"name": "first"}},
+        {"method": "GET", "path": "/community", "args": {"name": "missing"}},
+        {
+            "method": "DELETE",
+            "path": "/community",
+            "args": {"name": "first", "email": "a@purdue.edu"},
+        },
+        {
+            "method": "DELETE",
+            "path": "/community",
+            "args": {"name": "second", "email": "a@purdue.edu"},
+        },
+        {
+            "method": "POST",
+            "path": "/community/third/leave",
+            "body": {"email": "a@purdue.edu"},
+        },
+        {"method": "GET", "path": "/nowhere"},
+    ]
+
+    rv = client.post("/batch", json={"token": "refresh", "operations": operations})
+
+    assert rv.status_code == 200
+    statuses = [result["status"] for result in rv.get_json()["results"]]
+    assert statuses == [200, 200, 200, 200, 200, 404]
+    assert rv.get_json()["results"][0]["body"]["data"]["name"] == "first"
+    assert rv.get_json()["results"][1]["body"]["data"] is None
+    assert rv.get_json()["results"][4]["body"]["data"]["Members"] == []
+
+    calls = backend_calls(firestore_client, azure)
+    assert calls["azure.token"] == 1
+    assert calls["firestore.delete"] == 0
+    assert calls["firestore.commit"] == 3
+    assert set(firestore_client.data["communities"]) == {"third"}
+
+
+def test_batch_failed_operation(client, backends, monkeypatch):
+    """
+    Tests that an operation whose backend failed is answered with a 503
+    without turning the results of the other operations into errors
+    """
+    from google.api_core.exceptions import ServiceUnavailable
+
+    firestore_client, _ = backends
+    get = FakeDocument.get
+
+    def failing_get(self, *args, **kwargs):
+        if self.id == "second":
+            raise ServiceUnavailable("down")
+        return get(self, *args, **kwargs)
+
+    monkeypatch.setattr(FakeDocument, "get", failing_get)
+    operations = [
+        {"method": "GET", "path": "/community", "args": {"name": "second"}},
+        {
+            "method": "DELETE",
+            "path": "/community",
+            "args": {"name": "first", "email": "a@purdue.edu"},
+        },
+    ]
+
+    rv = client.post("/batch", json={"token": "refresh", "operations": operations})
+
+    assert rv.status_code == 200
+    assert [result["status"] for result in rv.get_json()["results"]] == [503, 200]
+    assert "first" not in firestore_client.data["communities"]
+
+
+def test_batch_reads_outside_request_context(backends):
+    """
+    Tests that reads build their responses on reader threads, which do not
+    inherit the app context of the batch
+    """
+    app = create_app({"TESTING": True})
+    request = BatchRequest(
+        {"method": "GET", "path": "/community", "args": {"name": "first"}}, "refresh"
+    )
+
+    result = _readers.submit(_run_in_app, app, request).result()
+
+    assert result["status"] == 200
+    assert result["body"]["data"]["name"] == "first"
+
+
+def test_batch_put_body(client, backends):
+    """
+    Tests that the token is only added to the body of POST operations, the
+    bodies of the other operations refuse fields they do not know
+    """
+    firestore_client, _ = backends
+    operations = [
+        {
+            "method": "PUT",
+            "path": "/community",
+            "args": {"name": "first", "email": "a@purdue.edu"},
+            "body": {"updateFields": {"mpm": 3}},
+        },
+        {
+            "method": "POST",
+            "path": "/community/first/join",
+            "body": {"email": "b@x.edu"},
+        },
+    ]
+
+    rv = client.post("/batch", json={"token": "refresh", "operations": operations})
+
+    assert [result["status"] for result in rv.get_json()["results"]] == [200, 200]
+    assert firestore_client.data["communities"]["first"][0]["mpm"] == 3
+
+
+def test_batch_post_validation(client, backends):
+    """
+    Tests that a malformed batch is rejected before anything runs
+    """
+    rv = client.post("/batch", json={"token": "refresh"})
+    assert rv.status_code == 400
+
+    rv = client.post("/batch", json={"token": "refresh", "operations": [{}]})
+    assert rv.status_code == 400
+
+    operations = [{"method": "GET", "path": "/community"}] * 51
+    rv = client.post("/batch", json={"token": "refresh", "operations": operations})
+    assert rv.status_code == 400
+
+
+def test_database_write_batch(backends):
+    """
+    Tests that writes in a batch are committed together and flushed before reads
+    """
+    firestore_client, _ = backends
+    db = Database("communities")
+
+    with write_batch() as batch:
+        db.delete("first")
+        db.update("missing", {"name": "missing"})
+        assert firestore_client.backend.calls["firestore.commit"] == 0
+    assert firestore_client.backend.calls["firestore.commit"] == 1
+    assert batch.failed
+
+    with write_batch():
+        db.delete("first")
+        assert not db.get("first").exists
+        db.delete("second")
+    assert firestore_client.backend.calls["firestore.commit"] == 3
+    assert set(firestore_client.data["communities"]) == {"third"}
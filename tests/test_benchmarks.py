@@ -0,0 +1,60 @@
+from benchmarks import bench_startup
+from benchmarks.bench_handlers import COMMUNITY, SCENARIOS, compare, run
+
+
+def test_benchmarks_run():
+    """
+    Tests that every benchmark scenario succeeds against the fake backends
+    """
+    report = run(iterations=3, warmup=0)
+
+    assert set(report["results"]) == {scenario.name for scenario in SCENARIOS}
+    for result in report["results"].values():
+        assert result["statuses"] == {"200": 3}
+
+    assert report["results"]["GET /community"]["calls_per_request"] == {
+        "azure.token": 1.0,
+        "firestore.get": 1.0,
+    }
+    events = report["results"][f"GET /community/{COMMUNITY}/events"]
+    assert events["calls_per_request"]["firestore.unlisten"] == 1.0
+
+
+def test_benchmarks_compare():
+    """
+    Tests that a comparison run flags an endpoint gaining a backend call
+    """
+    baseline = {
+        "results": {
+            "GET /community": {
+                "p99_ms": 10.0,
+                "calls_per_request": {"firestore.get": 1.0},
+            }
+        }
+    }
+    current = {
+        "results": {
+            "GET /community": {
+                "p99_ms": 10.0,
+                "calls_per_request": {"firestore.get": 2.0},
+            }
+        }
+    }
+
+    assert compare(baseline, baseline) == []
+    assert compare(baseline, current) == [
+        "GET /community: firestore.get calls per request went from 1.0 to 2.0"
+    ]
+
+
+def test_benchmarks_startup():
+    """
+    Tests that importing the app loads none of the backend SDKs
+    """
+    report = bench_startup.run(runs=1)
+
+    assert report["heavy_modules"] == []
+    assert report["first_response_ms"] > 0
+    assert bench_startup.compare(report, dict(report, heavy_modules=["grpc"])) == [
+        "grpc is now loaded at import"
+    ]
@@ -0,0 +1,34 @@
+from unittest.mock import MagicMock, patch
+
+from biit_server import clients
+from biit_server.database import Database
+
+
+def test_clients_created_once():
+    """
+    Tests that a shared client is only built on first use and then reused
+    """
+    factory = MagicMock()
+    with patch.dict(clients.FACTORIES, {"firestore": factory}):
+        clients.reset()
+        try:
+            Database("accounts")
+            Database("communities")
+        finally:
+            clients.reset()
+
+    factory.assert_called_once_with()
+    factory.return_value.collection.assert_any_call("communities")
+
+
+def test_clients_installed():
+    """
+    Tests that installed clients are replaced for the block only
+    """
+    fake = MagicMock()
+    with patch.dict(clients.FACTORIES, {"storage": MagicMock}):
+        clients.reset()
+        with clients.installed(storage=fake):
+            assert clients.storage_client() is fake
+        assert clients.storage_client() is not fake
+        clients.reset()
@@ -1,7 +1,16 @@
 import json
 import pytest
 from biit_server import create_app, community_handler
-from unittest.mock import patch
+from unittest.mock import MagicMock, call, patch
+
+from biit_server.search import SEARCH_COLLECTION, index_entry
+from biit_server.summaries import (
+    MEMBER_SHARD_COLLECTION,
+    SUMMARY_COLLECTION,
+    shard_id,
+    shard_ids,
+    summary,
+)
 
 # Waiting on DB before adding tests
 
@@ -15,6 +24,8 @@ def client():
 
 
 class MockCollection:
+    exists = True
+
     def __init__(self):
         """Helper class to simulate a collection"""
         self.name = "mock"
@@ -29,6 +40,8 @@ class MockCollection:
 
 
 class MockCollectionLeave:
+    exists = True
+
     def __init__(self, test_data):
         """Helper class to simulate a collection"""
         self.name = "mock"
@@ -44,6 +57,8 @@ class MockCollectionLeave:
 
 
 class MockCommunity:
+    exists = True
+
     def __init__(self, name):
         self.name = name
 
@@ -71,9 +86,9 @@ def test_community_post(client):
         test_json = {
             "name": "Cool Community",
             "codeofconduct": "Eatmyshorts",
-            "Admins": "Me,John,Jeff",
-            "Members": "Me,John,Adam",
-            "mpm": "Here",
+            "Admins": ["Me", "John", "Jeff"],
+            "Members": ["Me", "John", "Adam"],
+            "mpm": 2,
             "meettype": "Here",
             "token": "TestToken",
         }
@@ -92,6 +107,16 @@ def test_community_post(client):
         test_json["bans"] = []
 
         instance.add.assert_called_once_with(test_json, id=test_json["name"])
+        assert instance.set.call_args_list == [
+            call(test_json["name"], index_entry(test_json)),
+            call(test_json["name"], summary(test_json)),
+            call(
+                shard_id(test_json["name"], 0),
+                {"community": test_json["name"], "count": 3},
+            ),
+        ]
+        mock_database.assert_any_call(SEARCH_COLLECTION)
+        mock_database.assert_any_call(SUMMARY_COLLECTION)
 
 
 def test_community_get(client):
@@ -147,13 +172,16 @@ def test_community_put(client):
             "name": "TestCommunity",
             "token": "TestToken",
             "email": "Testemail@gmail.com",
-            "updateFields": {"name": "lanes"},
+            "updateFields": {"codeofconduct": "lanes"},
         }
 
         mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
         rv = client.put(
             "/community",
-            query_string=test_json,
+            query_string={
+                key: value for key, value in test_json.items() if key != "updateFields"
+            },
+            json={"updateFields": test_json["updateFields"]},
             follow_redirects=True,
         )
         assert (
@@ -164,6 +192,7 @@ def test_community_put(client):
         instance.update.assert_called_once_with(
             test_json["name"], test_json["updateFields"]
         )
+        instance.set.assert_not_called()
 
 
 def test_community_delete(client):
@@ -192,7 +221,11 @@ def test_community_delete(client):
             == rv.data
         )
 
-        instance.delete.assert_called_once_with("TestCommunity")
+        assert instance.delete.call_args_list == [call("TestCommunity")] * 3 + [
+            call(id) for id in shard_ids("TestCommunity")
+        ]
+        mock_database.assert_any_call(SEARCH_COLLECTION)
+        mock_database.assert_any_call(MEMBER_SHARD_COLLECTION)
 
 
 def test_community_join_post(client):
@@ -203,10 +236,12 @@ def test_community_join_post(client):
         community_handler, "azure_refresh_token"
     ) as mock_azure_refresh_token, patch(
         "biit_server.community_handler.Database"
-    ) as mock_database:
+    ) as mock_database, patch(
+        "biit_server.community_handler.update_members"
+    ) as mock_update_members:
         instance = mock_database.return_value
         instance.get.return_value = MockCollection()
-        instance.update.return_value = True
+        mock_update_members.return_value = (MockCollection(), True)
 
         test_data = {"token": "Toke", "email": "Testemail@gmail.com"}
         test_id = "Johnson"
@@ -223,9 +258,31 @@ def test_community_join_post(client):
         )
 
         instance.get.assert_called_with(test_id)
-        instance.update.assert_called_once_with(
-            test_id, {"Members": [test_data["email"]]}
-        )
+        mock_update_members.assert_called_once_with(test_id, test_data["email"], True)
+        instance.update.assert_not_called()
+
+
+def test_community_join_post_errors(client):
+    """
+    Tests that joining a community that cannot be changed, does not exist or
+    already has the user answers with an error
+    """
+    with patch.object(
+        community_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.community_handler.update_members"
+    ) as mock_update_members:
+        test_data = {"token": "Toke", "email": "Testemail@gmail.com"}
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+
+        statuses = []
+        member = MockCollectionLeave(test_data["email"])
+        for joined in (False, (MagicMock(exists=False), False), (member, False)):
+            mock_update_members.return_value = joined
+            rv = client.post("/community/Johnson/join", json=test_data)
+            statuses.append(rv.status_code)
+
+        assert statuses == [503, 404, 400]
 
 
 def test_community_leave_post(client):
@@ -236,13 +293,15 @@ def test_community_leave_post(client):
         community_handler, "azure_refresh_token"
     ) as mock_azure_refresh_token, patch(
         "biit_server.community_handler.Database"
-    ) as mock_database:
+    ) as mock_database, patch(
+        "biit_server.community_handler.update_members"
+    ) as mock_update_members:
         test_data = {"token": "Toke", "email": "Testemail@gmail.com"}
         test_id = "Johnson"
 
         instance = mock_database.return_value
         instance.get.return_value = MockCollectionLeave(test_data["email"])
-        instance.update.return_value = True
+        mock_update_members.return_value = (instance.get.return_value, True)
 
         mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
         rv = client.post(
@@ -257,4 +316,183 @@ def test_community_leave_post(client):
         )
 
         instance.get.assert_called_with(test_id)
-        instance.update.assert_called_once_with(test_id, {"Members": []})
+        mock_update_members.assert_called_once_with(test_id, test_data["email"], False)
+
+
+class MockMissing:
+    exists = False
+
+    def to_dict(self):
+        return None
+
+
+@pytest.mark.parametrize("found, status", [(False, 503), (MockMissing(), 404)])
+def test_community_put_unreadable(client, found, status):
+    """
+    Tests that updating a community that cannot be read or does not exist fails
+    """
+    with patch.object(
+        community_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.community_handler.Database"
+    ) as mock_database:
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+        mock_database.return_value.get.return_value = found
+        rv = client.put(
+            "/community",
+            query_string={
+                "name": "TestCommunity",
+                "token": "TestToken",
+                "email": "Testemail@gmail.com",
+            },
+            json={"updateFields": {"codeofconduct": "lanes"}},
+        )
+
+    assert rv.status_code == status
+
+
+class MockVersionedCommunity(MockCommunity):
+    def __init__(self, name, update_time):
+        super().__init__(name)
+        self.update_time = update_time
+
+
+def test_community_get_etag(client):
+    """
+    Tests that community get tags the response and answers matching polls with a 304
+    """
+    with patch.object(
+        community_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.community_handler.Database"
+    ) as mock_database:
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+
+        instance = mock_database.return_value
+        instance.get.return_value = MockVersionedCommunity("TestCommunity", "v1")
+        instance.update_time.return_value = "v1"
+
+        rv = client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "dabonem"},
+            follow_redirects=True,
+        )
+        etag = rv.headers["ETag"]
+
+        assert rv.status_code == 200
+        assert etag.startswith("W/")
+
+        rv = client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "dabonem"},
+            headers={"If-None-Match": etag},
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 304
+        assert b"" == rv.data
+        assert rv.headers["X-Refresh-Token"] == "AccessToken"
+        instance.get.assert_called_once_with("TestCommunity")
+
+        instance.update_time.return_value = "v2"
+        rv = client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "dabonem"},
+            headers={"If-None-Match": etag},
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 200
+        assert instance.get.call_count == 2
+
+
+class MockLargeCommunity:
+    exists = True
+
+    def __init__(self, members):
+        self.members = members
+
+    def to_dict(self):
+        return {"name": "TestCommunity", "Members": list(self.members)}
+
+
+def test_community_get_fields(client):
+    """
+    Tests that community get only reads and returns the selected fields
+    """
+    with patch.object(
+        community_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.community_handler.Database"
+    ) as mock_database:
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+
+        instance = mock_database.return_value
+        instance.get.return_value = MockCommunity("TestCommunity")
+
+        rv = client.get(
+            "/community",
+            query_string={
+                "name": "TestCommunity",
+                "token": "dabonem",
+                "fields": "name",
+            },
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 200
+        instance.get.assert_called_once_with("TestCommunity", fields=["name"])
+
+        rv = client.get(
+            "/community",
+            query_string={
+                "name": "TestCommunity",
+                "token": "dabonem",
+                "fields": "token",
+            },
+            follow_redirects=True,
+        )
+
+        assert rv.status_code == 400
+        assert instance.get.call_count == 1
+
+
+def test_community_get_members_pages(client):
+    """
+    Tests that community get pages through the members with a cursor
+    """
+    with patch.object(
+        community_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.community_handler.Database"
+    ) as mock_database:
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+
+        members = [f"member{i}@purdue.edu" for i in range(5)]
+        instance = mock_database.return_value
+        instance.get.return_value = MockLargeCommunity(members)
+
+        query = {"name": "TestCommunity", "token": "dabonem", "limit": "2"}
+        rv = client.get("/community", query_string=query, follow_redirects=True)
+        first = rv.get_json()
+
+        assert first["data"]["Members"] == members[:2]
+        assert first["next_cursor"]
+
+        # a member leaving before the cursor does not skip anyone
+        members.remove("member0@purdue.edu")
+        query["cursor"] = first["next_cursor"]
+        rv = client.get("/community", query_string=query, follow_redirects=True)
+        second = rv.get_json()
+
+        assert second["data"]["Members"] == members[1:3]
+
+        query["cursor"] = second["next_cursor"]
+        rv = client.get("/community", query_string=query, follow_redirects=True)
+
+        assert rv.get_json()["data"]["Members"] == members[3:]
+        assert rv.get_json()["next_cursor"] is None
+
+        query["cursor"] = "not a cursor"
+        rv = client.get("/community", query_string=query, follow_redirects=True)
+        assert rv.status_code == 400
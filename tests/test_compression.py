@@ -0,0 +1,106 @@
+import gzip
+from unittest.mock import patch
+
+import pytest
+from flask import jsonify
+from werkzeug.http import parse_accept_header
+from biit_server import create_app
+from biit_server.compression import _choose_encoding
+
+
+@pytest.fixture
+def app():
+    app = create_app({"TESTING": True, "COMPRESS_MIN_SIZE": 100})
+
+    @app.route("/test/large")
+    def large_route():
+        return jsonify({"Members": [f"member{i}@purdue.edu" for i in range(100)]})
+
+    @app.route("/test/small")
+    def small_route():
+        return jsonify({"name": "tiny"})
+
+    @app.route("/test/image")
+    def image_route():
+        return b"\x89PNG" + b"\x00" * 1000, 200, {"Content-Type": "image/png"}
+
+    return app
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        yield client
+
+
+def test_compression_gzip(client):
+    """
+    Tests that large json responses are gzipped when the client accepts it
+    """
+    rv = client.get("/test/large", headers={"Accept-Encoding": "gzip"})
+
+    assert rv.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in rv.headers["Vary"]
+    assert int(rv.headers["Content-Length"]) == len(rv.data)
+    assert b"member99@purdue.edu" in gzip.decompress(rv.data)
+
+
+def test_compression_not_accepted(client):
+    """
+    Tests that responses are not compressed without an Accept-Encoding header
+    """
+    rv = client.get("/test/large")
+
+    assert "Content-Encoding" not in rv.headers
+    assert b"member99@purdue.edu" in rv.data
+
+
+def test_compression_below_threshold(client):
+    """
+    Tests that responses smaller than the threshold are sent as is
+    """
+    rv = client.get("/test/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in rv.headers
+    assert b'{"name":"tiny"}\n' == rv.data
+
+
+def test_compression_skips_images(client):
+    """
+    Tests that already compressed image bytes are not compressed again
+    """
+    rv = client.get("/test/image", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in rv.headers
+    assert rv.data.startswith(b"\x89PNG")
+
+
+def test_compression_highest_quality():
+    """
+    Tests that the accepted encoding with the highest quality is picked
+    """
+    accept = lambda header: parse_accept_header(header)
+
+    with patch("biit_server.compression.brotli", object()):
+        assert _choose_encoding(accept("gzip;q=1.0, br;q=0.5")) == "gzip"
+        assert _choose_encoding(accept("gzip;q=0.5, br;q=1.0")) == "br"
+        assert _choose_encoding(accept("gzip, br")) == "br"
+        assert _choose_encoding(accept("br;q=0, identity")) == ""
+    with patch("biit_server.compression.brotli", None):
+        assert _choose_encoding(accept("br, gzip;q=0.1")) == "gzip"
+
+
+def test_compression_disabled():
+    """
+    Tests that compression can be turned off through the config
+    """
+    app = create_app({"TESTING": True, "COMPRESS_ENABLED": False})
+
+    @app.route("/test/large")
+    def large_route():
+        return jsonify({"data": "a" * 1000})
+
+    with app.test_client() as client:
+        rv = client.get("/test/large", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in rv.headers
@@ -1,7 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import time
+from unittest.mock import MagicMock
+
+from benchmarks.fakes import FakeFirestore
 from mockfirestore import MockFirestore
 import pytest
 
+import biit_server.database
 from biit_server.database import Database
+from biit_server.deadline import deadline
+from biit_server.errors import DeadlineExceeded
 
 
 def test_database_add():
@@ -141,3 +150,146 @@ def test_database_delete():
     doc = mock_db.collection(test_collection_name).document(test_data["id"]).get()
 
     assert not doc.exists
+
+
+def test_database_update_time():
+    """
+    Tests that database library caches the update_time of read documents
+    until the document is written to.
+    """
+    mock_db = MockFirestore()
+
+    test_data = {"name": "Leroy", "id": "1337"}
+
+    test_collection_name = "users"
+
+    mock_db.collection(test_collection_name).document(test_data["id"]).set(test_data)
+
+    test_db = Database(test_collection_name, firestore_client=mock_db)
+
+    cache = biit_server.database._update_times
+
+    test_db.get(test_data["id"])
+    update_time = test_db.update_time(test_data["id"])
+
+    assert update_time is not None
+    assert test_db.update_time(test_data["id"]) is update_time
+
+    test_db.update(test_data["id"], {"name": "Olivia"})
+
+    assert cache.get((test_collection_name, test_data["id"])) is None
+
+
+def test_database_get_single_flight():
+    """
+    Tests that concurrent reads of the same document share one Firestore read,
+    and that reads after a write do not join a read started before it.
+    """
+    started, release = Event(), Event()
+    firestore_client = MagicMock()
+    document = firestore_client.collection.return_value.document.return_value
+
+    def slow_get(**kwargs):
+        started.set()
+        release.wait(1)
+        return document.snapshot
+
+    document.get.side_effect = slow_get
+    test_db = Database("users", firestore_client=firestore_client)
+    flights = biit_server.database._gets
+    followers = flights.followers
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(test_db.get, "1337")
+        started.wait(1)
+        joined = [pool.submit(test_db.get, "1337") for _ in range(3)]
+        while flights.followers < followers + 3:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [future.result() for future in joined]
+
+    assert document.get.call_count == 1
+    assert all(result is document.snapshot for result in results)
+    assert flights.ratio() > 0
+
+    release.clear()
+    started.clear()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        stale = pool.submit(test_db.get, "1337")
+        started.wait(1)
+        test_db.update("1337", {"name": "Olivia"})
+        fresh = pool.submit(test_db.get, "1337")
+        while document.get.call_count < 3:
+            time.sleep(0.001)
+        release.set()
+        stale.result(), fresh.result()
+
+    assert document.get.call_count == 3
+
+
+def test_database_get_single_flight_deadlines():
+    """
+    Tests that a reader waits for a read in flight only as long as its own
+    deadline, and reads again itself when that read ran out of time
+    """
+    started, release = Event(), Event()
+    firestore_client = MagicMock()
+    document = firestore_client.collection.return_value.document.return_value
+    calls = []
+
+    def slow_get(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            started.set()
+            release.wait(1)
+            raise DeadlineExceeded("the leader ran out of time")
+        return document.snapshot
+
+    def get_within(seconds):
+        with deadline(seconds):
+            return test_db.get("42")
+
+    document.get.side_effect = slow_get
+    test_db = Database("users", firestore_client=firestore_client)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        leader = pool.submit(get_within, 5)
+        started.wait(1)
+        hurried = pool.submit(get_within, 0.05)
+        assert hurried.result(1) is False
+        followers = biit_server.database._gets.followers
+        patient = pool.submit(test_db.get, "42")
+        while biit_server.database._gets.followers == followers:
+            time.sleep(0.001)
+        release.set()
+
+        assert leader.result() is False
+        assert patient.result() is document.snapshot
+    assert len(calls) == 2
+
+
+def test_database_get_missing_cached():
+    """
+    Tests that a document found missing is not read again until it is added,
+    and that a read which started before the add does not cache its answer.
+    """
+    # MockFirestore refuses to add a document that was read while missing
+    mock_db = FakeFirestore()
+    test_db = Database("users", firestore_client=mock_db)
+
+    first = test_db.get("ghost")
+    second = test_db.get("ghost")
+    assert not first.exists
+    assert second is first
+    assert mock_db.backend.calls["firestore.get"] == 1
+    assert test_db.update_time("ghost") is None
+
+    test_db.add({"name": "Casper"}, id="ghost")
+
+    assert test_db.get("ghost").to_dict() == {"name": "Casper"}
+
+    missing = biit_server.database._missing
+    token = missing.token()
+    test_db.delete("ghost")
+    missing.set(("users", "ghost"), (mock_db, first), token)
+    assert test_db._known_missing("ghost") is None
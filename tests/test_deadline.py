@@ -0,0 +1,167 @@
+from unittest.mock import MagicMock
+
+import pytest
+from benchmarks.fakes import FakeAzure, FakeFirestore, FakeStorage, installed
+from biit_server import create_app
+from biit_server.database import Database
+from biit_server.deadline import (
+    call_options,
+    current_deadline,
+    deadline,
+    record_failure,
+)
+from biit_server.errors import BackendUnavailable, DeadlineExceeded, is_timeout
+from mockfirestore import MockFirestore
+
+
+@pytest.fixture
+def backends():
+    firestore_client = FakeFirestore()
+    firestore_client.collection("communities").document("TestCommunity")._set(
+        {"name": "TestCommunity"}
+    )
+    with installed(firestore_client, FakeStorage(), FakeAzure()):
+        yield firestore_client
+
+
+def test_deadline_call_options_outside_request():
+    """
+    Tests that calls made outside of a request or deadline block get no timeout
+    """
+    assert current_deadline() is None
+    assert call_options(5) == {}
+
+
+def test_deadline_call_options_caps_timeout():
+    """
+    Tests that a call gets the time left, capped to the timeout of its backend
+    """
+    with deadline(60):
+        assert call_options(5) == {"timeout": 5}
+        assert 0 < call_options()["timeout"] <= 60
+
+    with deadline(1):
+        assert call_options(5)["timeout"] <= 1
+
+
+def test_deadline_exhausted_fails_fast():
+    """
+    Tests that a call with no time left raises without reaching the backend
+    """
+    with deadline(0) as current:
+        with pytest.raises(DeadlineExceeded):
+            call_options(5)
+    assert current.failure == "deadline"
+
+
+def test_deadline_clients_without_timeout(caplog):
+    """
+    Tests that clients whose calls take no timeout, like mockfirestore, are
+    called without one and that it is logged
+    """
+    mock_db = MockFirestore()
+    mock_db.collection("communities").document("TestCommunity").set({"name": "a"})
+    communities = Database("communities", firestore_client=mock_db)
+
+    with deadline(2):
+        assert call_options(5, lambda: None) == {}
+        assert "no timeout" in caplog.text
+        assert communities.get("TestCommunity").to_dict() == {"name": "a"}
+        assert len(communities.query("name", "==", "a")) == 1
+
+
+def test_deadline_timeout_passed_to_firestore():
+    """
+    Tests that firestore calls in a deadline block get the time left as timeout
+    """
+    firestore_client = MagicMock()
+    with installed(firestore_client, FakeStorage()):
+        with deadline(2):
+            Database("communities").get("TestCommunity")
+        with deadline(0):
+            assert Database("communities").get("TestCommunity") is False
+
+    document = firestore_client.collection.return_value.document.return_value
+    document.get.assert_called_once()
+    assert 0 < document.get.call_args.kwargs["timeout"] <= 2
+
+
+def test_deadline_request_answers_504(backends):
+    """
+    Tests that a request which runs out of time is answered with a 504, not a 400
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_ENABLED": False})
+
+    with app.test_client() as client:
+        rv = client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "refresh"},
+            headers={"X-Request-Timeout": "0"},
+        )
+        ok = client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "refresh"},
+        )
+
+    assert rv.status_code == 504
+    assert ok.status_code == 200
+
+
+def test_deadline_keeps_answers():
+    """
+    Tests that only error responses are replaced by the failure of a backend call
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_ENABLED": False})
+
+    @app.route("/test/cached")
+    def cached_route():
+        record_failure(BackendUnavailable("down"))
+        return "cached"
+
+    @app.route("/test/failed")
+    def failed_route():
+        record_failure(BackendUnavailable("down"))
+        return "Bad Request: Community not found", 400
+
+    with app.test_client() as client:
+        cached = client.get("/test/cached")
+        failed = client.get("/test/failed")
+
+    assert cached.status_code == 200
+    assert failed.status_code == 503
+
+
+def test_deadline_route_budget(backends):
+    """
+    Tests that routes get their own budget and the header can only shorten it
+    """
+    app = create_app(
+        {
+            "TESTING": True,
+            "RATELIMIT_ENABLED": False,
+            "DEADLINE_ROUTES": {"/community": 0.0},
+        }
+    )
+
+    with app.test_client() as client:
+        rv = client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "refresh"},
+            headers={"X-Request-Timeout": "30"},
+        )
+
+    assert rv.status_code == 504
+
+
+def test_deadline_is_timeout():
+    """
+    Tests that timeouts of the SDKs are recognized by name
+    """
+
+    class ReadTimeout(OSError):
+        pass
+
+    assert is_timeout(DeadlineExceeded())
+    assert is_timeout(TimeoutError())
+    assert is_timeout(ReadTimeout())
+    assert not is_timeout(ValueError())
@@ -0,0 +1,143 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from biit_server import create_app
+from biit_server.events import WORKER_THREADS, EventHub, diff, stream
+
+
+def snapshot(data):
+    return MagicMock(to_dict=MagicMock(return_value=data))
+
+
+@pytest.fixture
+def firestore_client():
+    firestore_client = MagicMock()
+    document = firestore_client.collection.return_value.document.return_value
+    firestore_client.watch = document.on_snapshot.return_value
+    return firestore_client
+
+
+def test_events_diff():
+    """
+    Tests that joins, leaves, bans and deletions become events
+    """
+    before = {"Members": ["a", "b"], "bans": [{"name": "c", "ordered_by": "a"}]}
+    after = {"Members": ["b", "d"], "bans": [{"name": "e", "ordered_by": "b"}]}
+
+    assert diff(before, after) == [
+        ("joined", {"email": "d"}),
+        ("left", {"email": "a"}),
+        ("banned", {"email": "e"}),
+        ("unbanned", {"email": "c"}),
+    ]
+    assert diff(after, None) == [("deleted", {})]
+    assert diff(None, None) == []
+
+
+def test_events_fan_out(firestore_client):
+    """
+    Tests that one listener per community feeds every stream following it,
+    and is closed with the last stream
+    """
+    hub = EventHub(max_subscribers=10, queue_size=10)
+    first = hub.subscribe(firestore_client, "c")
+    second = hub.subscribe(firestore_client, "c")
+
+    document = firestore_client.collection.return_value.document.return_value
+    document.on_snapshot.assert_called_once()
+    on_snapshot = document.on_snapshot.call_args.args[0]
+    on_snapshot([snapshot({"Members": ["a"]})], [], None)
+    on_snapshot([snapshot({"Members": ["a", "b"]})], [], None)
+
+    assert first.queue.get_nowait() == ("joined", {"email": "b"})
+    assert second.queue.get_nowait() == ("joined", {"email": "b"})
+    assert first.queue.empty()
+
+    hub.unsubscribe(first)
+    firestore_client.watch.unsubscribe.assert_not_called()
+    hub.unsubscribe(second)
+    firestore_client.watch.unsubscribe.assert_called_once()
+    assert hub.count == 0
+
+
+def test_events_bounded(firestore_client):
+    """
+    Tests that streams are capped, and that a slow stream is told to resync
+    instead of buffering without bound
+    """
+    hub = EventHub(max_subscribers=1, queue_size=2)
+    subscriber = hub.subscribe(firestore_client, "c")
+    assert hub.subscribe(firestore_client, "other") is None
+
+    for i in range(5):
+        subscriber.push("joined", {"email": str(i)})
+
+    chunks = list(stream(hub, subscriber, keepalive=0.01, max_duration=1))
+
+    assert chunks[1:] == [
+        'event: joined\ndata: {"email": "0"}\n\n',
+        'event: joined\ndata: {"email": "1"}\n\n',
+        "event: resync\ndata: {}\n\n",
+    ]
+    assert hub.count == 0
+
+
+def test_events_route(firestore_client):
+    """
+    Tests that the events endpoint authenticates once and streams the changes of the community
+    """
+    app = create_app(
+        {
+            "TESTING": True,
+            "RATELIMIT_ENABLED": False,
+            "EVENTS_KEEPALIVE": 0.01,
+            "EVENTS_MAX_DURATION": 0.05,
+        }
+    )
+
+    with patch("biit_server.community_handler.clients") as clients, patch.dict(
+        "os.environ", {"STAGE": "dev"}
+    ):
+        clients.firestore_client.return_value = firestore_client
+        with app.test_client() as client:
+            rv = client.get(
+                "/community/c/events", query_string={"token": "t"}, buffered=False
+            )
+            document = firestore_client.collection.return_value.document.return_value
+            on_snapshot = document.on_snapshot.call_args.args[0]
+            on_snapshot([snapshot({"Members": []})], [], None)
+            on_snapshot([snapshot({"Members": ["a"]})], [], None)
+            body = b"".join(rv.response).decode()
+
+        missing = client.get("/community/c/events")
+
+    assert rv.status_code == 200
+    assert rv.mimetype == "text/event-stream"
+    assert body.startswith("event: ready\n")
+    assert '"refresh_token": "RefreshToken"' in body
+    assert 'event: joined\ndata: {"email": "a"}\n\n' in body
+    assert missing.status_code == 400
+    assert app.extensions["events"].count == 0
+    # streams hold a worker thread each, half of them keep serving requests
+    assert app.config["EVENTS_MAX_SUBSCRIBERS"] == WORKER_THREADS // 2
+
+
+def test_events_closed_before_start(firestore_client):
+    """
+    Tests that a stream closed before its body started gives its slot back
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_ENABLED": False})
+
+    with patch("biit_server.community_handler.clients") as clients, patch.dict(
+        "os.environ", {"STAGE": "dev"}
+    ):
+        clients.firestore_client.return_value = firestore_client
+        with app.test_client() as client:
+            rv = client.get(
+                "/community/c/events", query_string={"token": "t"}, buffered=False
+            )
+            assert app.extensions["events"].count == 1
+            rv.close()
+
+    assert app.extensions["events"].count == 0
+    firestore_client.watch.unsubscribe.assert_called_once()
@@ -0,0 +1,97 @@
+from threading import Event
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from biit_server import hedging
+from biit_server.database import Database
+from biit_server.metrics import HEDGED_READS
+
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    with patch.object(hedging, "_windows", {}), patch.object(
+        hedging, "_budget", hedging.RetryBudget(ratio=hedging.HEDGE_MAX_RATE, minimum=1)
+    ), patch.object(hedging, "HEDGE_DEFAULT_DELAY", 0.01):
+        yield
+
+
+def hedged_reads(collection, result):
+    return HEDGED_READS.collect().get((collection, result), 0)
+
+
+def test_hedging_fast_read_not_hedged():
+    """
+    Tests that a read answering before the delay is made only once
+    """
+    read = MagicMock(return_value="doc")
+
+    assert hedging.hedged("fast", read) == "doc"
+    assert read.call_count == 1
+    assert hedged_reads("fast", "fired") == 0
+
+
+def test_hedging_slow_read_hedged():
+    """
+    Tests that a slow read is hedged and the faster answer is returned
+    """
+    release = Event()
+    answers = iter(["slow", "hedge"])
+
+    def read():
+        answer = next(answers)
+        if answer == "slow":
+            release.wait(1)
+        return answer
+
+    try:
+        assert hedging.hedged("slow", read) == "hedge"
+    finally:
+        release.set()
+    assert hedged_reads("slow", "fired") == 1
+    assert hedged_reads("slow", "won") == 1
+
+
+def test_hedging_rate_capped():
+    """
+    Tests that once the hedge budget is spent slow reads are waited for instead
+    """
+    read = MagicMock(side_effect=lambda: time.sleep(0.03) or "doc")
+
+    for _ in range(5):
+        assert hedging.hedged("capped", read) == "doc"
+
+    assert hedged_reads("capped", "fired") == 1
+    assert read.call_count == 6
+
+
+def test_hedging_delay_from_percentile():
+    """
+    Tests that the delay follows the percentile of recent reads
+    """
+    window = hedging.LatencyWindow(size=100, refresh=10)
+    assert window.delay() == 0.01
+
+    for i in range(100):
+        window.add(i / 1000)
+
+    assert window.delay() == pytest.approx(0.095)
+
+
+def test_hedging_database_opt_in():
+    """
+    Tests that Database only hedges the reads of the configured collections
+    """
+    firestore_client = MagicMock()
+    document = firestore_client.collection.return_value.document.return_value
+    snapshot = document.get.return_value
+
+    with patch("biit_server.database.hedged", wraps=hedging.hedged) as hedged, patch(
+        "biit_server.database.HEDGE_COLLECTIONS", {"communities"}
+    ):
+        assert Database("communities", firestore_client).get("a", ["name"]) is snapshot
+        assert Database("accounts", firestore_client).get("b") is snapshot
+
+    assert hedged.call_count == 1
+    document.get.assert_any_call(field_paths=["name"])
+    document.get.assert_any_call()
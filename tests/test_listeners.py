@@ -0,0 +1,115 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from biit_server.database import Database
+from biit_server.listeners import DocumentListeners
+
+
+class FakeWatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.is_active = True
+        self.unsubscribed = False
+
+    def unsubscribe(self):
+        self.unsubscribed = True
+        self.is_active = False
+
+
+@pytest.fixture
+def firestore_client():
+    firestore_client = MagicMock()
+    firestore_client.watches = {}
+    document = firestore_client.collection.return_value.document
+
+    def on_snapshot(id):
+        def start(callback):
+            watch = firestore_client.watches[id] = FakeWatch(callback)
+            return watch
+
+        return start
+
+    document.side_effect = lambda id: MagicMock(
+        on_snapshot=on_snapshot(id), get=MagicMock(return_value=snapshot(id, 1))
+    )
+    return firestore_client
+
+
+def snapshot(id, version):
+    return MagicMock(exists=True, update_time=version, id=id)
+
+
+@pytest.fixture
+def listeners():
+    listeners = DocumentListeners(max_documents=2, min_reads=2)
+    with patch("biit_server.database._listeners", listeners), patch(
+        "biit_server.database.LISTEN_COLLECTIONS", {"communities"}
+    ):
+        yield listeners
+    listeners.clear()
+
+
+def test_listeners_serve_hot_documents(firestore_client, listeners):
+    """
+    Tests that a document read often enough is listened to and then read locally
+    """
+    community_db = Database("communities", firestore_client)
+
+    community_db.get("hot")
+    community_db.get("hot")
+    watch = firestore_client.watches["hot"]
+    pushed = snapshot("hot", 2)
+    watch.callback([pushed], [], None)
+
+    assert community_db.get("hot") is pushed
+    assert community_db.update_time("hot") == 2
+    assert Database("accounts", firestore_client).get("hot") is not pushed
+
+
+def test_listeners_stale_after_local_write(firestore_client, listeners):
+    """
+    Tests that the local copy is not served after a write of this process,
+    until the listener brings the new version
+    """
+    community_db = Database("communities", firestore_client)
+    community_db.get("hot")
+    community_db.get("hot")
+    watch = firestore_client.watches["hot"]
+    watch.callback([snapshot("hot", 2)], [], None)
+
+    community_db.update("hot", {"mpm": 3})
+
+    assert community_db.get("hot").update_time == 1
+    watch.callback([snapshot("hot", 2)], [], None)
+    assert community_db.get("hot").update_time == 1
+    watch.callback([snapshot("hot", 3)], [], None)
+    assert community_db.get("hot").update_time == 3
+
+
+def test_listeners_lru_eviction(firestore_client, listeners):
+    """
+    Tests that the least recently read document stops being listened to first
+    """
+    community_db = Database("communities", firestore_client)
+    for id in ("a", "a", "b", "b", "a", "c", "c"):
+        community_db.get(id)
+
+    assert firestore_client.watches["b"].unsubscribed
+    assert not firestore_client.watches["a"].unsubscribed
+    assert not firestore_client.watches["c"].unsubscribed
+    assert len(listeners) == 2
+
+
+def test_listeners_inactive_watch_dropped(firestore_client, listeners):
+    """
+    Tests that the copy of a listener that stopped is not served
+    """
+    community_db = Database("communities", firestore_client)
+    community_db.get("hot")
+    community_db.get("hot")
+    watch = firestore_client.watches["hot"]
+    watch.callback([snapshot("hot", 2)], [], None)
+    watch.is_active = False
+
+    assert community_db.get("hot").update_time == 1
+    assert len(listeners) == 0
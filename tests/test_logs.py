@@ -0,0 +1,78 @@
+import json
+import logging
+
+import pytest
+from biit_server.logs import (
+    LOG_DROPPED,
+    JsonFormatter,
+    NonBlockingHandler,
+    start_logging,
+    stop_logging,
+)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(JsonFormatter())
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+@pytest.fixture
+def root_handlers():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    stop_logging()
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_logs_pipeline(root_handlers):
+    """
+    Tests that records are written as json lines by the flusher and flushed on stop
+    """
+    target = ListHandler()
+    start_logging([target])
+
+    logging.getLogger("biit_server.requests").info(json.dumps({"route": "/ban"}))
+    logging.getLogger("biit_server.test").warning("slow %s", "firestore")
+    stop_logging()
+
+    lines = [json.loads(line) for line in target.lines]
+    assert lines == [
+        {"severity": "INFO", "logger": "biit_server.requests", "route": "/ban"},
+        {
+            "severity": "WARNING",
+            "logger": "biit_server.test",
+            "message": "slow firestore",
+        },
+    ]
+
+
+def test_logs_drop_policy():
+    """
+    Tests that a full queue drops info records and makes room for warnings
+    """
+    logger = logging.getLogger("biit_server.test_drop")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = NonBlockingHandler(queue_size=2)
+    logger.addHandler(handler)
+    before = LOG_DROPPED.collect().get(("INFO",), 0)
+
+    try:
+        for i in range(3):
+            logger.info("request %d", i)
+        logger.error("failed")
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+
+    waiting = [handler.queue.get_nowait().msg for _ in range(2)]
+    assert waiting == ["request 1", "failed"]
+    assert LOG_DROPPED.collect().get(("INFO",), 0) - before == 2
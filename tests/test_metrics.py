@@ -0,0 +1,140 @@
+import os
+import subprocess
+import sys
+from threading import Thread
+
+import pytest
+from biit_server import create_app
+from biit_server.database import Database
+from biit_server.metrics import FIRESTORE_READS, MetricsRegistry
+from mockfirestore import MockFirestore
+
+
+@pytest.fixture
+def client():
+    cli = create_app()
+    cli.config["TESTING"] = True
+    with cli.test_client() as client:
+        yield client
+
+
+def test_metrics_counter_threads():
+    """
+    Tests that counter updates from many threads all add up
+    """
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter", ("route",))
+
+    def work():
+        for _ in range(1000):
+            counter.inc("/community")
+
+    threads = [Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.collect() == {("/community",): 8000}
+    # the shards of the exited threads were folded together
+    assert len(counter._shards) == 1
+
+
+def test_metrics_histogram_render():
+    """
+    Tests that histograms are rendered with cumulative buckets
+    """
+    registry = MetricsRegistry()
+    histogram = registry.histogram("test_seconds", "Test histogram", buckets=(0.1, 1))
+
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    text = registry.render()
+
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_seconds_count 3" in text
+
+
+def test_metrics_worker_snapshots(tmp_path):
+    """
+    Tests that snapshots written by other worker processes are added up
+    """
+    worker = MetricsRegistry()
+    worker.counter("test_total", "Test counter").inc(amount=3)
+    worker.write_snapshot(str(tmp_path))
+    (tmp_path / f"metrics-{os.getpid()}.json").rename(
+        tmp_path / f"metrics-{os.getppid()}.json"
+    )
+
+    registry = MetricsRegistry()
+    registry.counter("test_total", "Test counter").inc(amount=2)
+
+    assert "test_total 5" in registry.render(str(tmp_path))
+
+
+def test_metrics_dead_worker_snapshots(tmp_path):
+    """
+    Tests that snapshots of worker processes that exited are removed
+    """
+    worker = MetricsRegistry()
+    worker.counter("test_total", "Test counter").inc(amount=3)
+    worker.write_snapshot(str(tmp_path))
+    pid = int(
+        subprocess.run(
+            [sys.executable, "-c", "import os; print(os.getpid())"],
+            capture_output=True,
+            text=True,
+        ).stdout
+    )
+    (tmp_path / f"metrics-{os.getpid()}.json").rename(tmp_path / f"metrics-{pid}.json")
+
+    registry = MetricsRegistry()
+    registry.counter("test_total", "Test counter").inc(amount=2)
+
+    assert "test_total 2" in registry.render(str(tmp_path))
+    assert not (tmp_path / f"metrics-{pid}.json").exists()
+
+
+def test_metrics_route_access():
+    """
+    Tests that /metrics is only served with the metrics token, or locally without one
+    """
+    app = create_app({"TESTING": True, "METRICS_TOKEN": "secret"})
+    with app.test_client() as client:
+        assert client.get("/metrics").status_code == 403
+        assert (
+            client.get(
+                "/metrics", headers={"Authorization": "Bearer secret"}
+            ).status_code
+            == 200
+        )
+
+    app = create_app({"TESTING": True, "METRICS_TOKEN": None})
+    with app.test_client() as client:
+        remote = {"REMOTE_ADDR": "10.0.0.1"}
+        assert client.get("/metrics", environ_base=remote).status_code == 403
+        assert client.get("/metrics").status_code == 200
+
+
+def test_metrics_route(client):
+    """
+    Tests that /metrics reports requests and firestore reads
+    """
+    mock_db = MockFirestore()
+    before = FIRESTORE_READS.collect().get(("metrics_test",), 0)
+
+    Database("metrics_test", firestore_client=mock_db).get("missing")
+    client.get("/community")
+
+    rv = client.get("/metrics")
+    text = rv.data.decode("utf-8")
+
+    assert rv.status_code == 200
+    assert rv.mimetype == "text/plain"
+    assert 'http_requests_total{route="/community",method="GET",status="400"}' in text
+    assert 'http_request_duration_seconds_bucket{route="/community"' in text
+    assert FIRESTORE_READS.collect()[("metrics_test",)] == before + 1
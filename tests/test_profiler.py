@@ -0,0 +1,81 @@
+import json
+import logging
+
+import pytest
+from biit_server import create_app, community_handler
+from unittest.mock import patch
+
+
+class MockCommunity:
+    def __init__(self, name):
+        self.name = name
+
+    def to_dict(self):
+        return {"name": self.name}
+
+
+def get_community(client, headers=None):
+    with patch.object(
+        community_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.community_handler.Database"
+    ) as mock_database:
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+        mock_database.return_value.get.return_value = MockCommunity("TestCommunity")
+        return client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "dabonem"},
+            headers=headers or {},
+            follow_redirects=True,
+        )
+
+
+def test_profiler_sampled(tmp_path, caplog):
+    """
+    Tests that sampled requests are logged by route and written to the profile directory
+    """
+    app = create_app(
+        {"TESTING": True, "PROFILE_SAMPLE_RATE": 1.0, "PROFILE_DIR": str(tmp_path)}
+    )
+
+    with app.test_client() as client, caplog.at_level(
+        logging.INFO, logger="biit_server.profiler"
+    ):
+        rv = get_community(client)
+
+    assert rv.status_code == 200
+    assert "X-Biit-Profile-Top" not in rv.headers
+
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line["route"] == "/community"
+    assert any("community_get" in row["function"] for row in line["top"])
+
+    profiles = list(tmp_path.iterdir())
+    assert len(profiles) == 1
+    assert profiles[0].name.startswith("community-GET-")
+
+
+def test_profiler_header():
+    """
+    Tests that only the secret header triggers a profile when sampling is off
+    """
+    app = create_app({"TESTING": True, "PROFILE_SECRET": "hunter2"})
+
+    with app.test_client() as client:
+        wrong = get_community(client, {"X-Biit-Profile": "guess"})
+        right = get_community(client, {"X-Biit-Profile": "hunter2"})
+
+    assert "X-Biit-Profile-Top" not in wrong.headers
+    assert "community_get" in right.headers["X-Biit-Profile-Top"]
+
+
+def test_profiler_off():
+    """
+    Tests that nothing is profiled by default
+    """
+    app = create_app({"TESTING": True})
+
+    with app.test_client() as client:
+        rv = get_community(client, {"X-Biit-Profile": ""})
+
+    assert "X-Biit-Profile-Top" not in rv.headers
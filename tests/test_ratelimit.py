@@ -0,0 +1,218 @@
+from threading import Event, Thread
+from unittest.mock import MagicMock
+
+import pytest
+from biit_server import create_app
+from biit_server.kvstore import MemoryStore, RedisStore
+from biit_server.ratelimit import LocalBuckets, SharedBuckets
+
+
+def test_ratelimit_local_buckets():
+    """
+    Tests that a bucket allows its burst then asks the caller to wait
+    """
+    buckets = LocalBuckets()
+
+    assert buckets.take("caller", 1.0, 2) == 0
+    assert buckets.take("caller", 1.0, 2) == 0
+    assert buckets.take("caller", 1.0, 2) > 0
+    assert buckets.take("other", 1.0, 2) == 0
+
+
+def test_ratelimit_shared_buckets():
+    """
+    Tests that limits kept in a shared store apply to every instance using it
+    """
+    store = MemoryStore()
+    first = SharedBuckets(store)
+    second = SharedBuckets(store)
+
+    assert first.take("caller", 1.0, 2) == 0
+    assert second.take("caller", 1.0, 2) == 0
+    assert first.take("caller", 1.0, 2) > 0
+
+
+def test_ratelimit_shared_buckets_bypassed_when_down():
+    """
+    Tests that the limits of the process apply while the shared store fails
+    """
+    store = MagicMock()
+    store.incr.side_effect = ConnectionError("down")
+    buckets = SharedBuckets(store)
+
+    assert buckets.take("caller", 1.0, 2) == 0
+    assert buckets.take("caller", 1.0, 2) == 0
+    assert buckets.take("caller", 1.0, 2) > 0
+    assert store.incr.call_count == 1
+    assert not buckets.enabled
+
+
+def test_ratelimit_refund():
+    """
+    Tests that a request rejected by one bucket does not use up the others
+    """
+    app = create_app(
+        {
+            "TESTING": True,
+            "RATELIMIT_CALLER": (0.001, 2),
+            "RATELIMIT_ROUTES": {"/community": (0.001, 1)},
+        }
+    )
+
+    with app.test_client() as client:
+        statuses = [
+            client.get("/community", query_string={"token": "a"}).status_code
+            for _ in range(3)
+        ]
+        other = client.get("/account", query_string={"token": "a"})
+
+    assert statuses == [400, 429, 429]
+    assert other.status_code == 400
+
+
+def test_ratelimit_batch_weight():
+    """
+    Tests that a batch takes one token per operation
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_CALLER": (0.001, 5)})
+    # operations without a path are refused before the token is refreshed
+    operations = [{}] * 3
+
+    with app.test_client() as client:
+        first = client.post("/batch", json={"token": "a", "operations": operations})
+        second = client.post("/batch", json={"token": "a", "operations": operations})
+        single = client.post("/batch", json={"token": "a", "operations": [{}]})
+        after = client.post("/batch", json={"token": "a", "operations": [{}]})
+
+    assert first.status_code == 400
+    assert second.status_code == 429
+    assert single.status_code == 400
+    assert after.status_code == 400
+
+
+def test_ratelimit_caller():
+    """
+    Tests that a caller over its limit gets a 429 with Retry-After before the handler runs
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_CALLER": (1.0, 2)})
+
+    with app.test_client() as client:
+        statuses = [
+            client.get("/account", query_string={"token": "a"}).status_code
+            for _ in range(3)
+        ]
+        other = client.get("/account", query_string={"token": "b"})
+        metrics = client.get("/metrics")
+        rv = client.get("/account", query_string={"token": "a"})
+
+    assert statuses == [400, 400, 429]
+    assert other.status_code == 400
+    assert metrics.status_code == 200
+    assert rv.status_code == 429
+    assert int(rv.headers["Retry-After"]) >= 1
+
+
+def test_ratelimit_address():
+    """
+    Tests that rotating tokens or forged forwarded addresses does not get a
+    client past the limit of the address the proxy saw
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_ADDRESS": (1.0, 2)})
+
+    with app.test_client() as client:
+        statuses = [
+            client.get(
+                "/account",
+                query_string={"token": str(i)},
+                headers={"X-Forwarded-For": f"10.0.0.{i}, 192.0.2.1"},
+            ).status_code
+            for i in range(3)
+        ]
+        other = client.get("/account", headers={"X-Forwarded-For": "192.0.2.2"})
+
+    assert statuses == [400, 400, 429]
+    assert other.status_code == 400
+
+
+def test_ratelimit_local_buckets_eviction():
+    """
+    Tests that new keys past the cap evict the least recently used bucket only
+    """
+    buckets = LocalBuckets(max_keys=2)
+    buckets.take("a", 1.0, 1)
+    buckets.take("b", 1.0, 1)
+    buckets.take("a", 1.0, 1)
+    buckets.take("c", 1.0, 1)
+
+    assert list(buckets._buckets) == ["a", "c"]
+
+
+def test_ratelimit_redis_incr():
+    """
+    Tests that redis counters get their expiry when created, in one transaction
+    """
+    client = MagicMock()
+    pipe = client.pipeline.return_value
+    pipe.execute.return_value = [True, 1]
+
+    assert RedisStore(client=client).incr("k", ttl=1.5) == 1
+    client.pipeline.assert_called_once_with(transaction=True)
+    pipe.set.assert_called_once_with("biit:k", 0, px=1500, nx=True)
+    pipe.incrby.assert_called_once_with("biit:k", 1)
+
+
+def test_ratelimit_route():
+    """
+    Tests that a route limit applies to all callers together
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_ROUTES": {"/community": (1.0, 1)}})
+
+    with app.test_client() as client:
+        first = client.get("/community", query_string={"email": "a@purdue.edu"})
+        second = client.get("/community", query_string={"email": "b@purdue.edu"})
+
+    assert first.status_code == 400
+    assert second.status_code == 429
+
+
+def test_ratelimit_concurrency():
+    """
+    Tests that requests over the concurrency cap are shed
+    """
+    app = create_app({"TESTING": True, "RATELIMIT_MAX_CONCURRENT": 1})
+    entered = Event()
+    release = Event()
+
+    @app.route("/test/slow")
+    def slow_route():
+        entered.set()
+        release.wait(5)
+        return "done"
+
+    results = []
+    client = app.test_client()
+    thread = Thread(target=lambda: results.append(app.test_client().get("/test/slow")))
+    thread.start()
+    entered.wait(5)
+    shed = client.get("/test/slow", headers={"X-Forwarded-For": "10.0.0.2"})
+    release.set()
+    thread.join()
+    after = client.get("/test/slow", headers={"X-Forwarded-For": "10.0.0.3"})
+
+    assert results[0].status_code == 200
+    assert shed.status_code == 429
+    assert after.status_code == 200
+
+
+def test_ratelimit_disabled():
+    """
+    Tests that admission control can be turned off
+    """
+    app = create_app(
+        {"TESTING": True, "RATELIMIT_ENABLED": False, "RATELIMIT_CALLER": (1.0, 1)}
+    )
+
+    with app.test_client() as client:
+        statuses = {client.get("/community").status_code for _ in range(3)}
+
+    assert statuses == {400}
@@ -0,0 +1,128 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from benchmarks.fakes import FakeAzure, FakeStorage, installed
+from biit_server import create_app, retry
+from biit_server.database import Database
+from biit_server.deadline import deadline
+from biit_server.errors import BackendUnavailable, is_retryable
+from biit_server.metrics import BACKEND_GIVEUPS, BACKEND_RETRIES
+
+
+class ServiceUnavailable(Exception):
+    """Named like the error of grpc UNAVAILABLE"""
+
+
+class InternalServerError(Exception):
+    """Named like the error of grpc INTERNAL"""
+
+
+class AlreadyExists(Exception):
+    """Named like the error of grpc ALREADY_EXISTS"""
+
+
+@pytest.fixture(autouse=True)
+def no_sleep():
+    retry._budget.reset()
+    with patch("biit_server.retry.time.sleep") as sleep:
+        yield sleep
+    retry._budget.reset()
+
+
+def test_retry_is_retryable():
+    """
+    Tests that only temporary errors are retried, and that calls which are not
+    idempotent are only retried when the backend refused them
+    """
+    assert is_retryable(ServiceUnavailable())
+    assert is_retryable(ServiceUnavailable(), idempotent=False)
+    assert is_retryable(InternalServerError())
+    assert not is_retryable(InternalServerError(), idempotent=False)
+    assert not is_retryable(AlreadyExists())
+    assert not is_retryable(BackendUnavailable())
+
+
+def test_retry_succeeds_after_transient_errors(no_sleep):
+    """
+    Tests that a call failing with retryable errors is retried with a jittered backoff
+    """
+    function = MagicMock(side_effect=[ServiceUnavailable(), ServiceUnavailable(), 1])
+    before = BACKEND_RETRIES.collect().get(("firestore", "ServiceUnavailable"), 0)
+
+    assert retry.with_retries("firestore", function, "a") == 1
+    assert function.call_count == 3
+    assert no_sleep.call_count == 2
+    assert all(
+        0 <= call.args[0] <= retry.RETRY_MAX_BACKOFF for call in no_sleep.mock_calls
+    )
+    assert BACKEND_RETRIES.collect()[("firestore", "ServiceUnavailable")] == before + 2
+
+
+def test_retry_gives_up():
+    """
+    Tests that a call is made at most RETRY_ATTEMPTS times, and that other errors are not retried
+    """
+    function = MagicMock(side_effect=ServiceUnavailable())
+    before = BACKEND_GIVEUPS.collect().get(("gcs", "attempts"), 0)
+
+    with pytest.raises(BackendUnavailable):
+        retry.with_retries("gcs", function)
+    assert function.call_count == retry.RETRY_ATTEMPTS
+    assert BACKEND_GIVEUPS.collect()[("gcs", "attempts")] == before + 1
+
+    function = MagicMock(side_effect=AlreadyExists())
+    with pytest.raises(AlreadyExists):
+        retry.with_retries("firestore", function, idempotent=False)
+    assert function.call_count == 1
+
+
+def test_retry_budget():
+    """
+    Tests that retries stop once the budget of the process is spent
+    """
+    budget = retry.RetryBudget(ratio=0.5, minimum=1)
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+    function = MagicMock(side_effect=ServiceUnavailable())
+    with patch.object(retry, "_budget", retry.RetryBudget(ratio=0, minimum=1)):
+        with pytest.raises(BackendUnavailable):
+            retry.with_retries("firestore", function)
+        assert function.call_count == 2
+        with pytest.raises(BackendUnavailable):
+            retry.with_retries("firestore", function)
+        assert function.call_count == 3
+
+
+def test_retry_respects_deadline():
+    """
+    Tests that no retry is made when the deadline would pass during the backoff
+    """
+    function = MagicMock(side_effect=ServiceUnavailable())
+    with deadline(0.5), patch.object(retry, "backoff", return_value=1.0):
+        with pytest.raises(BackendUnavailable):
+            retry.with_retries("firestore", function)
+    assert function.call_count == 1
+
+
+def test_retry_database_unavailable_answers_503():
+    """
+    Tests that a firestore outage is answered with a 503 instead of a 400
+    """
+    firestore_client = MagicMock()
+    document = firestore_client.collection.return_value.document.return_value
+    document.get.side_effect = ServiceUnavailable()
+    app = create_app({"TESTING": True, "RATELIMIT_ENABLED": False})
+
+    with installed(firestore_client, FakeStorage(), FakeAzure()):
+        assert Database("communities").get("TestCommunity") is False
+        with app.test_client() as client:
+            rv = client.get(
+                "/community",
+                query_string={"name": "TestCommunity", "token": "refresh"},
+            )
+
+    assert rv.status_code == 503
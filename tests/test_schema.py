@@ -0,0 +1,121 @@
+import io
+import pytest
+from biit_server import create_app
+from biit_server.schema import Field, Schema, query
+from unittest.mock import patch
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+
+@pytest.fixture
+def client():
+    cli = create_app()
+    cli.config["TESTING"] = True
+    with cli.test_client() as client:
+        yield client
+
+
+def test_schema_check():
+    """
+    Tests that a schema reports missing, mistyped, oversized and unknown fields
+    """
+    update = Schema(Field("mpm", int, required=False), allow_extra=False)
+    schema = Schema(
+        Field("name", max_length=4),
+        Field("Admins", list, required=False, items=str),
+        Field("updateFields", dict, required=False, min_items=1, items=update),
+    )
+
+    assert schema.check({"name": "abc", "other": 1}) is None
+    assert schema.check({}) == "Missing field name in request"
+    assert schema.check({"name": 1}) == "Field name must be a string"
+    assert schema.check({"name": "abcde"}) == "Field name is too long"
+    assert schema.check({"name": "a", "Admins": ["a", 1]}) is not None
+    assert schema.check({"name": "a", "updateFields": {}}) is not None
+    assert schema.check({"name": "a", "updateFields": {"mpm": True}}) is not None
+    assert schema.check({"name": "a", "updateFields": {"Members": []}}) == (
+        "Unknown field Members"
+    )
+    assert schema.check({"name": "a", "updateFields": {"mpm": 3}}) is None
+
+    assert query(Field("name")).validate({}) == (
+        "Bad Request: Missing query parameter name",
+        400,
+    )
+
+
+def test_schema_update_whitelist(client):
+    """
+    Tests that a PUT cannot change fields outside its whitelist
+    """
+    with patch("biit_server.community_handler.azure_refresh_token"), patch(
+        "biit_server.community_handler.Database"
+    ) as mock_database:
+        rv = client.put(
+            "/community",
+            query_string={"name": "a", "email": "a@purdue.edu", "token": "t"},
+            json={"updateFields": {"Members": ["me@purdue.edu"]}},
+        )
+
+        assert rv.status_code == 400
+        assert b"Unknown field Members" in rv.data
+        mock_database.return_value.update.assert_not_called()
+
+        # the old literal syntax in the query string is no longer evaluated
+        rv = client.put(
+            "/community",
+            query_string={
+                "name": "a",
+                "email": "a@purdue.edu",
+                "token": "t",
+                "updateFields": "{'mpm': 1}",
+            },
+        )
+
+        assert rv.status_code == 400
+        mock_database.return_value.update.assert_not_called()
+
+
+def test_schema_body_too_large(client):
+    """
+    Tests that an oversized body is refused before it is parsed
+    """
+    with patch("biit_server.schema.Schema.validate") as mock_validate:
+        rv = client.post(
+            "/community/a/join",
+            data=b"{" + b" " * 32 * 1024 + b"}",
+            content_type="application/json",
+        )
+
+        assert rv.status_code == 413
+        mock_validate.assert_not_called()
+
+
+def test_schema_chunked_body_too_large():
+    """
+    Tests that a body without a Content-Length is read no further than the limit
+    """
+
+    class Endless(io.RawIOBase):
+        read_bytes = 0
+
+        def readable(self):
+            return True
+
+        def readinto(self, buffer):
+            buffer[:] = b" " * len(buffer)
+            Endless.read_bytes += len(buffer)
+            return len(buffer)
+
+    app = create_app({"TESTING": True})
+    environ = EnvironBuilder(
+        path="/community/a/join", method="POST", content_type="application/json"
+    ).get_environ()
+    # a chunked request, the test client always sets a length
+    environ.pop("CONTENT_LENGTH", None)
+    environ["wsgi.input"] = io.BufferedReader(Endless())
+    environ["wsgi.input_terminated"] = True
+
+    body, status, headers = run_wsgi_app(app, environ)
+
+    assert status.startswith("413")
+    assert Endless.read_bytes < 64 * 1024
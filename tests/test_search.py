@@ -0,0 +1,147 @@
+import pytest
+from benchmarks.fakes import FakeAzure, FakeFirestore, FakeStorage, installed
+from biit_server import create_app
+from biit_server.search import (
+    index_entry,
+    index_terms,
+    matches,
+    normalize,
+    reindex,
+    search_term,
+)
+
+
+@pytest.fixture
+def firestore_client():
+    firestore_client = FakeFirestore()
+    with installed(firestore_client, FakeStorage(), FakeAzure()):
+        yield firestore_client
+
+
+@pytest.fixture
+def client():
+    cli = create_app({"TESTING": True, "RATELIMIT_ENABLED": False})
+    with cli.test_client() as client:
+        yield client
+
+
+def create(client, name, meettype="Online"):
+    community = {
+        "name": name,
+        "codeofconduct": "be nice",
+        "Admins": ["a@purdue.edu"],
+        "Members": ["a@purdue.edu"],
+        "mpm": 1,
+        "meettype": meettype,
+        "token": "refresh",
+    }
+    return client.post("/community", json=community)
+
+
+def search(client, q, **args):
+    return client.get(
+        "/community/search", query_string={"q": q, "token": "refresh", **args}
+    )
+
+
+def test_search_terms():
+    """
+    Tests that names are found by the prefixes of each of their words,
+    whatever their case and accents
+    """
+    assert normalize("Café  Swim-Club!") == "cafe swim club"
+    assert index_terms("Swim Club") == [
+        "s",
+        "sw",
+        "swi",
+        "swim",
+        "swim c",
+        "swim cl",
+        "swim clu",
+        "swim club",
+        "c",
+        "cl",
+        "clu",
+        "club",
+    ]
+    assert search_term(" SWIM   c") == "swim c"
+    assert len(search_term("a" * 100)) == 20
+    assert matches("Purdue Swim Club", "swim club")
+    assert not matches("Purdue Swim Club", "wim")
+
+
+def test_search_follows_writes(client, firestore_client):
+    """
+    Tests that creating, changing and deleting communities keeps the index current
+    """
+    assert create(client, "Purdue Swim Club").status_code == 200
+    assert create(client, "Swimming Lessons", meettype="Pool").status_code == 200
+    assert create(client, "Chess").status_code == 200
+    assert create(client, "Chess").status_code == 400
+
+    rv = search(client, "swim")
+    assert [c["name"] for c in rv.get_json()["data"]] == [
+        "Purdue Swim Club",
+        "Swimming Lessons",
+    ]
+
+    client.put(
+        "/community",
+        query_string={"name": "Chess", "email": "a@purdue.edu", "token": "refresh"},
+        json={"updateFields": {"meettype": "Library"}},
+    )
+    assert search(client, "ch").get_json()["data"] == [
+        {"name": "Chess", "meettype": "Library", "mpm": 1, "members": 1}
+    ]
+
+    client.delete(
+        "/community",
+        query_string={"name": "Chess", "email": "a@purdue.edu", "token": "refresh"},
+    )
+    assert search(client, "ch").get_json()["data"] == []
+    assert set(firestore_client.data["community_search"]) == {
+        "Purdue Swim Club",
+        "Swimming Lessons",
+    }
+
+
+def test_search_pages(client, firestore_client):
+    """
+    Tests that a search reads one bounded page per query
+    """
+    for name in ("Run A", "Run B", "Run C"):
+        create(client, name)
+    queries = firestore_client.backend.calls["firestore.query"]
+
+    first = search(client, "run", limit=2).get_json()
+    second = search(client, "run", limit=2, cursor=first["next_cursor"]).get_json()
+
+    assert [c["name"] for c in first["data"]] == ["Run A", "Run B"]
+    assert [c["name"] for c in second["data"]] == ["Run C"]
+    assert second["next_cursor"] is None
+    assert firestore_client.backend.calls["firestore.query"] == queries + 2
+
+
+def test_search_validation(client, firestore_client):
+    """
+    Tests that searches without words, and bad limits and cursors are rejected
+    """
+    assert search(client, "!!").status_code == 400
+    assert search(client, "run", limit=0).status_code == 400
+    assert search(client, "run", limit=51).status_code == 400
+    assert search(client, "run", cursor="nope").status_code == 400
+    assert client.get("/community/search", query_string={"q": "a"}).status_code == 400
+
+
+def test_search_reindex(firestore_client):
+    """
+    Tests that communities created before the index are indexed
+    """
+    firestore_client.collection("communities").document("Old Club")._set(
+        {"name": "Old Club", "meettype": "Online"}
+    )
+
+    assert reindex(firestore_client) == 1
+    assert firestore_client.data["community_search"]["Old Club"][0] == index_entry(
+        {"name": "Old Club", "meettype": "Online"}
+    )
@@ -0,0 +1,182 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+import pytest
+from benchmarks.fakes import FakeFirestore
+from biit_server.azure import azure_refresh_token
+from biit_server.database import Database
+from biit_server.kvstore import MemoryStore, RedisStore, decode_versioned
+from biit_server.shared_cache import (
+    SharedCache,
+    document_key,
+    installed,
+    token_key,
+    unseal,
+    version_of,
+)
+from google.protobuf.timestamp_pb2 import Timestamp
+
+
+@pytest.fixture
+def shared():
+    with installed(SharedCache(MemoryStore())) as shared:
+        yield shared
+
+
+@pytest.fixture
+def firestore_client():
+    firestore_client = FakeFirestore()
+    firestore_client.collection("communities").document("a")._set({"name": "a"})
+    firestore_client.collection("communities").document("b")._set({"name": "b"})
+    return firestore_client
+
+
+def test_shared_cache_versioned_set():
+    """
+    Tests that an entry is only replaced by a newer version
+    """
+    store = MemoryStore()
+
+    assert store.set_versioned("k", "new", 2.0)
+    assert not store.set_versioned("k", "old", 1.0)
+    assert not store.set_versioned("k", "same", 2.0)
+    assert decode_versioned(store.get("k")) == (2.0, "new")
+    assert store.set_versioned("k", "newer", 3.0, ttl=10)
+    assert [decode_versioned(raw)[1] for raw in store.mget(["k", "x"])] == [
+        "newer",
+        None,
+    ]
+
+
+def test_shared_cache_redis_store():
+    """
+    Tests that the redis store compares versions on the server and reads several keys at once
+    """
+    client = MagicMock()
+    client.eval.return_value = 1
+    store = RedisStore(client=client)
+
+    assert store.set_versioned("k", "v", 2.5, ttl=1)
+    store.mget(["a", "b"])
+
+    _, keys, key, version, value, px = client.eval.call_args.args
+    assert (keys, key, version, value, px) == (1, "biit:k", "2.5", "2.5|v", "1000")
+    client.mget.assert_called_once_with(["biit:a", "biit:b"])
+
+
+def test_shared_cache_database_get(shared, firestore_client):
+    """
+    Tests that a document read by one instance is served to the others from the
+    shared tier, and that a write keeps older versions out of it
+    """
+    Database("communities", firestore_client).get("a")
+    copy = Database("communities", firestore_client).get("a")
+
+    assert copy.to_dict() == {"name": "a"}
+    assert firestore_client.backend.calls["firestore.get"] == 1
+
+    Database("communities", firestore_client).update("a", {"name": "A"})
+    fresh = Database("communities", firestore_client).get("a")
+
+    assert fresh.to_dict() == {"name": "A"}
+    assert firestore_client.backend.calls["firestore.get"] == 2
+
+
+def test_shared_cache_database_get_many(shared, firestore_client):
+    """
+    Tests that several documents are read with one call to each tier
+    """
+    community_db = Database("communities", firestore_client)
+    community_db.get("a")
+
+    snapshots = community_db.get_many(["a", "b", "missing"])
+
+    assert [s.to_dict() if s.exists else None for s in snapshots] == [
+        {"name": "a"},
+        {"name": "b"},
+        None,
+    ]
+    assert firestore_client.backend.calls["firestore.get_all"] == 1
+    assert community_db.get("b").to_dict() == {"name": "b"}
+    assert firestore_client.backend.calls["firestore.get"] == 1
+
+
+def test_shared_cache_version_of():
+    """
+    Tests that versions are read from protobuf Timestamps, which
+    google-cloud-firestore 1.x gives, as well as from datetimes
+    """
+    written = datetime(2020, 1, 1, 0, 0, 1, 500000, tzinfo=timezone.utc)
+    timestamp = Timestamp(seconds=int(written.timestamp()), nanos=500000000)
+
+    assert version_of(timestamp) == written.timestamp()
+    assert version_of(written) == written.timestamp()
+    assert version_of(None) is None
+
+
+def test_shared_cache_protobuf_update_time(shared, firestore_client):
+    """
+    Tests that documents whose update_time is a protobuf Timestamp are read and cached
+    """
+    snapshot = firestore_client.collection("communities").document("a").get()
+    snapshot.update_time = Timestamp(seconds=1577836800, nanos=1000)
+    communities = Database("communities", firestore_client)
+
+    with patch.object(communities.collection_ref, "document") as document:
+        document.return_value.get.return_value = snapshot
+        assert communities.get("a").to_dict() == {"name": "a"}
+
+    assert shared.get(document_key("communities", "a"))["data"] == {"name": "a"}
+
+
+def test_shared_cache_write_tombstone(shared, firestore_client):
+    """
+    Tests that a write leaves a tombstone versioned with the time Firestore
+    gave the write, which keeps older versions out but not newer ones
+    """
+    communities = Database("communities", firestore_client)
+    old = firestore_client.collection("communities").document("a").get()
+
+    communities.set("a", {"name": "new"})
+    new = firestore_client.collection("communities").document("a").get()
+    raw = shared.store.get(document_key("communities", "a"))
+
+    assert decode_versioned(raw) == (version_of(new.update_time), "")
+    assert not shared.set(
+        document_key("communities", "a"), {}, version_of(old.update_time)
+    )
+
+
+def test_shared_cache_bypassed_when_down(firestore_client):
+    """
+    Tests that reads go to Firestore while the shared store fails
+    """
+    store = MagicMock()
+    store.mget.side_effect = ConnectionError("down")
+    with installed(SharedCache(store)) as shared:
+        first = Database("communities", firestore_client).get("a")
+        second = Database("communities", firestore_client).get("a")
+
+    assert first.to_dict() == second.to_dict() == {"name": "a"}
+    assert store.mget.call_count == 1
+    assert not shared.enabled
+
+
+def test_shared_cache_token_refresh(shared):
+    """
+    Tests that a token refreshed by one instance is not refreshed again by another
+    """
+    with patch(
+        "biit_server.azure._refresh", return_value=("access", "refresh")
+    ) as refresh:
+        assert azure_refresh_token("token") == ("access", "refresh")
+        assert azure_refresh_token("token") == ("access", "refresh")
+
+    refresh.assert_called_once_with("token")
+    assert not any("token" in key for key in shared.store._data)
+    # the tokens are sealed with the refresh token, not stored readable
+    stored = repr(shared.store._data)
+    assert "access" not in stored and "refresh" not in stored
+    sealed = shared.get(token_key("token"))
+    assert unseal("token", sealed) == ["access", "refresh"]
+    assert unseal("other", sealed) is None
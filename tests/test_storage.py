@@ -0,0 +1,33 @@
+from benchmarks.fakes import FakeStorage
+from biit_server.storage import Storage
+
+
+def test_storage_missing_blob_cached():
+    """
+    Tests that a missing blob is only looked up once, until it is added
+    """
+    storage_client = FakeStorage()
+    profiles = Storage("biit_profiles", storage_client=storage_client)
+
+    assert profiles.get("missing.jpg") is False
+    assert profiles.get("missing.jpg") is False
+    assert storage_client.backend.calls["gcs.get_blob"] == 1
+
+    profiles.add(b"jpg", "missing.jpg")
+
+    assert profiles.get("missing.jpg") == "anBn"
+    assert storage_client.backend.calls["gcs.get_blob"] == 2
+
+
+def test_storage_missing_blob_per_client():
+    """
+    Tests that a not found answer of one client is not used by another one
+    """
+    Storage("biit_profiles", storage_client=FakeStorage()).get("other.jpg")
+    storage_client = FakeStorage()
+
+    assert (
+        Storage("biit_profiles", storage_client=storage_client).get("other.jpg")
+        is False
+    )
+    assert storage_client.backend.calls["gcs.get_blob"] == 1
@@ -0,0 +1,142 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from benchmarks.fakes import FakeAzure, FakeFirestore, FakeStorage, Latency, installed
+from biit_server import create_app
+from biit_server.summaries import (
+    MEMBER_SHARDS,
+    read_summaries,
+    rebuild,
+    shard_ids,
+    update_members,
+)
+
+
+@pytest.fixture
+def firestore_client():
+    firestore_client = FakeFirestore()
+    with installed(firestore_client, FakeStorage(), FakeAzure()):
+        yield firestore_client
+
+
+@pytest.fixture
+def client(firestore_client):
+    cli = create_app({"TESTING": True, "RATELIMIT_ENABLED": False})
+    with cli.test_client() as client:
+        client.post(
+            "/community",
+            json={
+                "name": "Chess",
+                "codeofconduct": "be nice",
+                "Admins": ["a@purdue.edu"],
+                "Members": ["a@purdue.edu"],
+                "mpm": 2,
+                "meettype": "Library",
+                "token": "refresh",
+            },
+        )
+        yield client
+
+
+def test_summaries_follow_membership(client, firestore_client):
+    """
+    Tests that joins, leaves and bans keep the member count current, each in
+    one batch with the change of the members
+    """
+    commits = firestore_client.backend.calls["firestore.commit"]
+    for email in ("b@purdue.edu", "c@purdue.edu", "d@purdue.edu"):
+        client.post("/community/Chess/join", json={"email": email, "token": "r"})
+    client.post("/community/Chess/leave", json={"email": "b@purdue.edu", "token": "r"})
+    client.post("/community/Chess/leave", json={"email": "x@purdue.edu", "token": "r"})
+    client.post(
+        "/ban",
+        json={
+            "banner": "a@purdue.edu",
+            "bannee": "c@purdue.edu",
+            "community": "Chess",
+            "token": "r",
+        },
+    )
+
+    assert read_summaries(["Chess", "Go"]) == [
+        {"name": "Chess", "meettype": "Library", "mpm": 2, "members": 2},
+        None,
+    ]
+    # leaving a community one is not a member of writes nothing
+    assert firestore_client.backend.calls["firestore.commit"] == commits + 5
+    assert firestore_client.data["communities"]["Chess"][0]["bans"] == [
+        {"name": "c@purdue.edu", "ordered_by": "a@purdue.edu"}
+    ]
+
+
+def test_summaries_concurrent_membership():
+    """
+    Tests that concurrent joins and leaves of different members all change
+    the members and the member count, in step, and that repeated ones do not
+    """
+    firestore_client = FakeFirestore(Latency(base_ms=1))
+    firestore_client.collection("communities").document("Go")._set(
+        {"name": "Go", "Members": ["a", "d"]}
+    )
+    rebuild(firestore_client)
+    changes = [("b", True), ("c", True), ("a", False), ("e", True), ("d", False)]
+
+    with installed(firestore_client, FakeStorage(), FakeAzure()):
+        with ThreadPoolExecutor(max_workers=len(changes)) as pool:
+            results = list(pool.map(lambda c: update_members("Go", *c), changes))
+        repeated = [update_members("Go", *change) for change in changes]
+        counted = read_summaries(["Go"])[0]["members"]
+
+    members = firestore_client.data["communities"]["Go"][0]["Members"]
+    assert sorted(members) == ["b", "c", "e"]
+    assert all(changed for _, changed in results)
+    assert not any(changed for _, changed in repeated)
+    assert counted == 3
+
+
+def test_summaries_follow_community(client, firestore_client):
+    """
+    Tests that changing and deleting a community changes its summary, and that
+    a community created again with the same name starts from its own members
+    """
+    client.put(
+        "/community",
+        query_string={"name": "Chess", "email": "a@purdue.edu", "token": "r"},
+        json={"updateFields": {"mpm": 5, "codeofconduct": "be quiet"}},
+    )
+    assert read_summaries(["Chess"])[0]["mpm"] == 5
+
+    client.post("/community/Chess/join", json={"email": "b@purdue.edu", "token": "r"})
+    client.delete(
+        "/community",
+        query_string={"name": "Chess", "email": "a@purdue.edu", "token": "r"},
+    )
+    assert read_summaries(["Chess"]) == [None]
+    assert not firestore_client.data["community_member_shards"]
+
+
+def test_summaries_read_in_two_calls(client, firestore_client):
+    """
+    Tests that the summaries of a page of communities are read with one call
+    for the summaries and one for every shard
+    """
+    calls = firestore_client.backend.calls["firestore.get_all"]
+
+    read_summaries(["Chess", "Go", "Poker"])
+
+    assert firestore_client.backend.calls["firestore.get_all"] == calls + 2
+    assert len(shard_ids("Chess")) == MEMBER_SHARDS
+
+
+def test_summaries_rebuild(firestore_client):
+    """
+    Tests that communities created before summaries are summarized
+    """
+    firestore_client.collection("communities").document("Go")._set(
+        {"name": "Go", "meettype": "Online", "mpm": 1, "Members": ["a", "b"]}
+    )
+
+    assert rebuild(firestore_client) == 1
+    assert read_summaries(["Go"], firestore_client) == [
+        {"name": "Go", "meettype": "Online", "mpm": 1, "members": 2}
+    ]
@@ -0,0 +1,52 @@
+from threading import Event
+from unittest.mock import MagicMock, patch
+
+from biit_server import tasks
+from biit_server.tasks import TASKS, BackgroundExecutor
+
+
+def test_tasks_retry_and_drain():
+    """
+    Tests that a failing task is retried and drain waits for queued tasks
+    """
+    executor = BackgroundExecutor(workers=1, retries=2, backoff=0)
+    flaky = MagicMock(side_effect=[Exception("unavailable"), None])
+    broken = MagicMock(side_effect=Exception("gone"))
+    failed = TASKS.collect().get(("failed",), 0)
+
+    assert executor.submit(flaky, "a@purdue.edu.jpg")
+    assert executor.submit(broken)
+    assert executor.drain(5)
+
+    assert flaky.call_count == 2
+    flaky.assert_called_with("a@purdue.edu.jpg")
+    assert broken.call_count == 3
+    assert TASKS.collect().get(("failed",), 0) - failed == 1
+    assert executor.depth() == 0
+    assert not executor.submit(flaky)
+
+
+def test_tasks_queue_limit():
+    """
+    Tests that a full queue refuses tasks and defer then runs them right away
+    """
+    executor = BackgroundExecutor(workers=1, queue_size=1, retries=0)
+    release = Event()
+    started = Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    assert executor.submit(blocker)
+    started.wait(5)
+    assert executor.submit(MagicMock())
+    assert not executor.submit(MagicMock())
+
+    task = MagicMock()
+    with patch.object(tasks, "_executor", executor):
+        tasks.defer(task, 1)
+        task.assert_called_once_with(1)
+
+    release.set()
+    assert executor.drain(5)
@@ -0,0 +1,105 @@
+import json
+import logging
+from timeit import repeat
+
+import pytest
+from biit_server import create_app, community_handler
+from biit_server.database import Database
+from biit_server.timing import RequestTimer, span, _current_timer
+from mockfirestore import MockFirestore
+from unittest.mock import patch
+
+
+@pytest.fixture
+def client():
+    cli = create_app()
+    cli.config["TESTING"] = True
+    with cli.test_client() as client:
+        yield client
+
+
+def test_timing_server_timing_header(client, caplog):
+    """
+    Tests that backend phases show up in the Server-Timing header and the request log
+    """
+    mock_db = MockFirestore()
+    mock_db.collection("communities").document("TestCommunity").set(
+        {"name": "TestCommunity"}
+    )
+
+    with patch.object(
+        community_handler, "azure_refresh_token"
+    ) as mock_azure_refresh_token, patch(
+        "biit_server.community_handler.Database",
+        lambda collection: Database(collection, firestore_client=mock_db),
+    ), caplog.at_level(
+        logging.INFO, logger="biit_server.requests"
+    ):
+        mock_azure_refresh_token.return_value = ("RefreshToken", "AccessToken")
+        rv = client.get(
+            "/community",
+            query_string={"name": "TestCommunity", "token": "dabonem"},
+            follow_redirects=True,
+        )
+
+    assert rv.status_code == 200
+
+    header = rv.headers["Server-Timing"]
+    assert 'firestore;desc="1 calls";dur=' in header
+    assert "json;" in header
+    assert "total;dur=" in header
+
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line["route"] == "/community"
+    assert line["method"] == "GET"
+    assert line["status"] == 200
+    assert line["phases"]["firestore"]["calls"] == 1
+
+
+def test_timing_disabled():
+    """
+    Tests that no header is added when timing is turned off
+    """
+    app = create_app({"TESTING": True, "TIMING_ENABLED": False})
+
+    with app.test_client() as client:
+        rv = client.get("/community")
+
+    assert "Server-Timing" not in rv.headers
+
+
+class _Noop:
+    """The cheapest context manager, the overhead of a span is measured against it"""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+def test_timing_span_overhead():
+    """
+    Tests that timing a phase costs a few times an empty context manager,
+    whatever the speed of the machine
+    """
+
+    def loop(manager):
+        for _ in range(1000):
+            with manager("firestore"):
+                pass
+
+    token = _current_timer.set(RequestTimer())
+    try:
+        # the fastest of several runs, so a busy machine does not skew either side
+        baseline = min(repeat(lambda: loop(_Noop), number=5, repeat=5))
+        spans = min(repeat(lambda: loop(span), number=5, repeat=5))
+    finally:
+        _current_timer.reset(token)
+
+    assert spans < baseline * 5
@@ -0,0 +1,99 @@
+from unittest.mock import patch
+
+import pytest
+from benchmarks.fakes import (
+    FakeDocument,
+    FakeFirestore,
+    FakeStorage,
+    backend_calls,
+    installed,
+)
+from biit_server import create_app
+from biit_server.errors import BackendUnavailable
+from biit_server.warmup import default_steps
+
+
+@pytest.fixture
+def backends():
+    firestore_client = FakeFirestore()
+    storage_client = FakeStorage()
+    firestore_client.collection("communities").document("hot")._set({"name": "hot"})
+    with installed(firestore_client, storage_client), patch.dict(
+        "os.environ", {"STAGE": "dev"}
+    ):
+        yield firestore_client, storage_client
+
+
+def test_warmup_route(backends):
+    """
+    Tests that the warm up connects every backend and reads the hottest communities once
+    """
+    app = create_app({"TESTING": True, "WARMUP_COMMUNITIES": ["hot"]})
+
+    with app.test_client() as client:
+        rv = client.get("/warmup")
+        calls = backend_calls(*backends)
+        again = client.get("/warmup")
+
+    assert rv.status_code == 200
+    assert set(rv.get_json()["steps"]) == {
+        "firestore",
+        "storage",
+        "azure",
+        "communities",
+    }
+    assert calls["firestore.get"] == 2
+    assert calls["gcs.get_bucket"] == 1
+    assert again.status_code == 200
+    assert backend_calls(*backends) == calls
+
+
+def test_warmup_failure_retried(backends):
+    """
+    Tests that a failed warm up reports 503 and is retried by the next probe
+    """
+    app = create_app({"TESTING": True})
+    failures = [Exception("channel not ready")]
+
+    def flaky():
+        if failures:
+            raise failures.pop()
+
+    app.extensions["warmup"].steps = [("firestore", flaky)]
+
+    with app.test_client() as client:
+        rv = client.get("/warmup")
+        assert rv.status_code == 503
+        assert b"firestore" in rv.data
+
+        rv = client.get("/warmup")
+        assert rv.status_code == 200
+
+
+def test_warmup_background(backends):
+    """
+    Tests that the background initializer warms the instance before the first probe
+    """
+    app = create_app({"TESTING": True, "WARMUP_BACKGROUND": True})
+
+    assert app.extensions["warmup"].wait(5)
+    with app.test_client() as client:
+        assert client.get("/warmup").status_code == 200
+
+
+def test_warmup_firestore_down(backends):
+    """
+    Tests that the warm up is not ready while Firestore cannot be read
+    """
+    app = create_app({"TESTING": True, "WARMUP_COMMUNITIES": ["hot"]})
+    down = patch.object(FakeDocument, "get", side_effect=ValueError("unreachable"))
+
+    with app.test_client() as client, down:
+        rv = client.get("/warmup")
+
+    assert rv.status_code == 503
+    assert b"firestore" in rv.data
+    with app.app_context(), down:
+        steps = dict(default_steps(app.config))
+        with pytest.raises(BackendUnavailable):
+            steps["communities"]()